@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Benchmarks the detection of moved blocks of code in the diff viewer.
+#
+# Builds files of many small functions, moves a third of them to another
+# place and times opcodes_with_metadata on the result. The moved functions
+# share lines like "return value;" and "}", which is what made the move
+# detection slow on large refactors.
+#
+#   $ ./contrib/profiling/benchmark_moves.py [num_lines ...]
+
+import os
+import sys
+import time
+
+topdir = os.path.join(os.path.dirname(__file__), "..", "..")
+sys.path.insert(0, os.path.join(topdir, 'reviewboard'))
+sys.path.insert(0, topdir)
+
+try:
+    import settings
+except ImportError:
+    sys.stderr.write(("Error: Can't find the file 'settings.py' in the " +
+                      "directory containing %r. Make sure you're running " +
+                      "from the root reviewboard directory.") % __file__)
+    sys.exit(1)
+
+
+# This must be done before we import any models
+from django.core.management import setup_environ
+setup_environ(settings)
+
+from reviewboard.diffviewer.diffutils import opcodes_with_metadata
+from reviewboard.diffviewer.myersdiff import MyersDiffer
+
+
+def make_files(num_lines):
+    """
+    Returns the lines of a file of functions, and of the same file with the
+    first third of the functions moved after the second third.
+    """
+    a = []
+
+    for i in xrange(num_lines / 4):
+        a += [
+            'int func%d() {' % i,
+            '    x = compute(%d);' % i,
+            '    return value;',
+            '}',
+        ]
+
+    block_len = len(a) / 3
+    b = a[block_len:2 * block_len] + a[:block_len] + a[2 * block_len:]
+
+    return a, b
+
+
+def benchmark(num_lines):
+    a, b = make_files(num_lines)
+    differ = MyersDiffer(a, b)
+
+    # Generate the opcodes first, so that only the move detection is timed.
+    opcodes = list(differ.get_opcodes())
+    differ.get_opcodes = lambda: iter(opcodes)
+
+    start = time.time()
+    groups = opcodes_with_metadata(differ)
+    elapsed = time.time() - start
+
+    num_moved = 0
+
+    for tag, i1, i2, j1, j2, meta in groups:
+        if tag == 'insert':
+            num_moved += len(meta.get('moved', {}))
+
+    print "%8d lines: %6d moved lines found in %.3fs" % \
+          (num_lines, num_moved, elapsed)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sizes = [int(arg) for arg in sys.argv[1:]]
+    else:
+        sizes = [2000, 8000, 20000, 50000]
+
+    for num_lines in sizes:
+        benchmark(num_lines)
@@ -383,6 +383,31 @@ class DiffSettingsForm(SiteSettingsForm):
                     "changed lines."),
         initial=5)
 
+    diffviewer_diff_engine = forms.ChoiceField(
+        label=_("Diff engine"),
+        choices=(
+            ('myers', _('Standard')),
+            ('array', _('Vectorized (requires NumPy)')),
+        ),
+        help_text=_("The implementation used to compute diffs. Both produce "
+                    "the same diffs. The vectorized engine is faster on large "
+                    "files and falls back to the standard engine if NumPy "
+                    "is not installed."))
+
+    diffviewer_line_code_tables = forms.IntegerField(
+        label=_("Files with shared line codes"),
+        min_value=0,
+        help_text=_("The number of files whose lines are kept in memory "
+                    "between diffs, so that diffs against other revisions "
+                    "of these files are faster. Set to 0 to disable."))
+
+    diffviewer_warm_up_diffsets = forms.BooleanField(
+        label=_("Warm up new diffs"),
+        help_text=_("Generates new and published diffs into the cache before "
+                    "reviewers open them. This requires the warmdiffs "
+                    "management command to run periodically."),
+        required=False)
+
     diffviewer_paginate_by = forms.IntegerField(
         label=_("Paginate by"),
         help_text=_("The number of files to display per page in the diff "
@@ -439,6 +464,9 @@ class DiffSettingsForm(SiteSettingsForm):
                 ),
                 'classes': ('wide',),
                 'fields': ('diffviewer_context_num_lines',
+                           'diffviewer_diff_engine',
+                           'diffviewer_line_code_tables',
+                           'diffviewer_warm_up_diffsets',
                            'diffviewer_paginate_by',
                            'diffviewer_paginate_orphans')
             }
@@ -3,6 +3,8 @@ import os
 
 from django.conf import settings
 from django.contrib import auth
+from django.middleware.gzip import GZipMiddleware
+from django.middleware.http import ConditionalGetMiddleware
 
 try:
     from django.core.handlers.modpython import ModPythonRequest
@@ -53,6 +55,37 @@ class CheckUpdatesRequiredMiddleware(object):
         return None
 
 
+class StreamingGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that leaves streamed responses alone.
+
+    Compressing a response reads all of its content first. Views that
+    stream their response set its "streaming" attribute to True.
+    """
+    def process_response(self, request, response):
+        if getattr(response, 'streaming', False):
+            return response
+
+        return super(StreamingGZipMiddleware, self).process_response(
+            request, response)
+
+
+class StreamingConditionalGetMiddleware(ConditionalGetMiddleware):
+    """
+    ConditionalGetMiddleware that leaves streamed responses alone.
+
+    Computing the Content-Length of a response reads all of its content
+    first. Views that stream their response set its "streaming" attribute
+    to True.
+    """
+    def process_response(self, request, response):
+        if getattr(response, 'streaming', False):
+            return response
+
+        return super(StreamingConditionalGetMiddleware,
+                     self).process_response(request, response)
+
+
 class X509AuthMiddleware(object):
     """
     Middleware that authenticates a user using the environment variables set by
@@ -117,12 +117,15 @@ defaults.update({
     'auth_x509_username_regex':            '',
     'auth_x509_autocreate_users':          False,
     'diffviewer_context_num_lines':        5,
+    'diffviewer_diff_engine':              'array',
     'diffviewer_include_space_patterns':   [],
+    'diffviewer_line_code_tables':         100,
     'diffviewer_paginate_by':              20,
     'diffviewer_paginate_orphans':         10,
     'diffviewer_syntax_highlighting':      True,
     'diffviewer_syntax_highlighting_threshold': 0,
     'diffviewer_show_trailing_whitespace': True,
+    'diffviewer_warm_up_diffsets':         False,
     'mail_send_review_mail':               False,
     'mail_send_new_user_mail':             False,
     'search_enable':                       False,
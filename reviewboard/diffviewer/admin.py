@@ -21,6 +21,7 @@ class FileDiffAdmin(admin.ModelAdmin):
 class FileDiffInline(admin.StackedInline):
     model = FileDiff
     extra = 0
+    exclude = ('diff64', 'diff_hash', 'parent_diff64', 'parent_diff_hash')
 
 
 class DiffSetAdmin(admin.ModelAdmin):
@@ -0,0 +1,553 @@
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from reviewboard.diffviewer.myersdiff import MyersDiffer
+
+
+class ArrayMyersDiffer(MyersDiffer):
+    """
+    A MyersDiffer that keeps its state in compact arrays.
+
+    Line codes and modified flags are stored in typed arrays instead of
+    lists and dictionaries, and the diagonals in NumPy arrays. The passes
+    over whole files (counting codes, discarding lines and skipping runs
+    of equal lines) and the extension of all diagonals in each step of the
+    middle snake search are vectorized with NumPy.
+
+    The opcodes are identical to the ones of MyersDiffer. This differ
+    requires NumPy, see is_available().
+    """
+
+    # Number of lines compared one by one before comparing runs of equal
+    # lines with NumPy. Most runs are short, and small comparisons are
+    # faster without the NumPy overhead.
+    VECTOR_THRESHOLD = 16
+
+    @staticmethod
+    def is_available():
+        return numpy is not None
+
+    class DiffData:
+        def __init__(self, data):
+            self.data = data
+            self.length = len(data)
+            # Two extra flags, so that the lines before the start and after
+            # the end can be looked at, like with a dictionary.
+            self.modified = array('b', [0]) * (self.length + 2)
+            self.undiscarded = array('l')
+            self.undiscarded_lines = 0
+            self.real_indexes = array('l')
+            self.vector = None
+
+    def ratio(self):
+        # Only counts the lines that are still modified after shifting the
+        # chunks, while MyersDiffer also counts lines shifted out of chunks.
+        self._gen_diff_data()
+        a_equals = self.a_data.length - self.a_data.modified.count(1)
+        b_equals = self.b_data.length - self.b_data.modified.count(1)
+
+        return 1.0 * (a_equals + b_equals) / \
+                     (self.a_data.length + self.b_data.length)
+
+    def get_opcodes(self):
+        self._gen_diff_data()
+
+        a_length = self.a_data.length
+        b_length = self.b_data.length
+        a_modified = self.a_data.modified
+        b_modified = self.b_data.modified
+
+        a_line = b_line = 0
+        last_group = None
+
+        while a_line < a_length or b_line < b_length:
+            a_start = a_line
+            b_start = b_line
+
+            if a_line < a_length and not a_modified[a_line] and \
+               b_line < b_length and not b_modified[b_line]:
+                # Equal
+                a_changed = b_changed = 1
+                tag = "equal"
+                a_line += 1
+                b_line += 1
+            else:
+                # Deleted, inserted or replaced
+                while a_line < a_length and \
+                      (b_line >= b_length or a_modified[a_line]):
+                    a_line += 1
+
+                while b_line < b_length and \
+                      (a_line >= a_length or b_modified[b_line]):
+                    b_line += 1
+
+                a_changed = a_line - a_start
+                b_changed = b_line - b_start
+
+                assert a_start < a_line or b_start < b_line
+                assert a_changed != 0 or b_changed != 0
+
+                if a_changed == 0 and b_changed > 0:
+                    tag = "insert"
+                elif a_changed > 0 and b_changed == 0:
+                    tag = "delete"
+                elif a_changed > 0 and b_changed > 0:
+                    tag = "replace"
+
+                    if a_changed != b_changed:
+                        if a_changed > b_changed:
+                            a_line -= a_changed - b_changed
+                        elif a_changed < b_changed:
+                            b_line -= b_changed - a_changed
+
+                        a_changed = b_changed = min(a_changed, b_changed)
+
+            if last_group and last_group[0] == tag:
+                last_group = (tag,
+                              last_group[1], last_group[2] + a_changed,
+                              last_group[3], last_group[4] + b_changed)
+            else:
+                if last_group:
+                    yield last_group
+
+                last_group = (tag, a_start, a_start + a_changed,
+                              b_start, b_start + b_changed)
+
+        if not last_group:
+            last_group = ("equal", 0, a_length, 0, b_length)
+
+        yield last_group
+
+    def _gen_diff_data(self):
+        if self.a_data and self.b_data:
+            return
+
+        self.a_data = self.DiffData(self._gen_diff_codes(self.a, False))
+        self.b_data = self.DiffData(self._gen_diff_codes(self.b, True))
+
+        self._discard_confusing_lines()
+
+        self.a_data.vector = self._to_vector(self.a_data.undiscarded)
+        self.b_data.vector = self._to_vector(self.b_data.undiscarded)
+
+        self.max_lines = self.a_data.undiscarded_lines + \
+                         self.b_data.undiscarded_lines + 3
+
+        vector_size = self.a_data.undiscarded_lines + \
+                      self.b_data.undiscarded_lines + 3
+        self.fdiag = numpy.zeros(vector_size, dtype=numpy.int_)
+        self.bdiag = numpy.zeros(vector_size, dtype=numpy.int_)
+        self.downoff = self.upoff = self.b_data.undiscarded_lines + 1
+
+        self._lcs(0, self.a_data.undiscarded_lines,
+                  0, self.b_data.undiscarded_lines,
+                  self.minimal_diff)
+        self._shift_chunks(self.a_data, self.b_data)
+        self._shift_chunks(self.b_data, self.a_data)
+
+    def _gen_diff_codes(self, lines, is_modified_file):
+        return array('l', MyersDiffer._gen_diff_codes(self, lines,
+                                                      is_modified_file))
+
+    def _to_vector(self, codes):
+        if len(codes) == 0:
+            return numpy.zeros(0, dtype=numpy.dtype(codes.typecode))
+
+        return numpy.frombuffer(codes, dtype=numpy.dtype(codes.typecode))
+
+    def _to_array(self, typecode, vector):
+        result = array(typecode)
+        result.fromstring(vector.astype(numpy.dtype(typecode)).tostring())
+        return result
+
+    def _count_codes(self, data):
+        return numpy.bincount(self._to_vector(data.data),
+                              minlength=1 + self.last_code)
+
+    def _build_discard_list(self, data, counts):
+        many = 5 * self._very_approx_sqrt(data.length / 64)
+        codes = self._to_vector(data.data)
+        num_matches = counts[codes]
+
+        discards = numpy.zeros(data.length, dtype=numpy.int8)
+        discards[num_matches > many] = self.DISCARD_CANCEL
+        discards[num_matches == 0] = self.DISCARD_FOUND
+        discards[codes == 0] = self.DISCARD_NONE
+
+        return self._to_array('b', discards)
+
+    def _discard_lines(self, data, discards):
+        if self.minimal_diff:
+            kept = numpy.ones(data.length, dtype=bool)
+        else:
+            kept = self._to_vector(discards) == self.DISCARD_NONE
+
+        undiscarded = self._to_vector(data.data)[kept]
+        real_indexes = numpy.flatnonzero(kept)
+        j = len(undiscarded)
+
+        # Like MyersDiffer, the unused tail of the arrays is zeroed
+        padding = numpy.zeros(data.length - j, dtype=numpy.int_)
+        data.undiscarded = self._to_array(
+            'l', numpy.concatenate((undiscarded, padding)))
+        data.real_indexes = self._to_array(
+            'l', numpy.concatenate((real_indexes, padding)))
+        data.modified = self._to_array(
+            'b', numpy.concatenate((~kept, numpy.zeros(2, dtype=bool))))
+        data.undiscarded_lines = j
+
+    def _count_equal(self, a_data, a_start, b_data, b_start, length, step):
+        """
+        Returns the number of equal undiscarded lines in a row, starting at
+        the given indexes and moving by step (1 or -1) for at most length
+        lines.
+        """
+        a = a_data.undiscarded
+        b = b_data.undiscarded
+
+        if step < 0:
+            # Looking at the lines before the start indexes
+            a_start -= 1
+            b_start -= 1
+
+        count = 0
+        limit = min(length, self.VECTOR_THRESHOLD)
+
+        while count < limit and \
+              a[a_start + step * count] == b[b_start + step * count]:
+            count += 1
+
+        if count < limit or count == length:
+            return count
+
+        # Compare growing slices, so that long runs of equal lines don't
+        # cost a Python loop iteration per line and short runs don't
+        # compare far beyond their end.
+        a_vector = a_data.vector
+        b_vector = b_data.vector
+        chunk = self.VECTOR_THRESHOLD
+
+        while count < length:
+            chunk = min(chunk * 2, length - count)
+
+            if step > 0:
+                a_slice = a_vector[a_start + count:a_start + count + chunk]
+                b_slice = b_vector[b_start + count:b_start + count + chunk]
+            else:
+                a_slice = a_vector[a_start - count - chunk + 1:
+                                   a_start - count + 1][::-1]
+                b_slice = b_vector[b_start - count - chunk + 1:
+                                   b_start - count + 1][::-1]
+
+            unequal = numpy.flatnonzero(a_slice != b_slice)
+
+            if len(unequal) > 0:
+                return count + int(unequal[0])
+
+            count += chunk
+
+        return count
+
+    def _extend_snakes(self, x, y, a_bound, b_bound, step):
+        """
+        Follows the snakes of all diagonals at once, moving x and y by step
+        (1 or -1) as long as the lines are equal and within the bounds.
+        """
+        a = self.a_data.vector
+        b = self.b_data.vector
+
+        if step > 0:
+            offset = 0
+            active = numpy.flatnonzero((x < a_bound) & (y < b_bound))
+        else:
+            offset = -1
+            active = numpy.flatnonzero((x > a_bound) & (y > b_bound))
+
+        while len(active) > 0:
+            if len(active) <= 2:
+                # Only a few long snakes are left, follow them one by one
+                for i in active:
+                    if step > 0:
+                        length = min(a_bound - x[i], b_bound - y[i])
+                    else:
+                        length = min(x[i] - a_bound, y[i] - b_bound)
+
+                    equal = self._count_equal(self.a_data, int(x[i]),
+                                              self.b_data, int(y[i]),
+                                              int(length), step)
+                    x[i] += step * equal
+                    y[i] += step * equal
+
+                break
+
+            active = active[a[x[active] + offset] == b[y[active] + offset]]
+            x[active] += step
+            y[active] += step
+
+            if step > 0:
+                active = active[(x[active] < a_bound) & (y[active] < b_bound)]
+            else:
+                active = active[(x[active] > a_bound) & (y[active] > b_bound)]
+
+    def _find_sms(self, a_lower, a_upper, b_lower, b_upper, find_minimal):
+        """
+        Finds the Shortest Middle Snake, extending all diagonals of a
+        search step at once.
+
+        Each step only reads the diagonals written by the previous step, so
+        they can be computed together. Like MyersDiffer, the overlapping
+        diagonal with the highest k wins.
+        """
+        down_vector = self.fdiag
+        up_vector = self.bdiag
+        downoff = self.downoff
+        upoff = self.upoff
+
+        down_k = a_lower - b_lower
+        up_k = a_upper - b_upper
+        odd_delta = (down_k - up_k) % 2 != 0
+
+        down_vector[downoff + down_k] = a_lower
+        up_vector[upoff + up_k] = a_upper
+
+        dmin = a_lower - b_upper
+        dmax = a_upper - b_lower
+
+        down_min = down_max = down_k
+        up_min = up_max = up_k
+
+        cost = 0
+
+        while True:
+            cost += 1
+
+            if down_min > dmin:
+                down_min -= 1
+                down_vector[downoff + down_min - 1] = -1
+            else:
+                down_min += 1
+
+            if down_max < dmax:
+                down_max += 1
+                down_vector[downoff + down_max + 1] = -1
+            else:
+                down_max -= 1
+
+            # Extend the forward paths
+            k = numpy.arange(down_max, down_min - 1, -2)
+            tlo = down_vector[downoff + k - 1]
+            thi = down_vector[downoff + k + 1]
+            x = numpy.where(tlo >= thi, tlo + 1, thi)
+            y = x - k
+            old_x = x.copy()
+
+            self._extend_snakes(x, y, a_upper, b_upper, 1)
+
+            if odd_delta:
+                overlaps = numpy.flatnonzero(
+                    (up_min <= k) & (k <= up_max) &
+                    (up_vector[upoff + k] <= x))
+
+                if len(overlaps) > 0:
+                    i = overlaps[0]
+                    return int(x[i]), int(y[i]), True, True
+
+            big_snake = (x - old_x > self.SNAKE_LIMIT).any()
+            down_vector[downoff + k] = x
+
+            # Extend the reverse paths
+            if up_min > dmin:
+                up_min -= 1
+                up_vector[upoff + up_min - 1] = self.max_lines
+            else:
+                up_min += 1
+
+            if up_max < dmax:
+                up_max += 1
+                up_vector[upoff + up_max + 1] = self.max_lines
+            else:
+                up_max -= 1
+
+            k = numpy.arange(up_max, up_min - 1, -2)
+            tlo = up_vector[upoff + k - 1]
+            thi = up_vector[upoff + k + 1]
+            x = numpy.where(tlo < thi, tlo, thi - 1)
+            y = x - k
+            old_x = x.copy()
+
+            self._extend_snakes(x, y, a_lower, b_lower, -1)
+
+            if not odd_delta:
+                overlaps = numpy.flatnonzero(
+                    (down_min <= k) & (k <= down_max) &
+                    (x <= down_vector[downoff + k]))
+
+                if len(overlaps) > 0:
+                    i = overlaps[0]
+                    return int(x[i]), int(y[i]), True, True
+
+            big_snake = big_snake or \
+                        (old_x - x > self.SNAKE_LIMIT).any()
+            up_vector[upoff + k] = x
+
+            if find_minimal:
+                continue
+
+            # Heuristics courtesy of GNU diff, see MyersDiffer._find_sms.
+            if cost > 200 and big_snake:
+                ret_x, ret_y, best = \
+                    self._find_diagonal(down_min, down_max, down_k, 0,
+                                        downoff, down_vector,
+                                        lambda x: x - a_lower,
+                                        lambda x: a_lower + self.SNAKE_LIMIT <=
+                                                  x < a_upper,
+                                        lambda y: b_lower + self.SNAKE_LIMIT <=
+                                                  y < b_upper,
+                                        lambda i,k: i - k,
+                                        1, cost)
+
+                if best > 0:
+                    return int(ret_x), int(ret_y), True, False
+
+                ret_x, ret_y, best = \
+                    self._find_diagonal(up_min, up_max, up_k, best, upoff,
+                                        up_vector,
+                                        lambda x: a_upper - x,
+                                        lambda x: a_lower < x <= a_upper -
+                                                  self.SNAKE_LIMIT,
+                                        lambda y: b_lower < y <= b_upper -
+                                                  self.SNAKE_LIMIT,
+                                        lambda i,k: i + k,
+                                        0, cost)
+
+                if best > 0:
+                    return int(ret_x), int(ret_y), False, True
+
+    def _lcs(self, a_lower, a_upper, b_lower, b_upper, find_minimal):
+        # Skip equal lines at the start and the end
+        equal = self._count_equal(self.a_data, a_lower, self.b_data, b_lower,
+                                  min(a_upper - a_lower, b_upper - b_lower),
+                                  1)
+        a_lower += equal
+        b_lower += equal
+
+        equal = self._count_equal(self.a_data, a_upper, self.b_data, b_upper,
+                                  min(a_upper - a_lower, b_upper - b_lower),
+                                  -1)
+        a_upper -= equal
+        b_upper -= equal
+
+        if a_lower == a_upper:
+            # Inserted lines.
+            modified = self.b_data.modified
+            real_indexes = self.b_data.real_indexes
+
+            for i in xrange(b_lower, b_upper):
+                modified[real_indexes[i]] = 1
+        elif b_lower == b_upper:
+            # Deleted lines
+            modified = self.a_data.modified
+            real_indexes = self.a_data.real_indexes
+
+            for i in xrange(a_lower, a_upper):
+                modified[real_indexes[i]] = 1
+        else:
+            # Find the middle snake and length of an optimal path for A and B
+            x, y, low_minimal, high_minimal = \
+                self._find_sms(a_lower, a_upper, b_lower, b_upper,
+                               find_minimal)
+
+            self._lcs(a_lower, x, b_lower, y, low_minimal)
+            self._lcs(x, a_upper, y, b_upper, high_minimal)
+
+    def _shift_chunks(self, data, other_data):
+        # The index into the other data can become negative, where the
+        # flags must read as unmodified instead of wrapping around.
+        lines = data.data
+        modified = data.modified
+        other_modified = other_data.modified
+
+        i = j = 0
+        i_end = data.length
+
+        while True:
+            # Scan forward in order to find the start of a run of changes.
+            while i < i_end and not modified[i]:
+                i += 1
+
+                while j >= 0 and other_modified[j]:
+                    j += 1
+
+            if i == i_end:
+                return
+
+            start = i
+
+            # Find the end of these changes
+            i += 1
+            while modified[i]:
+                i += 1
+
+            while j >= 0 and other_modified[j]:
+                j += 1
+
+            while True:
+                run_length = i - start
+
+                # Move the changed chunks back as long as the previous
+                # unchanged line matches the last changed line.
+                while start != 0 and lines[start - 1] == lines[i - 1]:
+                    start -= 1
+                    i -= 1
+
+                    modified[start] = 1
+                    modified[i] = 0
+
+                    while modified[start - 1]:
+                        start -= 1
+
+                    j -= 1
+                    while j >= 0 and other_modified[j]:
+                        j -= 1
+
+                if j > 0 and other_modified[j - 1]:
+                    corresponding = i
+                else:
+                    corresponding = i_end
+
+                # Move the changed region forward as long as the first
+                # changed line is the same as the following unchanged line.
+                while i != i_end and lines[start] == lines[i]:
+                    modified[start] = 0
+                    modified[i] = 1
+
+                    start += 1
+                    i += 1
+
+                    while modified[i]:
+                        i += 1
+
+                    j += 1
+                    while j >= 0 and other_modified[j]:
+                        j += 1
+                        corresponding = i
+
+                if run_length == i - start:
+                    break
+
+            # Move the fully-merged run back to a corresponding run in the
+            # other data set, if we can.
+            while corresponding < i:
+                start -= 1
+                i -= 1
+
+                modified[start] = 1
+                modified[i] = 0
+
+                j -= 1
+                while j >= 0 and other_modified[j]:
+                    j -= 1
@@ -0,0 +1,261 @@
+import marshal
+import sys
+import zlib
+from array import array
+
+from django.utils.safestring import mark_safe
+
+
+# The cached data starts with these bytes, followed by a byte of flags
+MAGIC = 'RBC'
+FORMAT_VERSION = 1
+
+# Flags
+FLAG_COMPRESSED = 1
+
+# Encoded chunks smaller than this are stored uncompressed
+COMPRESS_MIN_SIZE = 4096
+
+
+class ChunkFormatError(Exception):
+    """Data that isn't a list of chunks encoded by encode_chunks."""
+    pass
+
+
+class EncodedChunk(dict):
+    """
+    A chunk decoded by decode_chunks.
+
+    All keys of the chunk except 'lines' are set when it is decoded. The
+    lines are built from the file data the first time they are used.
+    get_lines returns part of them without building the rest.
+    """
+    def __init__(self, chunks, spec):
+        change, collapsable, vlinenum, numlines, old_start, old_count, \
+            new_start, new_count, meta, extras = spec
+
+        dict.__init__(self, {
+            'change': change,
+            'collapsable': collapsable,
+            'numlines': numlines,
+            'meta': meta,
+        })
+
+        self._chunks = chunks
+        self._vlinenum = vlinenum
+        self._old_start = old_start
+        self._old_count = old_count
+        self._new_start = new_start
+        self._new_count = new_count
+        self._extras = extras
+
+    def __missing__(self, key):
+        if key != 'lines':
+            raise KeyError(key)
+
+        lines = self.get_lines()
+        self['lines'] = lines
+
+        return lines
+
+    def get_lines(self, start=0, end=None):
+        """
+        Returns the lines of the chunk between start and end, in the form
+        of the lines of the chunks returned by get_chunks.
+        """
+        if 'lines' in self:
+            return self['lines'][start:end]
+
+        start, end, step = slice(start, end).indices(self['numlines'])
+        lines = []
+
+        for i in xrange(start, end):
+            if i < self._old_count:
+                oldlinenum = self._old_start + i
+                oldmarkup = self._chunks.get_old_markup(oldlinenum)
+            else:
+                oldlinenum = ''
+                oldmarkup = ''
+
+            if i < self._new_count:
+                newlinenum = self._new_start + i
+                newmarkup = self._chunks.get_new_markup(newlinenum)
+            else:
+                newlinenum = ''
+                newmarkup = ''
+
+            extra = self._extras.get(i)
+
+            if extra:
+                oldregion, newregion = extra[:2]
+            else:
+                oldregion = newregion = []
+
+            line = [self._vlinenum + i,
+                    oldlinenum, mark_safe(oldmarkup), oldregion,
+                    newlinenum, mark_safe(newmarkup), newregion,
+                    bool(extra and extra[2])]
+
+            if extra:
+                line.extend(extra[3:])
+
+            lines.append(line)
+
+        return lines
+
+
+class EncodedChunkList(list):
+    """
+    The list of chunks decoded by decode_chunks, which holds the markup of
+    the lines of both files.
+    """
+    def __init__(self, old_markup, old_offsets, new_markup, new_offsets):
+        list.__init__(self)
+        self._old_markup = old_markup
+        self._old_offsets = old_offsets
+        self._new_markup = new_markup
+        self._new_offsets = new_offsets
+
+    def get_old_markup(self, linenum):
+        return self._old_markup[self._old_offsets[linenum - 1]:
+                                self._old_offsets[linenum]]
+
+    def get_new_markup(self, linenum):
+        return self._new_markup[self._new_offsets[linenum - 1]:
+                                self._new_offsets[linenum]]
+
+
+def encode_chunks(chunks, compress=True):
+    """
+    Encodes the chunks returned by get_chunks into a string for the cache.
+
+    The markup of each line of both files is stored once, in one string per
+    file along with the offsets of the lines. Each chunk is stored as the
+    ranges of lines it shows, its metadata and the changed regions, moves
+    and whitespace changes of its lines. Unlike a pickle of the chunks,
+    this loads quickly and the lines of a chunk are only built when they
+    are used.
+
+    If compress is True, large data is compressed with zlib.
+    """
+    old_markup = []
+    new_markup = []
+    specs = []
+
+    for chunk in chunks:
+        lines = chunk['lines']
+        old_start = old_count = new_start = new_count = 0
+        extras = {}
+
+        for i, line in enumerate(lines):
+            if line[1]:
+                if not old_count:
+                    old_start = line[1]
+
+                old_count += 1
+                _set_line(old_markup, line[1], line[2])
+
+            if line[4]:
+                if not new_count:
+                    new_start = line[4]
+
+                new_count += 1
+                _set_line(new_markup, line[4], line[5])
+
+            if line[3] != [] or line[6] != [] or line[7] or len(line) > 8:
+                extras[i] = (line[3], line[6], line[7]) + tuple(line[8:])
+
+        if lines:
+            vlinenum = lines[0][0]
+        else:
+            vlinenum = 0
+
+        specs.append((chunk['change'], chunk.get('collapsable', False),
+                      vlinenum, len(lines), old_start, old_count,
+                      new_start, new_count, chunk.get('meta', {}), extras))
+
+    old_markup, old_offsets = _join_lines(old_markup)
+    new_markup, new_offsets = _join_lines(new_markup)
+
+    try:
+        data = marshal.dumps((FORMAT_VERSION, old_markup, old_offsets,
+                              new_markup, new_offsets, specs))
+    except ValueError, e:
+        raise ChunkFormatError("The chunks can't be encoded: %s" % e)
+
+    flags = 0
+
+    if compress and len(data) >= COMPRESS_MIN_SIZE:
+        data = zlib.compress(data)
+        flags |= FLAG_COMPRESSED
+
+    return MAGIC + chr(flags) + data
+
+
+def decode_chunks(data):
+    """
+    Decodes a string returned by encode_chunks into a list of chunks.
+    Raises ChunkFormatError if the data was encoded differently, such as
+    by an older version of encode_chunks.
+    """
+    if not isinstance(data, str) or not data.startswith(MAGIC):
+        raise ChunkFormatError("The data isn't a list of encoded chunks")
+
+    flags = ord(data[len(MAGIC)])
+    data = data[len(MAGIC) + 1:]
+
+    try:
+        if flags & FLAG_COMPRESSED:
+            data = zlib.decompress(data)
+
+        data = marshal.loads(data)
+    except (zlib.error, ValueError, EOFError, TypeError), e:
+        raise ChunkFormatError("The encoded chunks are corrupt: %s" % e)
+
+    if data[0] != FORMAT_VERSION:
+        raise ChunkFormatError("The chunks were encoded in format version %s"
+                               % data[0])
+
+    version, old_markup, old_offsets, new_markup, new_offsets, specs = data
+
+    chunks = EncodedChunkList(old_markup, _load_offsets(old_offsets),
+                              new_markup, _load_offsets(new_offsets))
+    chunks.extend([EncodedChunk(chunks, spec) for spec in specs])
+
+    return chunks
+
+
+def _set_line(lines, linenum, markup):
+    if len(lines) < linenum:
+        lines.extend([u''] * (linenum - len(lines)))
+
+    lines[linenum - 1] = markup or u''
+
+
+def _join_lines(lines):
+    """
+    Returns the lines joined into one string, and the offsets at which
+    each line starts in it, followed by the length of the string, as an
+    array of integers in little endian byte order.
+    """
+    offsets = array('I', [0])
+    offset = 0
+
+    for line in lines:
+        offset += len(line)
+        offsets.append(offset)
+
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+
+    return u''.join(lines), offsets.tostring()
+
+
+def _load_offsets(data):
+    offsets = array('I')
+    offsets.fromstring(data)
+
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+
+    return offsets
@@ -1,20 +1,31 @@
 import fnmatch
+import multiprocessing
 import os
 import re
 import subprocess
 import tempfile
+from bisect import bisect_left, bisect_right
 from difflib import SequenceMatcher
 
 import logging
 
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
+
 try:
     import pygments
     from pygments.lexers import get_lexer_for_filename
     # from pygments.lexers import guess_lexer_for_filename
     from pygments.formatters import HtmlFormatter
+    from pygments.token import Text
+    from pygments.util import ClassNotFound
 except ImportError:
     pass
 
+from django.core.cache import cache
+from django.db import connection
 from django.utils.html import escape
 from django.utils.http import urlquote
 from django.utils.safestring import mark_safe
@@ -26,12 +37,40 @@ from djblets.util.misc import cache_memoize
 
 from reviewboard.accounts.models import Profile
 from reviewboard.admin.checks import get_can_enable_syntax_highlighting
+from reviewboard.diffviewer.arraydiff import ArrayMyersDiffer
+from reviewboard.diffviewer.chunkformat import ChunkFormatError, \
+                                              FORMAT_VERSION, \
+                                              decode_chunks, encode_chunks
+from reviewboard.diffviewer.hunkpatch import PatchError, apply_patch
+from reviewboard.diffviewer.linecodes import LineCodeTableCache
+from reviewboard.diffviewer.models import FileDiff
 from reviewboard.diffviewer.myersdiff import MyersDiffer
+from reviewboard.diffviewer.patiencediff import PatienceDiffer
 from reviewboard.diffviewer.smdiff import SMDiffer
 from reviewboard.scmtools.core import PRE_CREATION, HEAD
 
 
 DEFAULT_DIFF_COMPAT_VERSION = 1
+PATIENCE_DIFF_COMPAT_VERSION = 2
+
+# New diffs are compared with the PatienceDiffer if one of their files has
+# this many changed lines, or at least PATIENCE_DIFF_MIN_REPETITIVE_LINES
+# changed lines of which this fraction repeats earlier ones.
+PATIENCE_DIFF_MIN_LINES = 20000
+PATIENCE_DIFF_MIN_REPETITIVE_LINES = 2000
+PATIENCE_DIFF_REPEATED_FRACTION = 0.5
+
+# Implementations of the Myers diff algorithm (diff compat version 1).
+# The array engine needs NumPy and falls back to the plain one without it.
+DIFF_ENGINE_MYERS = 'myers'
+DIFF_ENGINE_ARRAY = 'array'
+
+# Pygments lexer classes by file extension. See get_lexer.
+lexer_classes = {}
+
+# Line code tables shared by the differs of all revisions of a file, keyed
+# by repository and file. See get_chunks.
+line_code_tables = LineCodeTableCache()
 
 NEW_FILE_STR = _("New File")
 NEW_CHANGE_STR = _("New Change")
@@ -160,21 +199,76 @@ class NoWrapperHtmlFormatter(HtmlFormatter):
 
 
 def Differ(a, b, ignore_space=False,
-           compat_version=DEFAULT_DIFF_COMPAT_VERSION):
+           compat_version=DEFAULT_DIFF_COMPAT_VERSION,
+           engine=DIFF_ENGINE_MYERS, line_codes=None):
     """
     Factory wrapper for returning a differ class based on the compat version
     and flags specified.
+
+    The engine selects the implementation of the Myers differ. Both produce
+    the same opcodes. If given, line_codes is the LineCodeTable the differ
+    shares with others.
     """
     if compat_version == 0:
         return SMDiffer(a, b)
     elif compat_version == 1:
-        return MyersDiffer(a, b, ignore_space)
+        if engine == DIFF_ENGINE_ARRAY and ArrayMyersDiffer.is_available():
+            return ArrayMyersDiffer(a, b, ignore_space, line_codes)
+
+        return MyersDiffer(a, b, ignore_space, line_codes)
+    elif compat_version == PATIENCE_DIFF_COMPAT_VERSION:
+        return PatienceDiffer(a, b, ignore_space, line_codes)
     else:
         raise DiffCompatError(
             "Invalid diff compatibility version (%s) passed to Differ" %
                 (compat_version))
 
 
+def get_diff_line_counts(data):
+    """
+    Returns the number of changed lines in a file diff, and how many of
+    them repeat an earlier changed line.
+
+    Only these counts are needed to pick a diff compat version, so callers
+    can compute them while parsing and drop the file diff right after.
+    """
+    num_lines = 0
+    num_repeated = 0
+    seen = set()
+
+    for line in data.splitlines():
+        if (not line.startswith(('+', '-')) or
+            line.startswith(('+++ ', '--- '))):
+            continue
+
+        num_lines += 1
+
+        if line[1:] in seen:
+            num_repeated += 1
+        else:
+            seen.add(line[1:])
+
+    return num_lines, num_repeated
+
+
+def get_diff_compat_version(line_counts):
+    """
+    Returns the diff compat version to use for a new diff, given the
+    line counts of its file diffs, as returned by get_diff_line_counts.
+
+    Diffs with large or highly repetitive files, such as generated code,
+    are compared with the PatienceDiffer. The time the Myers differ needs
+    grows quickly on those.
+    """
+    for num_lines, num_repeated in line_counts:
+        if (num_lines >= PATIENCE_DIFF_MIN_LINES or
+            (num_lines >= PATIENCE_DIFF_MIN_REPETITIVE_LINES and
+             num_repeated >= num_lines * PATIENCE_DIFF_REPEATED_FRACTION)):
+            return PATIENCE_DIFF_COMPAT_VERSION
+
+    return DEFAULT_DIFF_COMPAT_VERSION
+
+
 def convert_line_endings(data):
     # Files without a trailing newline come out of Perforce (and possibly
     # other systems) with a trailing \r. Diff will see the \r and
@@ -198,8 +292,9 @@ def convert_line_endings(data):
 
 
 def patch(diff, file, filename):
-    """Apply a diff to a file.  Delegates out to `patch` because noone
-       except Larry Wall knows how to patch."""
+    """Apply a diff to a file.  Unified diffs whose hunks apply exactly are
+       applied in-process. Everything else is delegated out to `patch`
+       because noone except Larry Wall knows how to patch."""
 
     log_timer = log_timed("Patching file %s" % filename)
 
@@ -207,6 +302,14 @@ def patch(diff, file, filename):
         # Someone uploaded an unchanged file. Return the one we're patching.
         return file
 
+    try:
+        data = apply_patch(convert_line_endings(diff),
+                           convert_line_endings(file))
+        log_timer.done()
+        return data
+    except PatchError, e:
+        logging.debug("Falling back to patch for '%s': %s" % (filename, e))
+
     # Prepare the temporary directory if none is available
     tempdir = tempfile.mkdtemp(prefix='reviewboard.')
 
@@ -371,13 +474,35 @@ def get_original_file(filediff):
 
     # If there's a parent diff set, apply it to the buffer.
     if filediff.parent_diff:
-        data = patch(filediff.parent_diff, data, filediff.source_file)
+        data = get_cached_patch(filediff.parent_diff, data,
+                                filediff.source_file)
 
     return data
 
 
 def get_patched_file(buffer, filediff):
-    return patch(filediff.diff, buffer, filediff.dest_file)
+    return get_cached_patch(filediff.diff, buffer, filediff.dest_file)
+
+
+def get_cached_patch(diff, file, filename):
+    """
+    Applies a diff to a file like patch(), caching the result by the hashes
+    of the file and the diff.
+
+    The same file is shown by the diff viewer with and without syntax
+    highlighting, in interdiffs and in comment fragments. It's patched only
+    once for all of them.
+    """
+    if diff.strip() == "":
+        # Someone uploaded an unchanged file. Return the one we're patching.
+        return file
+
+    key = "patched-file:%s:%s" % (sha1(file).hexdigest(),
+                                  sha1(diff).hexdigest())
+
+    # Wrapped in a list for the same reason as in get_original_file.
+    return cache_memoize(key, lambda: [patch(diff, file, filename)],
+                         large_data=True)[0]
 
 
 def register_interesting_lines_for_filename(differ, filename):
@@ -403,29 +528,288 @@ def register_interesting_lines_for_filename(differ, filename):
         differ.add_interesting_line_regex('header', regex)
 
 
+def build_diff_line(meta, vlinenum, oldlinenum, newlinenum, oldline, newline,
+                    oldmarkup, newmarkup):
+    """
+    Returns a line of a chunk, as described in get_file_chunks_in_range.
+    meta is the metadata of the chunk's opcode from opcodes_with_metadata.
+    """
+    if oldline and newline and oldline != newline:
+        oldregion, newregion = get_line_changed_regions(oldline, newline)
+    else:
+        oldregion = newregion = []
+
+    result = [vlinenum,
+              oldlinenum or '', mark_safe(oldmarkup or ''), oldregion,
+              newlinenum or '', mark_safe(newmarkup or ''), newregion,
+              (oldlinenum, newlinenum) in meta['whitespace_lines']]
+
+    if oldlinenum and oldlinenum in meta.get('moved', {}):
+        destination = meta["moved"][oldlinenum]
+        result.append(destination)
+    elif newlinenum and newlinenum in meta.get('moved', {}):
+        destination = meta["moved"][newlinenum]
+        result.append(destination)
+
+    return result
+
+
+def get_lexer(filename):
+    """
+    Returns a Pygments lexer for a file, or None if there's none for its
+    type.
+
+    Finding the lexer for a filename tries the filename patterns of every
+    lexer, so the lexer class found is remembered for the file extension,
+    or for the filename if it has no extension.
+    """
+    basename, ext = os.path.splitext(os.path.basename(filename))
+    key = ext or basename
+
+    try:
+        lexer_class = lexer_classes[key]
+    except KeyError:
+        # XXX Guessing is preferable but really slow, especially on XML
+        #     files.
+        #lexer = guess_lexer_for_filename(filename, data, stripnl=False)
+        try:
+            lexer_class = get_lexer_for_filename(filename).__class__
+        except ClassNotFound:
+            lexer_class = None
+
+        lexer_classes[key] = lexer_class
+
+    if not lexer_class:
+        return None
+
+    lexer = lexer_class(stripnl=False, encoding='utf-8')
+
+    try:
+        # This is only available in 0.7 and higher
+        lexer.add_filter('codetagify')
+    except AttributeError:
+        pass
+
+    return lexer
+
+
+def apply_pygments(data, filename, ranges=None):
+    """
+    Returns the lines of data highlighted as HTML, or None if there's no
+    lexer for the file.
+
+    If ranges is given as a list of (start, end) line indexes in order,
+    only the lines in them are highlighted and the others are None. The
+    file is still lexed from its start up to the last range, so the lines
+    are highlighted the same as when highlighting the whole file.
+    """
+    lexer = get_lexer(filename)
+
+    if not lexer:
+        return None
+
+    tokens = lexer.get_tokens(data)
+
+    if ranges is not None:
+        tokens = _filter_tokens(tokens, ranges)
+
+    lines = pygments.format(tokens, NoWrapperHtmlFormatter()).splitlines()
+
+    if ranges is not None:
+        hidden_start = 0
+
+        for start, end in ranges:
+            for i in xrange(hidden_start, min(start, len(lines))):
+                lines[i] = None
+
+            hidden_start = max(hidden_start, end)
+
+        for i in xrange(hidden_start, len(lines)):
+            lines[i] = None
+
+    return lines
+
+
+def _filter_tokens(tokens, ranges):
+    """
+    Yields the tokens on the lines in ranges and only the line breaks of
+    the other lines, up to the end of the last range.
+    """
+    ranges = [(start, end) for start, end in ranges if start < end]
+
+    if not ranges:
+        raise StopIteration
+
+    n = 0
+    start, end = ranges[0]
+    linenum = 0
+
+    for ttype, value in tokens:
+        parts = value.split('\n')
+
+        for i, part in enumerate(parts):
+            if i > 0:
+                yield Text, u'\n'
+                linenum += 1
+
+                while linenum >= end:
+                    n += 1
+
+                    if n == len(ranges):
+                        raise StopIteration
+
+                    start, end = ranges[n]
+
+            if part and linenum >= start:
+                yield ttype, part
+
+
+def get_highlighted_file(data, filename):
+    """
+    Returns the lines of a file highlighted by apply_pygments, or None if
+    there's no lexer for it.
+
+    They're cached by the file's contents and lexer, so that files shown in
+    several diffs, such as in interdiffs, are highlighted once.
+    """
+    lexer = get_lexer(filename)
+
+    if not lexer:
+        return None
+
+    key = "highlighted-file:%s:%s" % (sha1(data).hexdigest(),
+                                      lexer.__class__.__name__)
+
+    return cache_memoize(key, lambda: apply_pygments(data, filename),
+                         large_data=True)
+
+
+def highlight_collapsed_chunks(file):
+    """
+    Highlights the lines of the collapsed chunks of a file returned by
+    get_diff_files, for showing them expanded. get_chunks only highlights
+    the lines that are shown when the chunks are collapsed.
+    """
+    filediff = file['filediff']
+
+    if filediff.binary or filediff.deleted:
+        return
+
+    chunks = [chunk for chunk in file['chunks'] if chunk['collapsable']]
+
+    if not chunks:
+        return
+
+    old, new, a, b = get_diff_lines(filediff.diffset, filediff,
+                                    file['interfilediff'],
+                                    file['force_interdiff'])
+
+    siteconfig = SiteConfiguration.objects.get_current()
+    threshold = siteconfig.get('diffviewer_syntax_highlighting_threshold')
+
+    if threshold and (len(a) > threshold or len(b) > threshold):
+        return
+
+    tool = filediff.diffset.repository.get_scmtool()
+
+    try:
+        markup_a = get_highlighted_file(
+            old or '', tool.normalize_path_for_display(filediff.source_file))
+        markup_b = get_highlighted_file(
+            new or '', tool.normalize_path_for_display(filediff.dest_file))
+    except:
+        return
+
+    for chunk in chunks:
+        for line in chunk['lines']:
+            if markup_a and line[1] and line[1] <= len(markup_a):
+                line[2] = mark_safe(markup_a[line[1] - 1])
+
+            if markup_b and line[4] and line[4] <= len(markup_b):
+                line[5] = mark_safe(markup_b[line[4] - 1])
+
+
+def get_diff_lines(diffset, filediff, interfilediff, force_interdiff):
+    """
+    Returns the data of the two files to diff for a filediff, as UTF-8
+    strings ending with a newline, and their lines. See get_chunks for the
+    meaning of the arguments.
+    """
+    old = get_original_file(filediff)
+    new = get_patched_file(old, filediff)
+
+    if interfilediff:
+        old = new
+        interdiff_orig = get_original_file(interfilediff)
+        new = get_patched_file(interdiff_orig, interfilediff)
+    elif force_interdiff:
+        # Basically, revert the change.
+        old, new = new, old
+
+    encoding = diffset.repository.encoding or 'iso-8859-15'
+    old = convert_to_utf8(old, encoding)
+    new = convert_to_utf8(new, encoding)
+
+    # Normalize the input so that if there isn't a trailing newline, we add
+    # it.
+    if old and old[-1] != '\n':
+        old += '\n'
+
+    if new and new[-1] != '\n':
+        new += '\n'
+
+    a = NEWLINES_RE.split(old or '')
+    b = NEWLINES_RE.split(new or '')
+
+    # Remove the trailing newline, now that we've split this. This will
+    # prevent a duplicate line number at the end of the diff.
+    del(a[-1])
+    del(b[-1])
+
+    return old, new, a, b
+
+
+def get_differ(diffset, filediff, a, b):
+    """
+    Returns a differ for the lines of a filediff, with the diff settings
+    of the site and the file's header regexes registered.
+    """
+    siteconfig = SiteConfiguration.objects.get_current()
+    file = filediff.source_file
+
+    ignore_space = True
+    for pattern in siteconfig.get("diffviewer_include_space_patterns"):
+        if fnmatch.fnmatch(file, pattern):
+            ignore_space = False
+            break
+
+    # Successive revisions of a file mostly consist of the same lines. Their
+    # differs share the codes of these lines and of unchanged files.
+    line_codes = None
+    line_code_tables.max_tables = siteconfig.get("diffviewer_line_code_tables")
+
+    if line_code_tables.max_tables:
+        line_codes = line_code_tables.get_table(
+            (diffset.repository_id, filediff.source_file))
+
+    differ = Differ(a, b, ignore_space=ignore_space,
+                    compat_version=diffset.diffcompat,
+                    engine=siteconfig.get("diffviewer_diff_engine"),
+                    line_codes=line_codes)
+
+    # Register any regexes for interesting lines we may want to show.
+    register_interesting_lines_for_filename(differ, file)
+
+    return differ
+
+
 def get_chunks(diffset, filediff, interfilediff, force_interdiff,
                enable_syntax_highlighting):
     def diff_line(vlinenum, oldlinenum, newlinenum, oldline, newline,
                   oldmarkup, newmarkup):
         # This function accesses the variable meta, defined in an outer context.
-        if oldline and newline and oldline != newline:
-            oldregion, newregion = get_line_changed_regions(oldline, newline)
-        else:
-            oldregion = newregion = []
-
-        result = [vlinenum,
-                  oldlinenum or '', mark_safe(oldmarkup or ''), oldregion,
-                  newlinenum or '', mark_safe(newmarkup or ''), newregion,
-                  (oldlinenum, newlinenum) in meta['whitespace_lines']]
-
-        if oldlinenum and oldlinenum in meta.get('moved', {}):
-            destination = meta["moved"][oldlinenum]
-            result.append(destination)
-        elif newlinenum and newlinenum in meta.get('moved', {}):
-            destination = meta["moved"][newlinenum]
-            result.append(destination)
-
-        return result
+        return build_diff_line(meta, vlinenum, oldlinenum, newlinenum,
+                               oldline, newline, oldmarkup, newmarkup)
 
     def new_chunk(lines, start, end, collapsable=False,
                   tag='equal', meta=None):
@@ -500,23 +884,6 @@ def get_chunks(diffset, filediff, interfilediff, force_interdiff,
         else:
             last_header_index[0] = last_index
 
-    def apply_pygments(data, filename):
-        # XXX Guessing is preferable but really slow, especially on XML
-        #     files.
-        #if filename.endswith(".xml"):
-        lexer = get_lexer_for_filename(filename, stripnl=False,
-                                       encoding='utf-8')
-        #else:
-        #    lexer = guess_lexer_for_filename(filename, data, stripnl=False)
-
-        try:
-            # This is only available in 0.7 and higher
-            lexer.add_filter('codetagify')
-        except AttributeError:
-            pass
-
-        return pygments.highlight(data, lexer, NoWrapperHtmlFormatter()).splitlines()
-
 
     # There are three ways this function is called:
     #
@@ -552,38 +919,8 @@ def get_chunks(diffset, filediff, interfilediff, force_interdiff,
 
     assert filediff
 
-    file = filediff.source_file
-
-    old = get_original_file(filediff)
-    new = get_patched_file(old, filediff)
-
-    if interfilediff:
-        old = new
-        interdiff_orig = get_original_file(interfilediff)
-        new = get_patched_file(interdiff_orig, interfilediff)
-    elif force_interdiff:
-        # Basically, revert the change.
-        old, new = new, old
-
-    encoding = diffset.repository.encoding or 'iso-8859-15'
-    old = convert_to_utf8(old, encoding)
-    new = convert_to_utf8(new, encoding)
-
-    # Normalize the input so that if there isn't a trailing newline, we add
-    # it.
-    if old and old[-1] != '\n':
-        old += '\n'
-
-    if new and new[-1] != '\n':
-        new += '\n'
-
-    a = NEWLINES_RE.split(old or '')
-    b = NEWLINES_RE.split(new or '')
-
-    # Remove the trailing newline, now that we've split this. This will
-    # prevent a duplicate line number at the end of the diff.
-    del(a[-1])
-    del(b[-1])
+    old, new, a, b = get_diff_lines(diffset, filediff, interfilediff,
+                                    force_interdiff)
 
     a_num_lines = len(a)
     b_num_lines = len(b)
@@ -597,40 +934,11 @@ def get_chunks(diffset, filediff, interfilediff, force_interdiff,
     if threshold and (a_num_lines > threshold or b_num_lines > threshold):
         enable_syntax_highlighting = False
 
-    if enable_syntax_highlighting:
-        repository = filediff.diffset.repository
-        tool = repository.get_scmtool()
-        source_file = tool.normalize_path_for_display(filediff.source_file)
-        dest_file = tool.normalize_path_for_display(filediff.dest_file)
-        try:
-            # TODO: Try to figure out the right lexer for these files
-            #       once instead of twice.
-            markup_a = apply_pygments(old or '', source_file)
-            markup_b = apply_pygments(new or '', dest_file)
-        except:
-            pass
-
-    if not markup_a:
-        markup_a = NEWLINES_RE.split(escape(old))
-
-    if not markup_b:
-        markup_b = NEWLINES_RE.split(escape(new))
-
     linenum = 1
     last_header = [None, None]
     last_header_index = [0, 0]
 
-    ignore_space = True
-    for pattern in siteconfig.get("diffviewer_include_space_patterns"):
-        if fnmatch.fnmatch(file, pattern):
-            ignore_space = False
-            break
-
-    differ = Differ(a, b, ignore_space=ignore_space,
-                    compat_version=diffset.diffcompat)
-
-    # Register any regexes for interesting lines we may want to show.
-    register_interesting_lines_for_filename(differ, file)
+    differ = get_differ(diffset, filediff, a, b)
 
     # TODO: Make this back into a preference if people really want it.
     context_num_lines = siteconfig.get("diffviewer_context_num_lines")
@@ -645,7 +953,53 @@ def get_chunks(diffset, filediff, interfilediff, force_interdiff,
             "Generating diff chunks for filediff id %s (%s)" %
             (filediff.id, filediff.source_file))
 
-    for tag, i1, i2, j1, j2, meta in opcodes_with_metadata(differ):
+    opcodes = list(opcodes_with_metadata(differ))
+
+    if enable_syntax_highlighting:
+        # Only the lines outside of collapsed chunks are highlighted. The
+        # others are highlighted by highlight_collapsed_chunks when they're
+        # expanded.
+        ranges_a = []
+        ranges_b = []
+
+        for tag, i1, i2, j1, j2, meta in opcodes:
+            numlines = max(i2 - i1, j2 - j1)
+
+            for start, end, collapsable in _get_chunk_ranges(
+                    tag, numlines, linenum == 1,
+                    i2 == a_num_lines and j2 == b_num_lines,
+                    context_num_lines, collapse_threshold):
+                if not collapsable:
+                    ranges_a.append((i1 + min(start, i2 - i1),
+                                     i1 + min(end, i2 - i1)))
+                    ranges_b.append((j1 + min(start, j2 - j1),
+                                     j1 + min(end, j2 - j1)))
+
+            linenum += numlines
+
+        linenum = 1
+
+        repository = filediff.diffset.repository
+        tool = repository.get_scmtool()
+        source_file = tool.normalize_path_for_display(filediff.source_file)
+        dest_file = tool.normalize_path_for_display(filediff.dest_file)
+        try:
+            markup_a = apply_pygments(old or '', source_file, ranges_a)
+            markup_b = apply_pygments(new or '', dest_file, ranges_b)
+        except:
+            pass
+
+    if markup_a:
+        markup_a = _fill_markup(markup_a, a)
+    else:
+        markup_a = NEWLINES_RE.split(escape(old))
+
+    if markup_b:
+        markup_b = _fill_markup(markup_b, b)
+    else:
+        markup_b = NEWLINES_RE.split(escape(new))
+
+    for tag, i1, i2, j1, j2, meta in opcodes:
         oldlines = markup_a[i1:i2]
         newlines = markup_b[j1:j2]
         numlines = max(len(oldlines), len(newlines))
@@ -655,29 +1009,62 @@ def get_chunks(diffset, filediff, interfilediff, force_interdiff,
                     xrange(i1 + 1, i2 + 1), xrange(j1 + 1, j2 + 1),
                     a[i1:i2], b[j1:j2], oldlines, newlines)
 
-        if tag == 'equal' and numlines > collapse_threshold:
-            last_range_start = numlines - context_num_lines
-
-            if linenum == 1:
-                yield new_chunk(lines, 0, last_range_start, True)
-                yield new_chunk(lines, last_range_start, numlines)
-            else:
-                yield new_chunk(lines, 0, context_num_lines)
+        chunk_ranges = _get_chunk_ranges(
+            tag, numlines, linenum == 1,
+            i2 == a_num_lines and j2 == b_num_lines,
+            context_num_lines, collapse_threshold)
 
-                if i2 == a_num_lines and j2 == b_num_lines:
-                    yield new_chunk(lines, context_num_lines, numlines, True)
-                else:
-                    yield new_chunk(lines, context_num_lines,
-                                    last_range_start, True)
-                    yield new_chunk(lines, last_range_start, numlines)
-        else:
+        if len(chunk_ranges) == 1:
             yield new_chunk(lines, 0, numlines, False, tag, meta)
+        else:
+            for start, end, collapsable in chunk_ranges:
+                yield new_chunk(lines, start, end, collapsable)
 
         linenum += numlines
 
     log_timer.done()
 
 
+def _get_chunk_ranges(tag, numlines, is_first, is_last, context_num_lines,
+                      collapse_threshold):
+    """
+    Returns the ranges of the lines of an opcode that get_chunks makes
+    chunks of, as (start, end, collapsable) tuples. Long ranges of equal
+    lines are collapsed, except for the lines of context around changes.
+    """
+    if tag != 'equal' or numlines <= collapse_threshold:
+        return [(0, numlines, False)]
+
+    last_range_start = numlines - context_num_lines
+
+    if is_first:
+        return [(0, last_range_start, True),
+                (last_range_start, numlines, False)]
+    elif is_last:
+        return [(0, context_num_lines, False),
+                (context_num_lines, numlines, True)]
+    else:
+        return [(0, context_num_lines, False),
+                (context_num_lines, last_range_start, True),
+                (last_range_start, numlines, False)]
+
+
+def _fill_markup(markup, lines):
+    """
+    Returns the markup of lines, where the lines that apply_pygments left
+    unhighlighted are escaped.
+    """
+    markup = list(markup)
+
+    for i, line in enumerate(lines):
+        if i >= len(markup):
+            markup.append(escape(line))
+        elif markup[i] is None:
+            markup[i] = escape(line)
+
+    return markup
+
+
 def is_valid_move_range(lines):
     """Determines if a move range is valid and should be included.
 
@@ -709,6 +1096,7 @@ def opcodes_with_metadata(differ):
     """
     groups = []
     removes = {}
+    removed_lines = {}
     inserts = []
 
     for tag, i1, i2, j1, j2 in differ.get_opcodes():
@@ -740,19 +1128,19 @@ def opcodes_with_metadata(differ):
         group = (tag, i1, i2, j1, j2, meta)
         groups.append(group)
 
-        # Store delete/insert ranges for later lookup. We will be building
-        # keys that in most cases will be unique for the particular block
-        # of text being inserted/deleted. There is a chance of collision,
-        # so we store a list of matching groups under that key.
+        # Index the deleted lines for later lookup. Each stripped line maps
+        # to the first deleted line with that content, and each deleted
+        # line maps to its stripped content and group.
         #
-        # Later, we will loop through the keys and attempt to find insert
-        # keys/groups that match remove keys/groups.
+        # Later, we will look up the lines of the insert groups to find
+        # blocks of lines that were removed elsewhere.
         if tag == 'delete':
             for i in xrange(i1, i2):
                 line = differ.a[i].strip()
 
                 if line:
-                    removes.setdefault(line, []).append((i, group))
+                    removes.setdefault(line, i)
+                    removed_lines[i] = (line, group)
         elif tag == 'insert':
             inserts.append(group)
 
@@ -762,29 +1150,22 @@ def opcodes_with_metadata(differ):
     # deleted lines. We'll be going through and finding consecutive groups
     # of matching inserts/deletes that represent a move block.
     #
-    # The algorithm will be documented as we go in the code.
-    #
     # We start by looping through all the inserted groups.
     for itag, ii1, ii2, ij1, ij2, imeta in inserts:
-        # Store some state on the range we'll be working with inside this
-        # insert group.
-        #
         # i_move_cur is the current location inside the insert group
         # (from ij1 through ij2).
         #
-        # i_move_range is the current range of consecutive lines that we'll
-        # use for a move. Each line in this range has a corresponding
-        # consecutive delete line.
+        # i_move_start is where the current range of consecutive lines that
+        # we'll use for a move starts.
         #
-        # r_move_ranges represents deleted move ranges. The key is a
-        # string in the form of "{i1}-{i2}-{j1}-{j2}", with those positions
-        # taken from the remove group for the line. The value
-        # is an array of tuples of (r_start, r_end, r_group). These values
-        # are used to quickly locate deleted lines we've found that match
-        # the inserted lines, so we can assemble ranges later.
+        # r_move_range is the range of deleted lines matching it, as a list
+        # of [r_start, r_end, r_group]. A range is started at the first
+        # deleted line matching an inserted line, and is then extended by
+        # the following lines of its delete group as long as they match the
+        # inserted lines.
         i_move_cur = ij1
-        i_move_range = (i_move_cur, i_move_cur)
-        r_move_ranges = {} # key -> [(start, end, group)]
+        i_move_start = i_move_cur
+        r_move_range = None
 
         # Loop through every location from ij1 through ij2 until we've
         # reached the end.
@@ -798,116 +1179,67 @@ def opcodes_with_metadata(differ):
                 # The inserted line at this location has a corresponding
                 # removed line.
                 #
-                # If there's already some information on removed line ranges
-                # for this particular move block we're processing then we'll
-                # update the range.
-                #
-                # The way we do that is to find each removed line that
-                # matches this inserted line, and for each of those find
-                # out if there's an existing move range that the found
-                # removed line immediately follows. If there is, we update
-                # the existing range.
-                #
-                # If there isn't any move information for this line, we'll
-                # simply add it to the move ranges.
-                for ri, rgroup in removes.get(iline, []):
-                    key = "%s-%s-%s-%s" % rgroup[1:5]
-
-                    if r_move_ranges:
-                        for i, r_move_range in \
-                            enumerate(r_move_ranges.get(key, [])):
-                            # If the remove information for the line is next in
-                            # the sequence for this calculated move range...
-                            if ri == r_move_range[1] + 1:
-                                r_move_ranges[key][i] = (r_move_range[0], ri,
-                                                         rgroup)
-                                break
-                    else:
-                        # We don't have any move ranges yet, so it's time to
-                        # build one based on any removed lines we find that
-                        # match the inserted line.
-                        r_move_ranges[key] = [(ri, ri, rgroup)]
+                # If there isn't any move information yet, we start a range
+                # at the first removed line matching it.
+                if not r_move_range:
+                    ri = removes[iline]
+                    r_move_range = [ri, ri, removed_lines[ri][1]]
+
+                # Extend the range over the removed lines following it in
+                # its group that match this inserted line.
+                ri = r_move_range[1] + 1
+
+                while (ri in removed_lines and
+                       removed_lines[ri][0] == iline and
+                       removed_lines[ri][1] is r_move_range[2]):
+                    r_move_range[1] = ri
+                    ri += 1
 
                 # On to the next line in the sequence...
                 i_move_cur += 1
             else:
                 # We've reached the very end of the insert group. See if
                 # we have anything that looks like a move.
-                if r_move_ranges:
-                    r_move_range = None
-
-                    # Go through every range of lines we've found and
-                    # find the longest.
+                #
+                # If we have a move range, see if it's one we want to
+                # include or filter out. Some moves are not impressive
+                # enough to display. For example, a small portion of a
+                # comment, or whitespace-only changes.
+                if (r_move_range and
+                    is_valid_move_range(
+                        differ.a[r_move_range[0]:r_move_range[1]])):
+                    r_start, r_end, rgroup = r_move_range
+
+                    # Build the insert and remove ranges based on where we
+                    # are now and which range we found.
                     #
-                    # The longest move range wins. If we find two ranges that
-                    # are equal, though, we'll ignore both. The idea is that
-                    # if we have two identical moves, then it's probably
-                    # common enough code that we don't want to show the move.
-                    # An example might be some standard part of a comment
-                    # block, with no real changes in content.
+                    # The new ranges will be actual lists of positions,
+                    # rather than a beginning and end. These will be
+                    # provided to the renderer.
                     #
-                    # Note that with the current approach, finding duplicate
-                    # moves doesn't cause us to reset the winning range
-                    # to the second-highest identical match. We may want to
-                    # do that down the road, but it means additional state,
-                    # and this is hopefully uncommon enough to not be a real
-                    # problem.
-                    for ranges in r_move_ranges.itervalues():
-                        for r1, r2, rgroup in ranges:
-                            if not r_move_range:
-                                r_move_range = (r1, r2, rgroup)
-                            else:
-                                len1 = r_move_range[2] - r_move_range[1]
-                                len2 = r2 - r1
-
-                                if len1 < len2:
-                                    r_move_range = (r1, r2, rgroup)
-                                elif len1 == len2:
-                                    # If there are two that are the same, it
-                                    # may be common code that we don't want to
-                                    # see moves for. Comments, for example.
-                                    r_move_range = None
-
-                    # If we have a move range, see if it's one we want to
-                    # include or filter out. Some moves are not impressive
-                    # enough to display. For example, a small portion of a
-                    # comment, or whitespace-only changes.
-                    if (r_move_range and
-                        is_valid_move_range(
-                            differ.a[r_move_range[0]:r_move_range[1]])):
-
-                        # Rebuild the insert and remove ranges based on
-                        # where we are now and which range we won.
-                        #
-                        # The new ranges will be actual lists of positions,
-                        # rather than a beginning and end. These will be
-                        # provided to the renderer.
-                        #
-                        # The ranges expected by the renderers are 1-based,
-                        # whereas our calculations for this algorithm are
-                        # 0-based, so we add 1 to the numbers.
-                        #
-                        # The upper boundaries passed to the range() function
-                        # must actually be one higher than the value we want.
-                        # So, for r_move_range, we actually increment by 2.
-                        # We only increment i_move_cur by one, because
-                        # i_move_cur already factored in the + 1 by being
-                        # at the end of the while loop.
-                        i_move_range = range(i_move_range[0] + 1,
-                                             i_move_cur + 1)
-                        r_move_range = range(r_move_range[0] + 1,
-                                             r_move_range[1] + 2)
-
-                        rmeta = rgroup[-1]
-                        rmeta.setdefault('moved', {}).update(
-                            dict(zip(r_move_range, i_move_range)))
-                        imeta.setdefault('moved', {}).update(
-                            dict(zip(i_move_range, r_move_range)))
+                    # The ranges expected by the renderers are 1-based,
+                    # whereas our calculations for this algorithm are
+                    # 0-based, so we add 1 to the numbers.
+                    #
+                    # The upper boundaries passed to the range() function
+                    # must actually be one higher than the value we want.
+                    # So, for the removed lines, we actually increment by 2.
+                    # We only increment i_move_cur by one, because
+                    # i_move_cur already factored in the + 1 by being
+                    # at the end of the while loop.
+                    i_move_range = range(i_move_start + 1, i_move_cur + 1)
+                    r_move_range = range(r_start + 1, r_end + 2)
+
+                    rmeta = rgroup[-1]
+                    rmeta.setdefault('moved', {}).update(
+                        dict(zip(r_move_range, i_move_range)))
+                    imeta.setdefault('moved', {}).update(
+                        dict(zip(i_move_range, r_move_range)))
 
                 # Reset the state for the next range.
                 i_move_cur += 1
-                i_move_range = (i_move_cur, i_move_cur)
-                r_move_ranges = {}
+                i_move_start = i_move_cur
+                r_move_range = None
 
     return groups
 
@@ -921,12 +1253,334 @@ def get_revision_str(revision):
         return "Revision %s" % revision
 
 
+def get_cached_chunks(filediff, interfilediff, force_interdiff,
+                      enable_syntax_highlighting):
+    """
+    Returns the chunks of a file from the cache, generating them with
+    get_chunks if they aren't cached yet.
+
+    The chunks are cached in the compact format of encode_chunks. The lines
+    of each chunk are only decoded when they're used.
+    """
+    key = "diff-sidebyside-v%s-" % FORMAT_VERSION
+
+    if enable_syntax_highlighting:
+        key += "hl-"
+
+    key += _get_file_cache_key(filediff, interfilediff, force_interdiff)
+
+    def encode():
+        return encode_chunks(get_chunks(filediff.diffset,
+                                        filediff, interfilediff,
+                                        force_interdiff,
+                                        enable_syntax_highlighting))
+
+    data = cache_memoize(key, encode, large_data=True)
+
+    try:
+        return decode_chunks(data)
+    except ChunkFormatError, e:
+        logging.warning("Regenerating cached diff chunks %s: %s", key, e)
+
+        return decode_chunks(cache_memoize(key, encode, large_data=True,
+                                           force_overwrite=True))
+
+
+def get_cached_opcodes(filediff, interfilediff, force_interdiff):
+    """
+    Returns the opcodes of a file's diff from the cache, computing them if
+    they aren't cached yet.
+
+    The result is a dictionary with the opcodes returned by
+    opcodes_with_metadata as 'opcodes', and the header lines of the
+    original and modified files as 'left_headers' and 'right_headers'.
+    """
+    def compute():
+        diffset = filediff.diffset
+        old, new, a, b = get_diff_lines(diffset, filediff, interfilediff,
+                                        force_interdiff)
+        differ = get_differ(diffset, filediff, a, b)
+        opcodes = list(opcodes_with_metadata(differ))
+
+        return {
+            'opcodes': opcodes,
+            'left_headers': differ.get_interesting_lines('header', False),
+            'right_headers': differ.get_interesting_lines('header', True),
+        }
+
+    key = "diff-opcodes-" + _get_file_cache_key(filediff, interfilediff,
+                                                force_interdiff)
+
+    return cache_memoize(key, compute, large_data=True)
+
+
+def _get_file_cache_key(filediff, interfilediff, force_interdiff):
+    if not force_interdiff:
+        return str(filediff.id)
+    elif interfilediff:
+        return "interdiff-%s-%s" % (filediff.id, interfilediff.id)
+    else:
+        return "interdiff-%s-none" % filediff.id
+
+
+def warm_up_diffset(diffset, processes=None):
+    """
+    Generates the chunks of all files of a diffset into the cache, with and
+    without syntax highlighting, so that reviewers don't wait for them.
+
+    The files are processed by a pool of processes, by default one for
+    each CPU.
+    """
+    siteconfig = SiteConfiguration.objects.get_current()
+    highlighting = [False]
+
+    if siteconfig.get('diffviewer_syntax_highlighting'):
+        highlighting.append(True)
+
+    tasks = [(filediff.pk, enable_syntax_highlighting)
+             for filediff in diffset.files.all()
+             if not filediff.binary and not filediff.deleted
+             for enable_syntax_highlighting in highlighting]
+
+    if not tasks:
+        return
+
+    log_timer = log_timed("Warming up diff chunks for diffset id %s" %
+                          diffset.id)
+
+    # The worker processes must not share the database and cache
+    # connections of this process. They are reopened when needed.
+    connection.close()
+
+    if hasattr(cache, 'close'):
+        cache.close()
+
+    pool = multiprocessing.Pool(processes)
+
+    try:
+        pool.map(_warm_up_chunks, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    log_timer.done()
+
+
+def _warm_up_chunks(task):
+    filediff_id, enable_syntax_highlighting = task
+
+    try:
+        filediff = FileDiff.objects.get(pk=filediff_id)
+        get_cached_chunks(filediff, None, False, enable_syntax_highlighting)
+    except Exception, e:
+        # The chunks are generated again when the file is viewed, which
+        # reports the error to the user.
+        logging.error("Error warming up diff chunks for filediff id %s: %s",
+                      filediff_id, e, exc_info=1)
+
+
+def get_diff_file_index(diffset, interdiffset=None):
+    """
+    Returns the list of files shown in a diff, or in an interdiff between
+    two diffsets, in the order they're shown.
+
+    Each file is a dictionary with the IDs of its filediff and
+    interfilediff (``filediff_id`` and ``interfilediff_id``),
+    ``force_interdiff``, the ``basepath`` and ``basename`` of the file and
+    its ``index``, as in the files returned by get_diff_files.
+
+    Only the columns needed to list the files are fetched, and the diffs of
+    an interdiff are compared by hash, so no diffs or SCMTools are loaded.
+    Passing part of the list, such as a page of it, to get_diff_files
+    loads only the files in that part.
+    """
+    if interdiffset:
+        diffset_ids = [diffset.id, interdiffset.id]
+    else:
+        diffset_ids = [diffset.id]
+
+    rows = FileDiff.objects.filter(diffset__in=diffset_ids).values_list(
+        'pk', 'diffset', 'source_file', 'diff_hash')
+
+    if interdiffset:
+        parts = _get_interdiff_index_parts(diffset, interdiffset, rows)
+    else:
+        parts = [(filediff_id, None, False, source_file)
+                 for filediff_id, diffset_id, source_file, diff_hash_id
+                 in rows]
+
+    file_index = []
+
+    for filediff_id, interfilediff_id, force_interdiff, source_file in parts:
+        basepath, basename = _split_path(source_file)
+
+        file_index.append({
+            'filediff_id': filediff_id,
+            'interfilediff_id': interfilediff_id,
+            'force_interdiff': force_interdiff,
+            'basepath': basepath,
+            'basename': basename,
+            'index': len(file_index),
+        })
+
+    file_index.sort(_cmp_file)
+
+    return file_index
+
+
+def _get_interdiff_index_parts(diffset, interdiffset, rows):
+    """
+    Returns the files of an interdiff as a list of (filediff_id,
+    interfilediff_id, force_interdiff, source_file) tuples, given the
+    rows of the filediffs of both diffsets.
+
+    In order to support interdiffs properly, we need to display diffs on
+    every file in the union of both diffsets. A file in diffset but not in
+    interdiffset forces an interdiff, as it was reverted. A file only in
+    interdiffset is new, and is shown like a standard diff with no
+    interfilediff. Files with the same diff in both diffsets are left out.
+    """
+    filediff_rows = []
+
+    # A map used to quickly look up the equivalent interfilediff given a
+    # source file.
+    interdiff_map = {}
+
+    for row in rows:
+        if row[1] == diffset.id:
+            filediff_rows.append(row)
+
+        if row[1] == interdiffset.id:
+            interdiff_map[row[2]] = row
+
+    parts = []
+    unhashed_parts = []
+
+    for filediff_id, diffset_id, source_file, diff_hash_id in filediff_rows:
+        interdiff_row = interdiff_map.pop(source_file, None)
+
+        if not interdiff_row:
+            parts.append((filediff_id, None, True, source_file))
+            continue
+
+        interfilediff_id, interdiff_hash_id = interdiff_row[0], interdiff_row[3]
+
+        if diff_hash_id and interdiff_hash_id:
+            if diff_hash_id == interdiff_hash_id:
+                continue
+        else:
+            unhashed_parts.append(len(parts))
+
+        parts.append((filediff_id, interfilediff_id, True, source_file))
+
+    if unhashed_parts:
+        # Filediffs saved before FileDiffData existed have no hash, so
+        # their diffs have to be loaded and compared.
+        filediff_ids = []
+
+        for i in unhashed_parts:
+            filediff_ids += parts[i][:2]
+
+        filediffs = FileDiff.objects.in_bulk(filediff_ids)
+        same_parts = set([
+            i for i in unhashed_parts
+            if filediffs[parts[i][0]].has_same_diff(filediffs[parts[i][1]])
+        ])
+        parts = [part for i, part in enumerate(parts) if i not in same_parts]
+
+    # What's left in the map are interdiff files that are new. They have no
+    # file to diff against, so we can pretend the interdiff is the source
+    # filediff and not specify an interdiff.
+    parts += [(row[0], None, False, row[2]) for row in interdiff_map.values()]
+
+    return parts
+
+
+def load_diff_file_index(file_index):
+    """
+    Returns the files of a list returned by get_diff_file_index as a list
+    of (filediff, interfilediff, force_interdiff) tuples. All their
+    filediffs are fetched in one query.
+    """
+    filediff_ids = []
+
+    for entry in file_index:
+        filediff_ids.append(entry['filediff_id'])
+
+        if entry['interfilediff_id']:
+            filediff_ids.append(entry['interfilediff_id'])
+
+    filediffs = FileDiff.objects.select_related().in_bulk(filediff_ids)
+
+    return [(filediffs[entry['filediff_id']],
+             filediffs.get(entry['interfilediff_id']),
+             entry['force_interdiff'])
+            for entry in file_index]
+
+
+def get_interdiff_parts(diffset, interdiffset, filediff=None):
+    """
+    Returns the files to show in an interdiff between two diffsets, as a
+    list of (filediff, interfilediff, force_interdiff) tuples. If filediff
+    is given, only its file is looked up.
+
+    Files with the same diff in both diffsets are left out. Their diffs are
+    compared by hash, so no diffs stored in FileDiffData are loaded.
+    """
+    if not filediff:
+        return load_diff_file_index(get_diff_file_index(diffset,
+                                                        interdiffset))
+
+    interfilediffs = list(interdiffset.files.filter(
+        source_file=filediff.source_file))
+
+    if interfilediffs:
+        interfilediff = interfilediffs[-1]
+
+        if filediff.has_same_diff(interfilediff):
+            return []
+    else:
+        interfilediff = None
+
+    return [(filediff, interfilediff, True)]
+
+
+def _split_path(path):
+    """Returns the base path and base name of a file's path."""
+    i = path.rfind('/')
+
+    if i != -1:
+        return path[:i], path[i + 1:]
+    else:
+        return "", path
+
+
+def _cmp_file(x, y):
+    # Sort based on basepath in asc order
+    if x["basepath"] != y["basepath"]:
+        return cmp(x["basepath"], y["basepath"])
+
+    # Sort based on filename in asc order, then based on extension in desc
+    # order, to make *.h be ahead of *.c/cpp
+    x_file, x_ext = os.path.splitext(x["basename"])
+    y_file, y_ext = os.path.splitext(y["basename"])
+
+    if x_file != y_file:
+        return cmp(x_file, y_file)
+    else:
+        return cmp(y_ext, x_ext)
+
+
 def get_diff_files(diffset, filediff=None, interdiffset=None,
                    enable_syntax_highlighting=True,
-                   load_chunks=True):
+                   load_chunks=True, file_index=None):
+    """
+    Returns the information on the files of a diff or interdiff needed to
+    show them. If filediff is given, only its file is returned. If
+    file_index is given, only the files in it are returned, where it's all
+    or part of the list returned by get_diff_file_index.
+    """
     if filediff:
-        filediffs = [filediff]
-
         if interdiffset:
             log_timer = log_timed("Generating diff file info for "
                                   "interdiffset ids %s-%s, filediff %s" %
@@ -936,8 +1590,6 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
                                   "diffset id %s, filediff %s" %
                                   (diffset.id, filediff.id))
     else:
-        filediffs = diffset.files.select_related().all()
-
         if interdiffset:
             log_timer = log_timed("Generating diff file info for "
                                   "interdiffset ids %s-%s" %
@@ -947,70 +1599,30 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
                                   "diffset id %s" % diffset.id)
 
 
-    # A map used to quickly look up the equivalent interfilediff given a
-    # source file.
-    interdiff_map = {}
-    if interdiffset:
-        for interfilediff in interdiffset.files.all():
-            if not filediff or \
-               filediff.source_file == interfilediff.source_file:
-                interdiff_map[interfilediff.source_file] = interfilediff
-
-    key_prefix = "diff-sidebyside-"
-
-    if enable_syntax_highlighting:
-        key_prefix += "hl-"
-
-
-    # In order to support interdiffs properly, we need to display diffs
-    # on every file in the union of both diffsets. Iterating over one diffset
-    # or the other doesn't suffice.
-    #
-    # We build a list of parts containing the source filediff, the interdiff
-    # filediff (if specified), and whether to force showing an interdiff
-    # (in the case where a file existed in the source filediff but was
-    # reverted in the interdiff).
-    filediff_parts = []
-
-    for filediff in filediffs:
-        interfilediff = None
-
-        if filediff.source_file in interdiff_map:
-            interfilediff = interdiff_map[filediff.source_file]
-            del(interdiff_map[filediff.source_file])
-
-        filediff_parts.append((filediff, interfilediff, interdiffset != None))
-
+    if filediff:
+        if interdiffset:
+            filediff_parts = get_interdiff_parts(diffset, interdiffset,
+                                                 filediff)
+        else:
+            filediff_parts = [(filediff, None, False)]
 
-    if interdiffset:
-        # We've removed everything in the map that we've already found.
-        # What's left are interdiff files that are new. They have no file
-        # to diff against.
-        #
-        # The end result is going to be a view that's the same as when you're
-        # viewing a standard diff. As such, we can pretend the interdiff is
-        # the source filediff and not specify an interdiff. Keeps things
-        # simple, code-wise, since we really have no need to special-case
-        # this.
-        filediff_parts += [(interdiff, None, False)
-                           for interdiff in interdiff_map.values()]
+        indexes = range(len(filediff_parts))
+    else:
+        if file_index is None:
+            file_index = get_diff_file_index(diffset, interdiffset)
 
+        filediff_parts = load_diff_file_index(file_index)
+        indexes = [entry['index'] for entry in file_index]
 
     files = []
+    tool = diffset.repository.get_scmtool()
 
-    for parts in filediff_parts:
+    for index, parts in zip(indexes, filediff_parts):
         filediff, interfilediff, force_interdiff = parts
 
         newfile = (filediff.source_revision == PRE_CREATION)
 
         if interdiffset:
-            # First, find out if we want to even process this one.
-            # We only process if there's a difference in files.
-
-            if (filediff and interfilediff and
-                filediff.diff == interfilediff.diff):
-                continue
-
             source_revision = "Diff Revision %s" % diffset.revision
 
             if not interfilediff and force_interdiff:
@@ -1026,16 +1638,7 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
             else:
                 dest_revision = NEW_CHANGE_STR
 
-        i = filediff.source_file.rfind('/')
-
-        if i != -1:
-            basepath = filediff.source_file[:i]
-            basename = filediff.source_file[i + 1:]
-        else:
-            basepath = ""
-            basename = filediff.source_file
-
-        tool = filediff.diffset.repository.get_scmtool()
+        basepath, basename = _split_path(filediff.source_file)
         depot_filename = tool.normalize_path_for_display(filediff.source_file)
         dest_filename = tool.normalize_path_for_display(filediff.dest_file)
 
@@ -1052,67 +1655,208 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
             'binary': filediff.binary,
             'deleted': filediff.deleted,
             'newfile': newfile,
-            'index': len(files),
+            'index': index,
         }
 
         if load_chunks:
-            chunks = []
+            load_diff_file_chunks(file, enable_syntax_highlighting)
 
-            if not filediff.binary and not filediff.deleted:
-                key = key_prefix
+        files.append(file)
+
+    files.sort(_cmp_file)
+
+    log_timer.done()
 
-                if not force_interdiff:
-                    key += str(filediff.id)
-                elif interfilediff:
-                    key += "interdiff-%s-%s" % (filediff.id, interfilediff.id)
+    return files
+
+
+def load_diff_file_chunks(file, enable_syntax_highlighting=True):
+    """
+    Loads the chunks of a file returned by get_diff_files with load_chunks
+    set to False, along with the indexes of its changed chunks.
+    """
+    filediff = file['filediff']
+    chunks = []
+
+    if not filediff.binary and not filediff.deleted:
+        chunks = get_cached_chunks(filediff, file['interfilediff'],
+                                   file['force_interdiff'],
+                                   enable_syntax_highlighting)
+
+    file['chunks'] = chunks
+    file['changed_chunk_indexes'] = []
+    file['whitespace_only'] = True
+
+    for j, chunk in enumerate(file['chunks']):
+        chunk['index'] = j
+
+        if chunk['change'] != 'equal':
+            file['changed_chunk_indexes'].append(j)
+            meta = chunk.get('meta', {})
+
+            if not meta.get('whitespace_chunk', False):
+                file['whitespace_only'] = False
+
+    file['num_changes'] = len(file['changed_chunk_indexes'])
+
+
+class FileDiffRanges(object):
+    """
+    Builds the chunks of ranges of lines of a file's diff, such as the lines
+    of comments, without generating the chunks of the whole file.
+
+    The diff's opcodes are cached by get_cached_opcodes. Only the lines in
+    the requested ranges are marked up. Their highlighting is taken from
+    the whole file's, as cached by get_highlighted_file, so that lines
+    within multi-line strings and comments are highlighted correctly.
+    """
+    def __init__(self, filediff, interfilediff, force_interdiff,
+                 enable_syntax_highlighting):
+        self.filediff = filediff
+        self.interfilediff = interfilediff
+        self.force_interdiff = force_interdiff
+        self.enable_syntax_highlighting = enable_syntax_highlighting
+        self.a = None
+        self.b = None
+
+    def get_chunks(self, first_line, num_lines):
+        """
+        A generator that yields the chunks of the virtual lines first_line
+        through first_line + num_lines - 1, as described in
+        get_file_chunks_in_range. Chunks contain the lines of one opcode.
+        """
+        if self.a is None:
+            self._load()
+
+        last_line = first_line + num_lines
+        ranges = []
+
+        # Find the opcodes of the lines and the parts of them in the range.
+        n = max(bisect_right(self.opcode_lines, first_line) - 1, 0)
+
+        while n < len(self.opcodes) and self.opcode_lines[n] < last_line:
+            tag, i1, i2, j1, j2, meta = self.opcodes[n]
+            linenum = self.opcode_lines[n]
+            start = max(first_line - linenum, 0)
+            end = min(last_line - linenum, max(i2 - i1, j2 - j1))
+
+            if start < end:
+                ranges.append((self.opcodes[n], linenum, start, end))
+
+            n += 1
+
+        if not ranges:
+            raise StopIteration
+
+        # The lines of both files in the range
+        opcode, linenum, start, end = ranges[0]
+        a_lower = opcode[1] + min(start, opcode[2] - opcode[1])
+        b_lower = opcode[3] + min(start, opcode[4] - opcode[3])
+        opcode, linenum, start, end = ranges[-1]
+        a_upper = opcode[1] + min(end, opcode[2] - opcode[1])
+        b_upper = opcode[3] + min(end, opcode[4] - opcode[3])
+
+        markup_a = self._get_markup(self.old, self.a, a_lower, a_upper,
+                                    self.source_file)
+        markup_b = self._get_markup(self.new, self.b, b_lower, b_upper,
+                                    self.dest_file)
+
+        for (tag, i1, i2, j1, j2, meta), linenum, start, end in ranges:
+            lines = []
+
+            for k in xrange(start, end):
+                i = i1 + k
+                j = j1 + k
+
+                if i < i2:
+                    oldlinenum = i + 1
+                    oldline = self.a[i]
+                    oldmarkup = markup_a[i - a_lower]
                 else:
-                    key += "interdiff-%s-none" % filediff.id
+                    oldlinenum = oldline = oldmarkup = None
 
-                chunks = cache_memoize(
-                    key,
-                    lambda: list(get_chunks(filediff.diffset,
-                                            filediff, interfilediff,
-                                            force_interdiff,
-                                            enable_syntax_highlighting)),
-                    large_data=True)
+                if j < j2:
+                    newlinenum = j + 1
+                    newline = self.b[j]
+                    newmarkup = markup_b[j - b_lower]
+                else:
+                    newlinenum = newline = newmarkup = None
+
+                lines.append(build_diff_line(meta, linenum + k,
+                                             oldlinenum, newlinenum,
+                                             oldline, newline,
+                                             oldmarkup, newmarkup))
+
+            chunk_meta = dict(meta)
+            chunk_meta['headers'] = [
+                self._find_header(self.left_headers,
+                                  i1 + min(start, i2 - i1)),
+                self._find_header(self.right_headers,
+                                  j1 + min(start, j2 - j1)),
+            ]
 
-            file['chunks'] = chunks
-            file['changed_chunk_indexes'] = []
-            file['whitespace_only'] = True
+            yield {
+                'lines': lines,
+                'numlines': len(lines),
+                'change': tag,
+                'meta': chunk_meta,
+            }
 
-            for j, chunk in enumerate(file['chunks']):
-                chunk['index'] = j
+    def _load(self):
+        filediff = self.filediff
+        diffset = filediff.diffset
 
-                if chunk['change'] != 'equal':
-                    file['changed_chunk_indexes'].append(j)
-                    meta = chunk.get('meta', {})
+        info = get_cached_opcodes(filediff, self.interfilediff,
+                                  self.force_interdiff)
+        self.opcodes = info['opcodes']
+        self.left_headers = info['left_headers']
+        self.right_headers = info['right_headers']
 
-                    if not meta.get('whitespace_chunk', False):
-                        file['whitespace_only'] = False
+        # The virtual line number of the first line of each opcode
+        self.opcode_lines = []
+        linenum = 1
 
-            file['num_changes'] = len(file['changed_chunk_indexes'])
+        for tag, i1, i2, j1, j2, meta in self.opcodes:
+            self.opcode_lines.append(linenum)
+            linenum += max(i2 - i1, j2 - j1)
 
-        files.append(file)
+        self.old, self.new, self.a, self.b = \
+            get_diff_lines(diffset, filediff, self.interfilediff,
+                           self.force_interdiff)
 
-    def cmp_file(x, y):
-        # Sort based on basepath in asc order
-        if x["basepath"] != y["basepath"]:
-            return cmp(x["basepath"], y["basepath"])
-
-        # Sort based on filename in asc order, then based on extension in desc
-        # order, to make *.h be ahead of *.c/cpp
-        x_file, x_ext = os.path.splitext(x["basename"])
-        y_file, y_ext = os.path.splitext(y["basename"])
-        if x_file != y_file:
-            return cmp(x_file, y_file)
-        else:
-            return cmp(y_ext, x_ext)
+        siteconfig = SiteConfiguration.objects.get_current()
+        threshold = siteconfig.get('diffviewer_syntax_highlighting_threshold')
 
-    files.sort(cmp_file)
+        if threshold and (len(self.a) > threshold or len(self.b) > threshold):
+            self.enable_syntax_highlighting = False
 
-    log_timer.done()
+        tool = diffset.repository.get_scmtool()
+        self.source_file = \
+            tool.normalize_path_for_display(filediff.source_file)
+        self.dest_file = tool.normalize_path_for_display(filediff.dest_file)
 
-    return files
+    def _get_markup(self, data, lines, lower, upper, filename):
+        if self.enable_syntax_highlighting and lower < upper:
+            try:
+                markup = get_highlighted_file(data or '', filename)
+
+                if markup and len(markup) >= upper:
+                    return markup[lower:upper]
+            except:
+                pass
+
+        return [escape(line) for line in lines[lower:upper]]
+
+    def _find_header(self, headers, index):
+        """
+        Returns the last of the header lines before the line at the index.
+        """
+        n = bisect_left(headers, (index,))
+
+        if n == 0:
+            return ""
+
+        return (headers[n - 1][1] or "").strip()
 
 
 def get_file_chunks_in_range(context, filediff, interfilediff,
@@ -1122,9 +1866,10 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
     filediff/interfilediff.
 
     This is primarily intended for use with templates. It takes a
-    RequestContext for looking up the user and for caching file lists,
-    in order to improve performance and reduce lookup times for files that have
-    already been fetched.
+    RequestContext for looking up the user and for caching the opcodes and
+    lines of files that have already been fetched, in order to improve
+    performance when showing many ranges of a file. Only the lines in the
+    range are marked up, as described in FileDiffRanges.
 
     Each returned chunk is a dictionary with the following fields:
 
@@ -1153,79 +1898,26 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
       7        True if line consists of only whitespace changes
       ======== =============================================================
     """
-    def find_header(headers):
-        for header in reversed(headers):
-            if header[0] < first_line:
-                return header[1]
-
-    interdiffset = None
+    if (filediff.binary or filediff.deleted or
+        (interfilediff and filediff.has_same_diff(interfilediff))):
+        raise StopIteration
 
-    key = "_diff_files_%s_%s" % (filediff.diffset.id, filediff.id)
+    key = "_diff_ranges_%s_%s" % (filediff.diffset.id, filediff.id)
 
     if interfilediff:
         key += "_%s" % (interfilediff.id)
-        interdiffset = interfilediff.diffset
 
     if key in context:
-        files = context[key]
+        ranges = context[key]
     else:
         assert 'user' in context
-        files = get_diff_files(filediff.diffset, filediff, interdiffset,
-                               get_enable_highlighting(context['user']))
-        context[key] = files
-
-    if not files:
-        raise StopIteration
+        ranges = FileDiffRanges(filediff, interfilediff,
+                                interfilediff is not None,
+                                get_enable_highlighting(context['user']))
+        context[key] = ranges
 
-    assert len(files) == 1
-    last_header = (None, None)
-
-    for chunk in files[0]['chunks']:
-        if ('headers' in chunk['meta'] and
-            (chunk['meta']['headers'][0] or chunk['meta']['headers'][1])):
-            last_header = chunk['meta']['headers']
-
-        lines = chunk['lines']
-
-        if lines[-1][0] >= first_line >= lines[0][0]:
-            start_index = first_line - lines[0][0]
-
-            if first_line + num_lines <= lines[-1][0]:
-                last_index = start_index + num_lines
-            else:
-                last_index = len(lines)
-
-            new_chunk = {
-                'lines': chunk['lines'][start_index:last_index],
-                'numlines': last_index - start_index,
-                'change': chunk['change'],
-                'meta': chunk.get('meta', {}),
-            }
-
-            if 'left_headers' in chunk['meta']:
-                left_header = find_header(chunk['meta']['left_headers'])
-                right_header = find_header(chunk['meta']['right_headers'])
-                del new_chunk['meta']['left_headers']
-                del new_chunk['meta']['right_headers']
-
-                if left_header or right_header:
-                    header = (left_header, right_header)
-                else:
-                    header = last_header
-
-                new_chunk['meta']['headers'] = [
-                    (header[0] or "").strip(),
-                    (header[1] or "").strip(),
-                ]
-
-            yield new_chunk
-
-            first_line += new_chunk['numlines']
-            num_lines -= new_chunk['numlines']
-
-            assert num_lines >= 0
-            if num_lines == 0:
-                break
+    for chunk in ranges.get_chunks(first_line, num_lines):
+        yield chunk
 
 
 def get_enable_highlighting(user):
@@ -3,4 +3,5 @@ SEQUENCE = [
     'filediff_filenames_1024_chars',
     'diffset_basedir',
     'filediff_status',
+    'filediff_data',
 ]
@@ -5,7 +5,8 @@ from django import forms
 from django.utils.encoding import smart_unicode
 from django.utils.translation import ugettext as _
 
-from reviewboard.diffviewer.diffutils import DEFAULT_DIFF_COMPAT_VERSION
+from reviewboard.diffviewer.diffutils import get_diff_compat_version, \
+                                             get_diff_line_counts
 from reviewboard.diffviewer.models import DiffSet, FileDiff
 from reviewboard.scmtools.core import PRE_CREATION, UNKNOWN, FileNotFoundError
 
@@ -87,12 +88,27 @@ class UploadDiffForm(forms.Form):
             basedir = ''
 
         # Parse the diff
-        files = list(self._process_files(
-            diff_file, basedir, check_existance=(not parent_diff_file)))
+        files = []
+        line_counts = []
+
+        for f in self._process_files(diff_file, basedir,
+                                     check_existance=(not parent_diff_file)):
+            if f.data:
+                line_counts.append(get_diff_line_counts(f.data))
+
+            # Post-commit diffs can be read back file by file. Don't keep
+            # all of their file diffs in memory, they are read again when
+            # saved.
+            if getattr(f, 'section', None) is not None:
+                f.data = None
+
+            files.append(f)
 
         if len(files) == 0:
             raise EmptyDiffError(_("The diff file is empty"))
 
+        diffcompat = get_diff_compat_version(line_counts)
+
         # Sort the files so that header files come before implementation.
         files.sort(cmp=self._compare_files, key=lambda f: f.origFile)
 
@@ -119,7 +135,7 @@ class UploadDiffForm(forms.Form):
         diffset = DiffSet(name=diff_file.name, revision=0,
                           basedir=basedir,
                           history=diffset_history,
-                          diffcompat=DEFAULT_DIFF_COMPAT_VERSION)
+                          diffcompat=diffcompat)
         diffset.repository = self.repository
         diffset.save()
 
@@ -150,7 +166,7 @@ class UploadDiffForm(forms.Form):
                                 dest_file=dest_file,
                                 source_revision=smart_unicode(source_rev),
                                 dest_detail=f.newInfo,
-                                diff=f.data,
+                                diff=self._get_file_data(diff_file, f),
                                 parent_diff=parent_content,
                                 binary=f.binary,
                                 status=status)
@@ -163,9 +179,23 @@ class UploadDiffForm(forms.Form):
             return diffset, None
 
     def _process_files(self, file, basedir, check_existance=False):
+        if hasattr(file, 'iter_file_diffs'):
+            # Parse the diff of one file at a time
+            for section, data in enumerate(file.iter_file_diffs()):
+                for index, f in enumerate(self._process_data(
+                        data, basedir, check_existance)):
+                    f.section = section
+                    f.section_index = index
+                    yield f
+        else:
+            for f in self._process_data(file.read(), basedir,
+                                        check_existance):
+                yield f
+
+    def _process_data(self, data, basedir, check_existance=False):
         tool = self.repository.get_scmtool()
 
-        for f in tool.get_parser(file.read()).parse():
+        for f in tool.get_parser(data).parse():
             f2, revision = tool.parse_diff_revision(f.origFile, f.origInfo)
             if f2.startswith("/"):
                 filename = f2
@@ -187,6 +217,18 @@ class UploadDiffForm(forms.Form):
             yield f
 
 
+    def _get_file_data(self, diff_file, f):
+        """
+        Returns the diff data of a parsed file, reading the file diff of
+        its section again if the data has been dropped.
+        """
+        if f.data is not None:
+            return f.data
+
+        tool = self.repository.get_scmtool()
+        data = diff_file.get_file_diff(f.section)
+        return tool.get_parser(data).parse()[f.section_index].data
+
     def _compare_files(self, filename1, filename2):
         """
         Compares two files, giving precedence to header files over source
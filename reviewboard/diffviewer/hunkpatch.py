@@ -0,0 +1,233 @@
+import re
+
+
+HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+NO_NEWLINE_MARKER = '\\'
+
+
+class PatchError(Exception):
+    """A diff that can't be applied exactly by apply_patch."""
+    pass
+
+
+class Hunk(object):
+    """
+    A hunk of a unified diff. The old and new lines don't include their
+    newlines. old_newline and new_newline tell whether the last line of
+    each side ends with one.
+    """
+    def __init__(self, old_start, old_count, new_start, new_count):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.old_lines = []
+        self.new_lines = []
+        self.old_newline = True
+        self.new_newline = True
+        self.leading_context = 0
+        self.trailing_context = 0
+        self.has_changes = False
+
+
+def apply_patch(diff, data):
+    """
+    Applies the unified diff of a single file to the file's data and
+    returns the patched data. Both must have Unix line endings.
+
+    Like patch, hunks are applied where they are expected, or at an offset
+    if the file has lines added or removed elsewhere, and
+    "\\ No newline at end of file" markers are honored. Unlike patch, all
+    context lines must match. Raises PatchError for hunks that don't apply
+    that way and for anything that isn't a unified diff.
+    """
+    lines, newline = split_lines(data)
+    result = []
+    pos = 0
+    offset = 0
+
+    for hunk in parse_hunks(diff):
+        if hunk.old_count == 0:
+            # The new lines go after the given line
+            expected = hunk.old_start
+        else:
+            expected = hunk.old_start - 1
+
+        lower = pos
+        upper = len(lines) - len(hunk.old_lines)
+
+        # Like patch, hunks with less context on one side than on the other
+        # must be at the start or the end of the file
+        if (hunk.leading_context < hunk.trailing_context and
+            hunk.old_start <= 1):
+            upper = min(upper, 0)
+        elif hunk.trailing_context < hunk.leading_context:
+            lower = max(lower, upper)
+
+        if hunk.old_lines and hunk.old_newline != newline:
+            if hunk.old_newline:
+                # The last line of the file has no newline and can't match
+                upper = min(upper, len(lines) - len(hunk.old_lines) - 1)
+            else:
+                raise PatchError("Hunk at line %s expects the file to end "
+                                 "without a newline" % hunk.old_start)
+        elif not hunk.old_newline:
+            # The hunk must match the end of the file
+            lower = max(lower, upper)
+
+        start = _find_lines(lines, hunk.old_lines, expected + offset,
+                            lower, upper)
+
+        if start is None:
+            raise PatchError("Hunk at line %s doesn't apply" %
+                             hunk.old_start)
+
+        result.extend(lines[pos:start])
+        result.extend(hunk.new_lines)
+        pos = start + len(hunk.old_lines)
+        offset = start - expected
+
+        if pos == len(lines):
+            if hunk.new_lines:
+                # Like with patch, a kept last line gets a newline if lines
+                # are added after it
+                newline = hunk.new_newline
+            elif hunk.old_lines:
+                # The file now ends with the line before the removed ones
+                newline = True
+        elif not hunk.new_newline:
+            raise PatchError("Hunk at line %s removes a newline before the "
+                             "end of the file" % hunk.old_start)
+
+    result.extend(lines[pos:])
+
+    if not result:
+        return ''
+    elif newline:
+        result.append('')
+
+    return '\n'.join(result)
+
+
+def parse_hunks(diff):
+    """
+    Returns the hunks of the unified diff of a single file. The header
+    lines before the first hunk are skipped.
+    """
+    hunks = []
+    hunk = None
+    old_left = new_left = 0
+    last_kind = None
+
+    for line in split_lines(diff)[0]:
+        if old_left > 0 or new_left > 0:
+            if line == '':
+                # Blank context lines sometimes lose their leading space
+                line = ' '
+
+            kind = line[0]
+
+            if kind == ' ':
+                hunk.old_lines.append(line[1:])
+                hunk.new_lines.append(line[1:])
+                old_left -= 1
+                new_left -= 1
+
+                if hunk.has_changes:
+                    hunk.trailing_context += 1
+                else:
+                    hunk.leading_context += 1
+            elif kind == '-':
+                hunk.old_lines.append(line[1:])
+                old_left -= 1
+            elif kind == '+':
+                hunk.new_lines.append(line[1:])
+                new_left -= 1
+            elif kind == NO_NEWLINE_MARKER and last_kind:
+                _strip_newline(hunk, last_kind)
+                continue
+            else:
+                raise PatchError("Unexpected line in hunk: %r" % line)
+
+            if old_left < 0 or new_left < 0:
+                raise PatchError("Hunk is longer than its header says")
+
+            if kind != ' ':
+                hunk.has_changes = True
+                hunk.trailing_context = 0
+
+            last_kind = kind
+        elif line.startswith(NO_NEWLINE_MARKER) and last_kind:
+            _strip_newline(hunk, last_kind)
+            last_kind = None
+        elif line.startswith('@@'):
+            m = HUNK_RE.match(line)
+
+            if not m:
+                raise PatchError("Invalid hunk header: %r" % line)
+
+            old_start, old_count, new_start, new_count = m.groups('1')
+            hunk = Hunk(int(old_start), int(old_count),
+                        int(new_start), int(new_count))
+            hunks.append(hunk)
+            old_left = hunk.old_count
+            new_left = hunk.new_count
+            last_kind = None
+        elif line.startswith('***'):
+            raise PatchError("Context diffs are not supported")
+        else:
+            # File headers before the first hunk or garbage after the last
+            last_kind = None
+
+    if old_left > 0 or new_left > 0:
+        raise PatchError("Hunk is shorter than its header says")
+
+    if not hunks:
+        raise PatchError("The diff has no hunks")
+
+    return hunks
+
+
+def split_lines(data):
+    """
+    Splits data into lines without their newlines. Returns the lines and
+    whether the last line ends with a newline. Unlike str.splitlines(),
+    only \\n ends a line.
+    """
+    lines = data.split('\n')
+
+    if lines[-1] == '':
+        lines.pop()
+        return lines, True
+
+    return lines, False
+
+
+def _strip_newline(hunk, kind):
+    if kind in ' -':
+        hunk.old_newline = False
+
+    if kind in ' +':
+        hunk.new_newline = False
+
+
+def _find_lines(lines, wanted, expected, lower, upper):
+    """
+    Returns the index closest to expected, between lower and upper, at
+    which lines contains the wanted lines, or None. Like patch, later
+    indexes are tried first.
+    """
+    if lower > upper:
+        return None
+
+    expected = min(max(expected, lower), upper)
+    size = len(wanted)
+
+    for distance in xrange(max(expected - lower, upper - expected) + 1):
+        for start in (expected + distance, expected - distance):
+            if (lower <= start <= upper and
+                (size == 0 or lines[start] == wanted[0]) and
+                lines[start:start + size] == wanted):
+                return start
+
+    return None
@@ -0,0 +1,172 @@
+import hashlib
+import threading
+
+
+class LineCodeTable(object):
+    """
+    Maps lines of text to the numbers compared by the differs.
+
+    A table can be shared by the differs of all revisions of a file. Lines
+    keep their codes from one differ to the next, and the codes and
+    interesting lines of the last max_files files are kept by content hash.
+    Diffing a file against a new revision then skips coding the lines of
+    the unchanged side and scanning them for interesting lines.
+
+    Lines are never removed from a table, as the differs using it rely on
+    their codes. Once it holds the codes of more than max_lines distinct
+    lines, the table is full and shouldn't be handed to new differs.
+    """
+    def __init__(self, max_files=0, max_lines=0):
+        self.max_files = max_files
+        self.max_lines = max_lines
+        self.lock = threading.Lock()
+        self.code_table = {}
+        self.last_code = 0
+        self.interesting_line_regexes = []
+        self.interesting_line_table = {}
+        self.files = {}
+        self.file_keys = []
+
+    def is_full(self):
+        """
+        Returns whether the table holds more than max_lines line codes.
+        """
+        return bool(self.max_lines) and len(self.code_table) > self.max_lines
+
+    def get_codes(self, lines, ignore_space, interesting_line_regexes):
+        """
+        Returns the codes of the lines and the interesting lines matching
+        the (name, regex) tuples, as a dictionary of lists of (line number,
+        line) tuples keyed by name.
+
+        Both are shared with other callers and must not be modified.
+        """
+        self.lock.acquire()
+        try:
+            if interesting_line_regexes != self.interesting_line_regexes:
+                # The interesting lines known so far were looked for with
+                # other regexes
+                self.interesting_line_regexes = list(interesting_line_regexes)
+                self.interesting_line_table = {}
+                self.files = {}
+                self.file_keys = []
+
+            if not self.max_files:
+                return self._gen_codes(lines, ignore_space)
+
+            data = ''.join(lines)
+
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+
+            key = (hashlib.sha1(data).hexdigest(), ignore_space)
+
+            if key in self.files:
+                self.file_keys.remove(key)
+            else:
+                self.files[key] = self._gen_codes(lines, ignore_space)
+
+                if len(self.file_keys) == self.max_files:
+                    del self.files[self.file_keys.pop(0)]
+
+            self.file_keys.append(key)
+
+            return self.files[key]
+        finally:
+            self.lock.release()
+
+    def _gen_codes(self, lines, ignore_space):
+        codes = []
+        interesting_lines = {}
+
+        for name, regex in self.interesting_line_regexes:
+            interesting_lines[name] = []
+
+        linenum = 0
+
+        for line in lines:
+            # TODO: Handle ignoring/triming spaces, ignoring casing, and
+            #       special hooks
+
+            raw_line = line
+            stripped_line = line.lstrip()
+
+            if ignore_space:
+                # We still want to show lines that contain only whitespace.
+                if len(stripped_line) > 0:
+                    line = stripped_line
+
+            interesting_line_name = None
+
+            try:
+                code = self.code_table[line]
+                interesting_line_name = \
+                    self.interesting_line_table.get(code, None)
+            except KeyError:
+                # This is a new, unrecorded line, so mark it and store it.
+                self.last_code += 1
+                code = self.last_code
+                self.code_table[line] = code
+
+                # Check to see if this is an interesting line that the caller
+                # wants recorded.
+                if stripped_line:
+                    for name, regex in self.interesting_line_regexes:
+                        if regex.match(raw_line):
+                            interesting_line_name = name
+                            self.interesting_line_table[code] = name
+                            break
+
+            if interesting_line_name:
+                interesting_lines[interesting_line_name].append((linenum,
+                                                                 raw_line))
+
+            codes.append(code)
+
+            linenum += 1
+
+        return codes, interesting_lines
+
+
+class LineCodeTableCache(object):
+    """
+    A per-process cache of line code tables, keyed by file.
+
+    Holds the tables of the max_tables files used last. Each table keeps
+    the codes of up to max_files revisions of its file. A table that holds
+    more than max_lines line codes is replaced by a new one, so that the
+    tables of files with many revisions don't grow without bounds. Differs
+    that still use the old table keep it until they're done.
+    """
+    def __init__(self, max_tables=100, max_files=8, max_lines=50000):
+        self.max_tables = max_tables
+        self.max_files = max_files
+        self.max_lines = max_lines
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.keys = []
+
+    def get_table(self, key):
+        """
+        Returns the line code table for the key, creating it if needed.
+        """
+        self.lock.acquire()
+        try:
+            if key in self.tables:
+                table = self.tables[key]
+                self.keys.remove(key)
+            else:
+                table = None
+
+            if table is None or table.is_full():
+                table = LineCodeTable(self.max_files, self.max_lines)
+                self.tables[key] = table
+
+            self.keys.append(key)
+
+            while len(self.keys) > self.max_tables:
+                del self.tables[self.keys.pop(0)]
+
+            return table
+        finally:
+            self.lock.release()
@@ -0,0 +1,47 @@
+import optparse
+
+from django.core.management.base import NoArgsCommand
+from django.db.models import Q
+
+from reviewboard.diffviewer.models import FileDiff
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option('--batch-size', type='int',
+                             dest='batch_size', default=200,
+                             help='The number of filediffs to load at '
+                                  'a time'),
+        )
+    help = ("Moves the diffs of filediffs saved by older versions into the "
+            "shared, compressed diff storage")
+    requires_model_validation = True
+
+    def handle_noargs(self, **options):
+        batch_size = options.get('batch_size', 200)
+        legacy_q = ((Q(diff_hash__isnull=True) & ~Q(diff64='')) |
+                    (Q(parent_diff_hash__isnull=True) &
+                     ~Q(parent_diff64='')))
+        last_id = 0
+        num_condensed = 0
+
+        while True:
+            filediffs = list(FileDiff.objects.filter(legacy_q,
+                                                     pk__gt=last_id)
+                             .order_by('pk')[:batch_size])
+
+            if not filediffs:
+                break
+
+            for filediff in filediffs:
+                # Setting the diffs again stores them in FileDiffData and
+                # clears the legacy fields when saved.
+                filediff.diff = filediff.diff
+                filediff.parent_diff = filediff.parent_diff
+                filediff.save()
+
+            last_id = filediffs[-1].pk
+            num_condensed += len(filediffs)
+
+            if int(options.get('verbosity', 1)):
+                print "Condensed %d filediffs" % num_condensed
@@ -0,0 +1,54 @@
+import optparse
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reviewboard.diffviewer.diffutils import warm_up_diffset
+from reviewboard.diffviewer.models import DiffSet, DiffSetWarmUp
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        optparse.make_option('--loop', action='store_true',
+                             dest='loop', default=False,
+                             help='Keep running and check for queued '
+                                  'warm-ups periodically'),
+        optparse.make_option('--interval', type='int',
+                             dest='interval', default=5,
+                             help='The number of seconds to wait between '
+                                  'checks when running with --loop'),
+        optparse.make_option('--processes', type='int',
+                             dest='processes', default=None,
+                             help='The number of processes generating '
+                                  'chunks (default: one per CPU)'),
+        )
+    args = '[diffset_id ...]'
+    help = ("Generates the diff chunks of queued diffsets, or of the given "
+            "diffsets, into the cache")
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        processes = options.get('processes', None)
+
+        if args:
+            for diffset_id in args:
+                try:
+                    diffset = DiffSet.objects.get(pk=diffset_id)
+                except (DiffSet.DoesNotExist, ValueError):
+                    raise CommandError("Diffset %s does not exist" %
+                                       diffset_id)
+
+                warm_up_diffset(diffset, processes)
+
+            return
+
+        interval = options.get('interval', 5)
+
+        while True:
+            for diffset in DiffSetWarmUp.objects.claim_all():
+                warm_up_diffset(diffset, processes)
+
+            if not options.get('loop', False):
+                break
+
+            time.sleep(interval)
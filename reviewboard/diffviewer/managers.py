@@ -0,0 +1,95 @@
+from hashlib import sha1
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Manager
+
+from djblets.siteconfig.models import SiteConfiguration
+
+
+class DiffSetWarmUpManager(Manager):
+    """A manager for DiffSetWarmUp models."""
+
+    def queue(self, diffset):
+        """Queues the generation of a diffset's chunks into the cache.
+
+        Nothing is queued unless warm-ups are enabled in the site
+        configuration. Returns the queued warm-up or None.
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+
+        if not siteconfig.get('diffviewer_warm_up_diffsets'):
+            return None
+
+        return self.create(diffset=diffset)
+
+    def claim_all(self):
+        """Removes all queued warm-ups and returns their diffsets, oldest
+        first.
+        """
+        diffsets = []
+        warm_up_ids = []
+
+        for warm_up in self.select_related('diffset').order_by('time_added'):
+            warm_up_ids.append(warm_up.pk)
+
+            if warm_up.diffset not in diffsets:
+                diffsets.append(warm_up.diffset)
+
+        self.filter(pk__in=warm_up_ids).delete()
+
+        return diffsets
+
+
+class FileDiffDataManager(Manager):
+    """A manager for FileDiffData models."""
+
+    # Number of attempts at adding a reference while concurrent requests
+    # store or delete the same data
+    MAX_REFERENCE_ATTEMPTS = 3
+
+    @transaction.commit_on_success
+    def get_or_create_from_data(self, data):
+        """Returns the stored data with the given contents, storing it first
+        if there's none yet, and adds a reference to it.
+
+        The reference is added with an UPDATE, which reads the current row
+        rather than the transaction's snapshot, and locks it until the
+        transaction ends. If there's no row to update, such as when a
+        concurrent release deleted it, the data is stored again. If a
+        concurrent request stored it first, the reference is added to its
+        row on the next attempt. The IntegrityError of the last attempt is
+        raised once MAX_REFERENCE_ATTEMPTS attempts failed.
+        """
+        binary_hash = sha1(data).hexdigest()
+
+        for attempt in range(self.MAX_REFERENCE_ATTEMPTS):
+            if self.filter(binary_hash=binary_hash).update(
+                    ref_count=F('ref_count') + 1):
+                return self.get(binary_hash=binary_hash)
+
+            sid = transaction.savepoint()
+
+            try:
+                filediff_data = self.create(binary_hash=binary_hash,
+                                            content=data,
+                                            ref_count=1)
+                transaction.savepoint_commit(sid)
+                return filediff_data
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+
+                if attempt + 1 == self.MAX_REFERENCE_ATTEMPTS:
+                    raise
+
+    @transaction.commit_on_success
+    def release(self, pk):
+        """Removes a reference to the stored data with the given ID, and
+        deletes the data once nothing references it.
+
+        The data is only deleted if no FileDiff uses it anymore, even if
+        the reference count has drifted.
+        """
+        self.filter(pk=pk).update(ref_count=F('ref_count') - 1)
+        self.filter(pk=pk, ref_count__lte=0,
+                    filediffs__isnull=True,
+                    parent_filediffs__isnull=True).delete()
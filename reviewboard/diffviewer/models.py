@@ -1,12 +1,47 @@
+import zlib
 from datetime import datetime
 
 from django.db import models
+from django.db.models.signals import post_delete
 from django.utils.translation import ugettext_lazy as _
 from djblets.util.fields import Base64Field
 
+from reviewboard.diffviewer.managers import DiffSetWarmUpManager, \
+                                           FileDiffDataManager
 from reviewboard.scmtools.models import Repository
 
 
+class FileDiffData(models.Model):
+    """
+    The contents of a diff, shared by all FileDiffs with the same diff or
+    parent diff.
+
+    The contents are stored compressed and are looked up by their SHA1
+    hash. ref_count is the number of diffs and parent diffs of FileDiffs
+    that use them.
+    """
+    binary_hash = models.CharField(_("hash"), max_length=40, unique=True)
+    binary = Base64Field(_("compressed data"))
+    ref_count = models.IntegerField(_("reference count"), default=0)
+
+    objects = FileDiffDataManager()
+
+    def _get_content(self):
+        if not hasattr(self, '_content'):
+            self._content = zlib.decompress(self.binary)
+
+        return self._content
+
+    def _set_content(self, content):
+        self._content = content
+        self.binary = zlib.compress(content)
+
+    content = property(_get_content, _set_content)
+
+    def __unicode__(self):
+        return self.binary_hash
+
+
 class FileDiff(models.Model):
     """
     A diff of a single file.
@@ -32,16 +67,109 @@ class FileDiff(models.Model):
                                        max_length=512)
     dest_detail = models.CharField(_("destination file details"),
                                    max_length=512)
-    diff = Base64Field(_("diff"), db_column="diff_base64")
+    diff64 = Base64Field(_("diff"), db_column="diff_base64", blank=True)
+    diff_hash = models.ForeignKey(FileDiffData, null=True, blank=True,
+                                  related_name='filediffs',
+                                  verbose_name=_("diff data"))
     binary = models.BooleanField(_("binary file"), default=False)
-    parent_diff = Base64Field(_("parent diff"), db_column="parent_diff_base64",
-                              blank=True)
+    parent_diff64 = Base64Field(_("parent diff"),
+                                db_column="parent_diff_base64",
+                                blank=True)
+    parent_diff_hash = models.ForeignKey(FileDiffData, null=True, blank=True,
+                                         related_name='parent_filediffs',
+                                         verbose_name=_("parent diff data"))
     status = models.CharField(_("status"), max_length=1, choices=STATUSES)
 
     @property
     def deleted(self):
         return self.status == 'D'
 
+    def _get_diff(self):
+        return self._get_data('diff_hash', 'diff64')
+
+    def _set_diff(self, diff):
+        self._set_data('diff_hash', diff)
+
+    diff = property(_get_diff, _set_diff)
+
+    def _get_parent_diff(self):
+        return self._get_data('parent_diff_hash', 'parent_diff64')
+
+    def _set_parent_diff(self, parent_diff):
+        self._set_data('parent_diff_hash', parent_diff)
+
+    parent_diff = property(_get_parent_diff, _set_parent_diff)
+
+    def has_same_diff(self, filediff):
+        """
+        Returns whether this filediff has the same diff as another one.
+
+        Diffs stored in FileDiffData are compared by their hashes, without
+        loading them.
+        """
+        if (self.diff_hash_id and filediff.diff_hash_id and
+            not self._has_pending_data('diff_hash') and
+            not filediff._has_pending_data('diff_hash')):
+            return self.diff_hash_id == filediff.diff_hash_id
+
+        return self.diff == filediff.diff
+
+    def _has_pending_data(self, hash_field):
+        return hash_field in self.__dict__.get('_pending_data', {})
+
+    def _get_data(self, hash_field, legacy_field):
+        """
+        Returns a diff set since the last save, or else the stored diff.
+        Filediffs saved before diffs were stored in FileDiffData keep their
+        diffs in the legacy field.
+        """
+        if self._has_pending_data(hash_field):
+            return self._pending_data[hash_field]
+        elif getattr(self, hash_field + '_id'):
+            return getattr(self, hash_field).content
+        else:
+            return getattr(self, legacy_field)
+
+    def _set_data(self, hash_field, data):
+        self.__dict__.setdefault('_pending_data', {})[hash_field] = data
+
+    def save(self, **kwargs):
+        """
+        Saves the filediff.
+
+        The diff and parent diff set since the last save are stored in the
+        FileDiffData shared with other filediffs, and the references to the
+        data they replace are released.
+        """
+        pending_data = self.__dict__.pop('_pending_data', {})
+        released_ids = []
+
+        for hash_field, legacy_field in (('diff_hash', 'diff64'),
+                                         ('parent_diff_hash',
+                                          'parent_diff64')):
+            if hash_field not in pending_data:
+                continue
+
+            old_id = getattr(self, hash_field + '_id')
+            data = pending_data[hash_field]
+
+            if data:
+                filediff_data = \
+                    FileDiffData.objects.get_or_create_from_data(data)
+            else:
+                filediff_data = None
+
+            setattr(self, hash_field, filediff_data)
+            setattr(self, legacy_field, '')
+
+            if old_id:
+                released_ids.append(old_id)
+
+        super(FileDiff, self).save(**kwargs)
+
+        for pk in released_ids:
+            FileDiffData.objects.release(pk)
+
     def __unicode__(self):
         return u"%s (%s) -> %s (%s)" % (self.source_file, self.source_revision,
                                         self.dest_file, self.dest_detail)
@@ -92,6 +220,23 @@ class DiffSet(models.Model):
         ordering = ['revision', 'timestamp']
 
 
+class DiffSetWarmUp(models.Model):
+    """
+    A queued generation of a diffset's chunks into the cache.
+
+    Queued warm-ups are run by the warmdiffs management command, so that
+    the chunks are cached before reviewers open the diff.
+    """
+    diffset = models.ForeignKey(DiffSet, related_name='warm_ups',
+                                verbose_name=_("diff set"))
+    time_added = models.DateTimeField(_("time added"), default=datetime.now)
+
+    objects = DiffSetWarmUpManager()
+
+    def __unicode__(self):
+        return u"Warm-up of %s" % self.diffset
+
+
 class DiffSetHistory(models.Model):
     """
     A collection of diffsets.
@@ -107,3 +252,13 @@ class DiffSetHistory(models.Model):
 
     class Meta:
         verbose_name_plural = "Diff set histories"
+
+
+def _release_filediff_data(sender, instance, **kwargs):
+    """Releases the data of the diff and parent diff of a deleted filediff."""
+    for pk in (instance.diff_hash_id, instance.parent_diff_hash_id):
+        if pk:
+            FileDiffData.objects.release(pk)
+
+
+post_delete.connect(_release_filediff_data, sender=FileDiff)
@@ -1,3 +1,6 @@
+from reviewboard.diffviewer.linecodes import LineCodeTable
+
+
 class MyersDiffer:
     """
     An implementation of Eugene Myers's O(ND) Diff algorithm based on GNU diff.
@@ -20,20 +23,22 @@ class MyersDiffer:
             self.undiscarded_lines = 0
             self.real_indexes = []
 
-    def __init__(self, a, b, ignore_space=False):
+    def __init__(self, a, b, ignore_space=False, line_codes=None):
         if type(a) != type(b):
             raise TypeError
 
+        if line_codes is None:
+            line_codes = LineCodeTable()
+
         self.a = a
         self.b = b
-        self.code_table = {}
+        self.line_codes = line_codes
         self.last_code = 0
         self.a_data = self.b_data = None
         self.ignore_space = ignore_space
         self.minimal_diff = False
         self.interesting_line_regexes = []
         self.interesting_lines = [{}, {}]
-        self.interesting_line_table = {}
 
         # SMS State
         self.max_lines = 0
@@ -185,55 +190,21 @@ class MyersDiffer:
         Converts all unique lines of text into unique numbers. Comparing
         lists of numbers is faster than comparing lists of strings.
         """
-        codes = []
+        codes, interesting_lines = \
+            self.line_codes.get_codes(lines, self.ignore_space,
+                                      self.interesting_line_regexes)
 
-        linenum = 0
+        # The table may be shared with other differs and can have handed
+        # out higher codes in the meantime.
+        self.last_code = self.line_codes.last_code
 
         if is_modified_file:
-            interesting_lines = self.interesting_lines[1]
+            index = 1
         else:
-            interesting_lines = self.interesting_lines[0]
-
-        for line in lines:
-            # TODO: Handle ignoring/triming spaces, ignoring casing, and
-            #       special hooks
-
-            raw_line = line
-            stripped_line = line.lstrip()
-
-            if self.ignore_space:
-                # We still want to show lines that contain only whitespace.
-                if len(stripped_line) > 0:
-                    line = stripped_line
-
-            interesting_line_name = None
-
-            try:
-                code = self.code_table[line]
-                interesting_line_name = \
-                    self.interesting_line_table.get(code, None)
-            except KeyError:
-                # This is a new, unrecorded line, so mark it and store it.
-                self.last_code += 1
-                code = self.last_code
-                self.code_table[line] = code
-
-                # Check to see if this is an interesting line that the caller
-                # wants recorded.
-                if stripped_line:
-                    for name, regex in self.interesting_line_regexes:
-                        if regex.match(raw_line):
-                            interesting_line_name = name
-                            self.interesting_line_table[code] = name
-                            break
-
-            if interesting_line_name:
-                interesting_lines[interesting_line_name].append((linenum,
-                                                                 raw_line))
-
-            codes.append(code)
+            index = 0
 
-            linenum += 1
+        for name, found in interesting_lines.iteritems():
+            self.interesting_lines[index][name] = list(found)
 
         return codes
 
@@ -594,135 +565,144 @@ class MyersDiffer:
                     j -= 1
 
     def _discard_confusing_lines(self):
-        def build_discard_list(data, discards, counts):
-            many = 5 * self._very_approx_sqrt(data.length / 64)
+        a_code_counts = self._count_codes(self.a_data)
+        b_code_counts = self._count_codes(self.b_data)
 
-            for i, item in enumerate(data.data):
-                if item != 0:
-                    num_matches = counts[item]
+        a_discarded = self._build_discard_list(self.a_data, b_code_counts)
+        b_discarded = self._build_discard_list(self.b_data, a_code_counts)
 
-                    if num_matches == 0:
-                        discards[i] = self.DISCARD_FOUND
-                    elif num_matches > many:
-                        discards[i] = self.DISCARD_CANCEL
+        self._check_discard_runs(self.a_data, a_discarded)
+        self._check_discard_runs(self.b_data, b_discarded)
 
-        def scan_run(discards, i, length, index_func):
-            consec = 0
+        self._discard_lines(self.a_data, a_discarded)
+        self._discard_lines(self.b_data, b_discarded)
 
-            for j in xrange(length):
-                index = index_func(i, j)
-                discard = discards[index]
+    def _count_codes(self, data):
+        """
+        Returns a list mapping each line code to the number of lines with
+        that code in the data.
+        """
+        counts = [0] * (1 + self.last_code)
 
-                if j >= 8 and discard == self.DISCARD_FOUND:
-                    break
+        for item in data.data:
+            counts[item] += 1
 
-                if discard == self.DISCARD_FOUND:
-                    consec += 1
-                else:
-                    consec = 0
+        return counts
+
+    def _build_discard_list(self, data, counts):
+        """
+        Returns the provisional discard states of the lines of the data,
+        based on how often each line occurs in the other file.
+        """
+        discards = [0] * data.length
+        many = 5 * self._very_approx_sqrt(data.length / 64)
 
-                    if discard == self.DISCARD_CANCEL:
-                        discards[index] = self.DISCARD_NONE
+        for i, item in enumerate(data.data):
+            if item != 0:
+                num_matches = counts[item]
 
-                if consec == 3:
-                    break
+                if num_matches == 0:
+                    discards[i] = self.DISCARD_FOUND
+                elif num_matches > many:
+                    discards[i] = self.DISCARD_CANCEL
 
-        def check_discard_runs(data, discards):
-            i = 0
-            while i < data.length:
-                # Cancel the provisional discards that are not in the middle
-                # of a run of discards
-                if discards[i] == self.DISCARD_CANCEL:
-                    discards[i] = self.DISCARD_NONE
-                elif discards[i] == self.DISCARD_FOUND:
-                    # We found a provisional discard
-                    provisional = 0
-
-                    # Find the end of this run of discardable lines and count
-                    # how many are provisionally discardable.
-                    #for j in xrange(i, data.length):
-                    j = i
-                    while j < data.length:
-                        if discards[j] == self.DISCARD_NONE:
-                            break
-                        elif discards[j] == self.DISCARD_CANCEL:
-                            provisional += 1
-                        j += 1
+        return discards
 
-                    # Cancel the provisional discards at the end and shrink
-                    # the run.
-                    while j > i and discards[j - 1] == self.DISCARD_CANCEL:
-                        j -= 1
-                        discards[j] = 0
-                        provisional -= 1
-
-                    length = j - i
-
-                    # If 1/4 of the lines are provisional, cancel discarding
-                    # all the provisional lines in the run.
-                    if provisional * 4 > length:
-                        while j > i:
-                            j -= 1
-                            if discards[j] == self.DISCARD_CANCEL:
-                                discards[j] = self.DISCARD_NONE
-                    else:
-                        minimum = 1 + self._very_approx_sqrt(length / 4)
-                        j = 0
-                        consec = 0
-                        while j < length:
-                            if discards[i + j] != self.DISCARD_CANCEL:
-                                consec = 0
-                            else:
-                                consec += 1
-                                if minimum == consec:
-                                    j -= consec
-                                elif minimum < consec:
-                                    discards[i + j] = self.DISCARD_NONE
-
-                            j += 1
-
-                        scan_run(discards, i, length, lambda x,y: x + y)
-                        i += length - 1
-                        scan_run(discards, i, length, lambda x,y: x - y)
+    def _scan_run(self, discards, i, length, index_func):
+        consec = 0
 
-                i += 1
+        for j in xrange(length):
+            index = index_func(i, j)
+            discard = discards[index]
+
+            if j >= 8 and discard == self.DISCARD_FOUND:
+                break
 
-        def discard_lines(data, discards):
-            j = 0
-            for i, item in enumerate(data.data):
-                if self.minimal_diff or discards[i] == self.DISCARD_NONE:
-                    data.undiscarded[j] = item
-                    data.real_indexes[j] = i
+            if discard == self.DISCARD_FOUND:
+                consec += 1
+            else:
+                consec = 0
+
+                if discard == self.DISCARD_CANCEL:
+                    discards[index] = self.DISCARD_NONE
+
+            if consec == 3:
+                break
+
+    def _check_discard_runs(self, data, discards):
+        i = 0
+        while i < data.length:
+            # Cancel the provisional discards that are not in the middle
+            # of a run of discards
+            if discards[i] == self.DISCARD_CANCEL:
+                discards[i] = self.DISCARD_NONE
+            elif discards[i] == self.DISCARD_FOUND:
+                # We found a provisional discard
+                provisional = 0
+
+                # Find the end of this run of discardable lines and count
+                # how many are provisionally discardable.
+                #for j in xrange(i, data.length):
+                j = i
+                while j < data.length:
+                    if discards[j] == self.DISCARD_NONE:
+                        break
+                    elif discards[j] == self.DISCARD_CANCEL:
+                        provisional += 1
                     j += 1
-                else:
-                    data.modified[i] = True
 
-            data.undiscarded_lines = j
+                # Cancel the provisional discards at the end and shrink
+                # the run.
+                while j > i and discards[j - 1] == self.DISCARD_CANCEL:
+                    j -= 1
+                    discards[j] = 0
+                    provisional -= 1
 
+                length = j - i
 
-        self.a_data.undiscarded = [0] * self.a_data.length
-        self.b_data.undiscarded = [0] * self.b_data.length
-        self.a_data.real_indexes = [0] * self.a_data.length
-        self.b_data.real_indexes = [0] * self.b_data.length
-        a_discarded = [0] * self.a_data.length
-        b_discarded = [0] * self.b_data.length
-        a_code_counts = [0] * (1 + self.last_code)
-        b_code_counts = [0] * (1 + self.last_code)
+                # If 1/4 of the lines are provisional, cancel discarding
+                # all the provisional lines in the run.
+                if provisional * 4 > length:
+                    while j > i:
+                        j -= 1
+                        if discards[j] == self.DISCARD_CANCEL:
+                            discards[j] = self.DISCARD_NONE
+                else:
+                    minimum = 1 + self._very_approx_sqrt(length / 4)
+                    j = 0
+                    consec = 0
+                    while j < length:
+                        if discards[i + j] != self.DISCARD_CANCEL:
+                            consec = 0
+                        else:
+                            consec += 1
+                            if minimum == consec:
+                                j -= consec
+                            elif minimum < consec:
+                                discards[i + j] = self.DISCARD_NONE
 
-        for item in self.a_data.data:
-            a_code_counts[item] += 1
+                        j += 1
 
-        for item in self.b_data.data:
-            b_code_counts[item] += 1
+                    self._scan_run(discards, i, length, lambda x,y: x + y)
+                    i += length - 1
+                    self._scan_run(discards, i, length, lambda x,y: x - y)
 
-        build_discard_list(self.a_data, a_discarded, b_code_counts)
-        build_discard_list(self.b_data, b_discarded, a_code_counts)
+            i += 1
+
+    def _discard_lines(self, data, discards):
+        data.undiscarded = [0] * data.length
+        data.real_indexes = [0] * data.length
 
-        check_discard_runs(self.a_data, a_discarded)
-        check_discard_runs(self.b_data, b_discarded)
+        j = 0
+        for i, item in enumerate(data.data):
+            if self.minimal_diff or discards[i] == self.DISCARD_NONE:
+                data.undiscarded[j] = item
+                data.real_indexes[j] = i
+                j += 1
+            else:
+                data.modified[i] = True
 
-        discard_lines(self.a_data, a_discarded)
-        discard_lines(self.b_data, b_discarded)
+        data.undiscarded_lines = j
 
 
     def _very_approx_sqrt(self, i):
@@ -0,0 +1,229 @@
+from bisect import bisect_left
+
+from reviewboard.diffviewer.myersdiff import MyersDiffer
+
+
+class PatienceDiffer(MyersDiffer):
+    """
+    A differ that anchors on lines that are unique in both files.
+
+    Lines that occur exactly once in both files are matched up along their
+    longest increasing subsequence, as in the patience diff algorithm, and
+    the regions between them are diffed on their own. Regions without
+    unique lines are split at the longest match around the rarest common
+    line, as in histogram diffs. Small regions are diffed by MyersDiffer.
+
+    The Myers algorithm gets slow on large regions with many differences,
+    which is common in generated files. Regions that are too large for it
+    and have no line to anchor on are split in half on both sides instead,
+    which bounds the time needed for any pair of files at the cost of a
+    less accurate diff around the split.
+    """
+
+    # Regions with up to this many lines on both sides together are diffed
+    # by MyersDiffer
+    MYERS_REGION_LINES = 200
+
+    # Regions without anchors up to this many lines are still diffed by
+    # MyersDiffer. Larger ones are split.
+    MYERS_MAX_REGION_LINES = 10000
+
+    # Lines occurring more often than this in a region are not anchored on
+    MAX_ANCHOR_OCCURRENCES = 64
+
+    def _gen_diff_data(self):
+        """
+        Generate all the diff data needed to return opcodes or the diff ratio.
+        This is only called once during the liftime of a PatienceDiffer
+        instance.
+        """
+        if self.a_data and self.b_data:
+            return
+
+        self.a_data = self.DiffData(self._gen_diff_codes(self.a, False))
+        self.b_data = self.DiffData(self._gen_diff_codes(self.b, True))
+
+        self._diff_regions()
+        self._shift_chunks(self.a_data, self.b_data)
+        self._shift_chunks(self.b_data, self.a_data)
+
+    def _diff_regions(self):
+        a = self.a_data.data
+        b = self.b_data.data
+
+        # Regions still to diff. A stack instead of recursion, since large
+        # files can be split into very many regions.
+        regions = [(0, self.a_data.length, 0, self.b_data.length)]
+
+        while regions:
+            a_lower, a_upper, b_lower, b_upper = regions.pop()
+
+            # Skip equal lines at the start and the end
+            while a_lower < a_upper and b_lower < b_upper and \
+                  a[a_lower] == b[b_lower]:
+                a_lower += 1
+                b_lower += 1
+
+            while a_upper > a_lower and b_upper > b_lower and \
+                  a[a_upper - 1] == b[b_upper - 1]:
+                a_upper -= 1
+                b_upper -= 1
+
+            num_lines = a_upper - a_lower + b_upper - b_lower
+
+            if a_lower == a_upper or b_lower == b_upper:
+                self._mark_modified(a_lower, a_upper, b_lower, b_upper)
+                continue
+
+            if num_lines <= self.MYERS_REGION_LINES:
+                self._diff_region_myers(a_lower, a_upper, b_lower, b_upper)
+                continue
+
+            matches = \
+                self._find_unique_matches(a_lower, a_upper,
+                                          b_lower, b_upper) or \
+                self._find_rare_match(a_lower, a_upper, b_lower, b_upper)
+
+            if matches:
+                # Diff the regions around the matching blocks
+                for i, j, length in matches:
+                    regions.append((a_lower, i, b_lower, j))
+                    a_lower = i + length
+                    b_lower = j + length
+
+                regions.append((a_lower, a_upper, b_lower, b_upper))
+            elif num_lines <= self.MYERS_MAX_REGION_LINES:
+                self._diff_region_myers(a_lower, a_upper, b_lower, b_upper)
+            else:
+                a_middle = (a_lower + a_upper) / 2
+                b_middle = (b_lower + b_upper) / 2
+                regions.append((a_lower, a_middle, b_lower, b_middle))
+                regions.append((a_middle, a_upper, b_middle, b_upper))
+
+    def _find_unique_matches(self, a_lower, a_upper, b_lower, b_upper):
+        """
+        Returns the lines that are unique in both regions and appear in the
+        same order, as a list of (a index, b index, 1) tuples.
+        """
+        a = self.a_data.data
+        b = self.b_data.data
+
+        a_counts = {}
+        a_indexes = {}
+        for i in xrange(a_lower, a_upper):
+            a_counts[a[i]] = a_counts.get(a[i], 0) + 1
+            a_indexes[a[i]] = i
+
+        b_counts = {}
+        for j in xrange(b_lower, b_upper):
+            b_counts[b[j]] = b_counts.get(b[j], 0) + 1
+
+        # Pairs of unique lines, ordered by their index in b
+        pairs = [(a_indexes[b[j]], j)
+                 for j in xrange(b_lower, b_upper)
+                 if b_counts[b[j]] == 1 and a_counts.get(b[j]) == 1]
+
+        # Find the longest increasing subsequence of the indexes in a by
+        # patience sorting, remembering the top of the previous pile for
+        # each pair.
+        pile_tops = []
+        pile_top_pairs = []
+        previous = [None] * len(pairs)
+
+        for n, (i, j) in enumerate(pairs):
+            pile = bisect_left(pile_tops, i)
+
+            if pile > 0:
+                previous[n] = pile_top_pairs[pile - 1]
+
+            if pile == len(pile_tops):
+                pile_tops.append(i)
+                pile_top_pairs.append(n)
+            else:
+                pile_tops[pile] = i
+                pile_top_pairs[pile] = n
+
+        matches = []
+
+        if pile_top_pairs:
+            n = pile_top_pairs[-1]
+
+            while n is not None:
+                i, j = pairs[n]
+                matches.append((i, j, 1))
+                n = previous[n]
+
+            matches.reverse()
+
+        return matches
+
+    def _find_rare_match(self, a_lower, a_upper, b_lower, b_upper):
+        """
+        Returns the longest block of equal lines around the rarest line
+        common to both regions, as a list with one (a index, b index,
+        length) tuple. Returns an empty list if all common lines are too
+        frequent to anchor on.
+        """
+        a = self.a_data.data
+        b = self.b_data.data
+
+        a_occurrences = {}
+        for i in xrange(a_lower, a_upper):
+            a_occurrences.setdefault(a[i], []).append(i)
+
+        best = None
+        best_count = self.MAX_ANCHOR_OCCURRENCES + 1
+        best_length = 0
+
+        j = b_lower
+        while j < b_upper:
+            next_j = j + 1
+            occurrences = a_occurrences.get(b[j], [])
+
+            if 0 < len(occurrences) <= best_count:
+                for i in occurrences:
+                    # Extend the match in both directions
+                    start_i, start_j = i, j
+                    while start_i > a_lower and start_j > b_lower and \
+                          a[start_i - 1] == b[start_j - 1]:
+                        start_i -= 1
+                        start_j -= 1
+
+                    end_i, end_j = i + 1, j + 1
+                    while end_i < a_upper and end_j < b_upper and \
+                          a[end_i] == b[end_j]:
+                        end_i += 1
+                        end_j += 1
+
+                    length = end_i - start_i
+
+                    if len(occurrences) < best_count or length > best_length:
+                        best = (start_i, start_j, length)
+                        best_count = len(occurrences)
+                        best_length = length
+
+                    # The lines within this match have been looked at
+                    next_j = max(next_j, end_j)
+
+            j = next_j
+
+        if best:
+            return [best]
+
+        return []
+
+    def _diff_region_myers(self, a_lower, a_upper, b_lower, b_upper):
+        differ = MyersDiffer(self.a[a_lower:a_upper], self.b[b_lower:b_upper],
+                             self.ignore_space)
+
+        for tag, i1, i2, j1, j2 in differ.get_opcodes():
+            if tag != "equal":
+                self._mark_modified(a_lower + i1, a_lower + i2,
+                                    b_lower + j1, b_lower + j2)
+
+    def _mark_modified(self, a_lower, a_upper, b_lower, b_upper):
+        for i in xrange(a_lower, a_upper):
+            self.a_data.modified[i] = True
+
+        for j in xrange(b_lower, b_upper):
+            self.b_data.modified[j] = True
@@ -1,13 +1,22 @@
 import os
 import unittest
 
+import nose
+from django.db import IntegrityError
 from django.test import TestCase
 from djblets.siteconfig.models import SiteConfiguration
 
-from reviewboard.diffviewer.models import DiffSet, FileDiff
+from reviewboard.diffviewer.models import DiffSet, DiffSetWarmUp, FileDiff, \
+                                          FileDiffData
 from reviewboard.diffviewer.templatetags.difftags import highlightregion
+from reviewboard.diffviewer.chunkformat import ChunkFormatError, \
+                                              decode_chunks, encode_chunks
 import reviewboard.diffviewer.diffutils as diffutils
+from reviewboard.diffviewer.hunkpatch import PatchError, apply_patch
+from reviewboard.diffviewer.linecodes import LineCodeTable, \
+                                            LineCodeTableCache
 import reviewboard.diffviewer.parser as diffparser
+from reviewboard.scmtools.core import PRE_CREATION
 from reviewboard.scmtools.models import Repository
 
 
@@ -35,6 +44,87 @@ class MyersDifferTest(TestCase):
                           ("equal",   5, 8, 9, 12)])
 
 
+    def testArrayDiffer(self):
+        """Testing array differ against myers differ"""
+        if not diffutils.ArrayMyersDiffer.is_available():
+            raise nose.SkipTest('NumPy is not installed')
+
+        prefix = os.path.join(os.path.dirname(__file__), 'testdata')
+
+        for filename in os.listdir(os.path.join(prefix, 'new_src')):
+            if not os.path.exists(os.path.join(prefix, 'orig_src', filename)):
+                continue
+
+            a = open(os.path.join(prefix, 'orig_src', filename)).readlines()
+            b = open(os.path.join(prefix, 'new_src', filename)).readlines()
+
+            for old, new in ((a, b), (b, a), (a, a), (a, []), ([], b)):
+                self.assertEqual(
+                    list(diffutils.ArrayMyersDiffer(old, new).get_opcodes()),
+                    list(diffutils.MyersDiffer(old, new).get_opcodes()))
+
+        # Runs of equal lines longer than the vectorization threshold
+        a = ['%d\n' % (i % 50) for i in range(500)]
+        b = a[:100] + ['x\n'] + a[130:400] + a[:20] + a[400:]
+        self.assertEqual(
+            list(diffutils.ArrayMyersDiffer(a, b).get_opcodes()),
+            list(diffutils.MyersDiffer(a, b).get_opcodes()))
+
+    def testPatienceDiffer(self):
+        """Testing patience differ"""
+        # Small files are diffed by the myers differ
+        a = ['1\n', '2\n', '3\n', '4\n']
+        b = ['1\n', '5\n', '3\n']
+        self.assertEqual(
+            list(diffutils.PatienceDiffer(a, b).get_opcodes()),
+            list(diffutils.MyersDiffer(a, b).get_opcodes()))
+
+        # Large, repetitive files are split at unique lines
+        a = ['%d\n' % (i % 10) for i in range(1000)]
+        b = a[:300] + ['unique\n'] + a[300:700] + ['other\n'] + a[700:]
+        self.assertEqual(list(diffutils.PatienceDiffer(a, b).get_opcodes()),
+                         [('equal', 0, 300, 0, 300),
+                          ('insert', 300, 300, 300, 301),
+                          ('equal', 300, 700, 301, 701),
+                          ('insert', 700, 700, 701, 702),
+                          ('equal', 700, 1000, 702, 1002)])
+
+        # Repetitive diffs are compared with the patience differ
+        repetitive = ''.join(['+%d\n' % (i % 10) for i in range(3000)])
+        varied = ''.join(['+%d\n' % i for i in range(3000)])
+        line_counts = [diffutils.get_diff_line_counts(repetitive)]
+        self.assertEqual(diffutils.get_diff_compat_version(line_counts),
+                         diffutils.PATIENCE_DIFF_COMPAT_VERSION)
+        line_counts = [diffutils.get_diff_line_counts(varied)]
+        self.assertEqual(diffutils.get_diff_compat_version(line_counts),
+                         diffutils.DEFAULT_DIFF_COMPAT_VERSION)
+
+    def testSharedLineCodes(self):
+        """Testing myers differ with shared line codes"""
+        line_codes = LineCodeTable(max_files=2)
+        a = ['1\n', '2\n', '3\n']
+        b = ['1\n', '4\n', '3\n']
+        c = ['1\n', '4\n', '5\n']
+
+        for old, new in ((a, b), (b, c), (a, c)):
+            differ = diffutils.MyersDiffer(old, new, line_codes=line_codes)
+            self.assertEqual(
+                list(differ.get_opcodes()),
+                list(diffutils.MyersDiffer(old, new).get_opcodes()))
+
+        self.assertEqual(line_codes.last_code, 5)
+        self.assertEqual(len(line_codes.files), 2)
+
+        # Full tables are replaced by new ones
+        tables = LineCodeTableCache(max_lines=4)
+        table = tables.get_table('file')
+        table.get_codes(a, False, [])
+        self.assertTrue(tables.get_table('file') is table)
+
+        table.get_codes(c, False, [])
+        self.assertTrue(table.is_full())
+        self.assertFalse(tables.get_table('file') is table)
+
     def __test_diff(self, a, b, expected):
         opcodes = list(diffutils.MyersDiffer(a, b).get_opcodes())
         self.assertEquals(opcodes, expected)
@@ -223,6 +313,87 @@ class DiffParserTest(unittest.TestCase):
         diff = self._get_file('diffs', 'unified', 'README.diff')
         self.assertRaises(Exception, lambda: diffutils.patch(diff, old, file))
 
+    def testCachedPatch(self):
+        """Testing patching with the patched file cache"""
+        file = 'foo.c'
+
+        old = self._get_file('orig_src', file)
+        new = self._get_file('new_src', file)
+        diff = self._get_file('diffs', 'unified', 'foo.c.diff')
+
+        for i in range(2):
+            self.assertEqual(diffutils.get_cached_patch(diff, old, file), new)
+
+        self.assertEqual(diffutils.get_cached_patch('', old, file), old)
+
+    def testHunkPatch(self):
+        """Testing in-process patching"""
+        old = 'a\nb\nc\nd\n'
+        diff = '--- test.c\n+++ test.c\n@@ -2,3 +2,3 @@\n b\n-c\n+C\n d\n'
+        self.assertEqual(apply_patch(diff, old), 'a\nb\nC\nd\n')
+
+        # Hunks are applied at an offset if lines were added before them
+        self.assertEqual(apply_patch(diff, 'x\n' + old), 'x\na\nb\nC\nd\n')
+
+        diff = '@@ -1 +1 @@\n-a\n+b\n\\ No newline at end of file\n'
+        self.assertEqual(apply_patch(diff, 'a\n'), 'b')
+
+        # Hunks that don't match are left to patch
+        self.assertRaises(PatchError, lambda: apply_patch(diff, 'x\n'))
+
+    def testEncodedChunks(self):
+        """Testing encoding and decoding cached chunks"""
+        chunks = [
+            {
+                'lines': [[1, 1, 'a', [], 1, 'a', [], False]],
+                'numlines': 1,
+                'change': 'equal',
+                'collapsable': False,
+                'meta': {},
+            },
+            {
+                'lines': [[2, 2, 'b', [(0, 1)], 2, 'B', [(0, 1)], False],
+                          [3, '', '', [], 3, 'c', [], False]],
+                'numlines': 2,
+                'change': 'replace',
+                'collapsable': False,
+                'meta': {'whitespace_lines': [], 'whitespace_chunk': False},
+            },
+            {
+                'lines': [[4, 3, 'd', [], '', '', [], False, 9]],
+                'numlines': 1,
+                'change': 'delete',
+                'collapsable': False,
+                'meta': {'moved': {3: 9}},
+            },
+        ]
+
+        for compress in (False, True):
+            decoded = decode_chunks(encode_chunks(chunks, compress))
+            self.assertEqual(len(decoded), len(chunks))
+            self.assertEqual(decoded[1].get_lines(1), chunks[1]['lines'][1:])
+
+            for chunk, decoded_chunk in zip(chunks, decoded):
+                self.assertEqual(decoded_chunk['change'], chunk['change'])
+                self.assertEqual(decoded_chunk['meta'], chunk['meta'])
+                self.assertEqual(decoded_chunk['lines'], chunk['lines'])
+
+        self.assertRaises(ChunkFormatError,
+                          lambda: decode_chunks('not encoded chunks'))
+
+    def testHighlightingRanges(self):
+        """Testing highlighting ranges of lines"""
+        data = 'x = 1\n"""\nfoo\nbar\n"""\ny = 2\n'
+        lines = diffutils.apply_pygments(data, 'test.py')
+        ranged_lines = diffutils.apply_pygments(data, 'test.py',
+                                                [(0, 1), (3, 4)])
+
+        # The lines in the ranges are lexed from the start of the file
+        self.assertEqual(ranged_lines,
+                         [lines[0], None, None, lines[3]])
+        self.assertEqual(diffutils.apply_pygments(data, 'test.unknown'),
+                         None)
+
     def testEmptyPatch(self):
         """Testing patching with an empty diff"""
         old = 'This is a test'
@@ -338,6 +509,26 @@ class DiffParserTest(unittest.TestCase):
             self.assertEqual(r_moves[0][i], j)
 
 
+    def testMoveDetectionRepeatedLines(self):
+        """Testing move detection of blocks with repeated lines"""
+        old = []
+
+        for i in range(30):
+            old += ['int func%d() {' % i, '    return value;', '}',
+                    '// End of func%d' % i]
+
+        # Move the first ten functions after the next ten.
+        new = old[40:80] + old[:40] + old[80:]
+        differ = diffutils.Differ(old, new)
+        moved = {}
+
+        for tag, i1, i2, j1, j2, meta in \
+            diffutils.opcodes_with_metadata(differ):
+            if tag == 'delete':
+                moved.update(meta.get('moved', {}))
+
+        self.assertEqual(moved, dict([(i + 1, i + 41) for i in range(40)]))
+
     def _get_file(self, *relative):
         f = open(os.path.join(*tuple([self.PREFIX] + list(relative))))
         data = f.read()
@@ -427,3 +618,229 @@ class DbTests(TestCase):
 
         filediff = FileDiff.objects.get(pk=filediff.id)
         self.assertEquals(filediff.source_file, long_filename)
+
+    def testFileDiffData(self):
+        """Testing sharing the stored data of identical diffs"""
+        diff = '--- README\n+++ README\n@@ -1 +1 @@\n-Hello\n+Hi\n'
+
+        repository = Repository.objects.get(pk=1)
+        diffset = DiffSet.objects.create(name='test',
+                                         revision=1,
+                                         repository=repository)
+        filediff1 = FileDiff.objects.create(diffset=diffset,
+                                            source_file='README',
+                                            dest_file='README',
+                                            diff=diff)
+        filediff2 = FileDiff.objects.create(diffset=diffset,
+                                            source_file='README',
+                                            dest_file='README',
+                                            diff=diff)
+
+        self.assertEqual(filediff1.diff_hash_id, filediff2.diff_hash_id)
+        self.assertEqual(filediff1.parent_diff_hash, None)
+
+        filediff_data = FileDiffData.objects.get(pk=filediff1.diff_hash_id)
+        self.assertEqual(filediff_data.ref_count, 2)
+        self.assertEqual(FileDiff.objects.get(pk=filediff2.pk).diff, diff)
+
+        filediff1.delete()
+        filediff_data = FileDiffData.objects.get(pk=filediff2.diff_hash_id)
+        self.assertEqual(filediff_data.ref_count, 1)
+
+        filediff2.diff = diff.replace('Hi', 'Hey')
+        filediff2.save()
+        self.assertFalse(
+            FileDiffData.objects.filter(pk=filediff_data.pk).exists())
+
+        # Data still in use is kept, even if its reference count drifted
+        FileDiffData.objects.filter(pk=filediff2.diff_hash_id).update(
+            ref_count=1)
+        FileDiffData.objects.release(filediff2.diff_hash_id)
+        self.assertTrue(
+            FileDiffData.objects.filter(pk=filediff2.diff_hash_id).exists())
+
+        filediff2.delete()
+        self.assertEqual(FileDiffData.objects.count(), 0)
+
+    def testFileDiffDataConcurrency(self):
+        """Testing adding references to diff data changed concurrently"""
+        diff = '--- README\n+++ README\n@@ -1 +1 @@\n-Hello\n+Hi\n'
+        manager = FileDiffData.objects
+        old_data = manager.get_or_create_from_data(diff)
+
+        # Another request releases the data just before the reference is
+        # added. The data is stored again.
+        def filter(*args, **kwargs):
+            del manager.filter
+            manager.release(old_data.pk)
+            return manager.filter(*args, **kwargs)
+
+        manager.filter = filter
+
+        try:
+            filediff_data = manager.get_or_create_from_data(diff)
+        finally:
+            manager.__dict__.pop('filter', None)
+
+        self.assertEqual(manager.count(), 1)
+        self.assertEqual(filediff_data.ref_count, 1)
+        self.assertEqual(manager.get(pk=filediff_data.pk).content, diff)
+
+        # Another request stores the data just before this one does. The
+        # reference is added to its data instead.
+        manager.release(filediff_data.pk)
+
+        def create(**kwargs):
+            del manager.create
+            manager.create(**kwargs)
+            return manager.create(**kwargs)
+
+        manager.create = create
+
+        try:
+            filediff_data = manager.get_or_create_from_data(diff)
+        finally:
+            manager.__dict__.pop('create', None)
+
+        self.assertEqual(manager.count(), 1)
+        self.assertEqual(filediff_data.ref_count, 2)
+
+        # Requests that keep failing give up after a few attempts
+        attempts = []
+
+        def create(**kwargs):
+            attempts.append(kwargs)
+            raise IntegrityError('column binary_hash is not unique')
+
+        manager.create = create
+
+        try:
+            self.assertRaises(IntegrityError,
+                              manager.get_or_create_from_data, 'other')
+        finally:
+            del manager.create
+
+        self.assertEqual(len(attempts), manager.MAX_REFERENCE_ATTEMPTS)
+
+    def testInterdiffParts(self):
+        """Testing finding the files of an interdiff"""
+        repository = Repository.objects.get(pk=1)
+        diffset = DiffSet.objects.create(name='test',
+                                         revision=1,
+                                         repository=repository)
+        interdiffset = DiffSet.objects.create(name='test',
+                                              revision=2,
+                                              repository=repository)
+
+        def create_filediff(diffset, filename, diff):
+            return FileDiff.objects.create(diffset=diffset,
+                                           source_file=filename,
+                                           dest_file=filename,
+                                           diff=diff)
+
+        create_filediff(diffset, 'same', 'diff 1')
+        create_filediff(interdiffset, 'same', 'diff 1')
+        changed = create_filediff(diffset, 'changed', 'diff 2')
+        interchanged = create_filediff(interdiffset, 'changed', 'diff 3')
+        reverted = create_filediff(diffset, 'reverted', 'diff 4')
+        new = create_filediff(interdiffset, 'new', 'diff 5')
+
+        parts = diffutils.get_interdiff_parts(diffset, interdiffset)
+        self.assertEqual(len(parts), 3)
+        self.assertTrue((changed, interchanged, True) in parts)
+        self.assertTrue((reverted, None, True) in parts)
+        self.assertTrue((new, None, False) in parts)
+
+        parts = diffutils.get_interdiff_parts(diffset, interdiffset, changed)
+        self.assertEqual(parts, [(changed, interchanged, True)])
+
+    def testDiffFileIndex(self):
+        """Testing loading a page of the files of a diff"""
+        repository = Repository.objects.get(pk=1)
+        diffset = DiffSet.objects.create(name='test',
+                                         revision=1,
+                                         repository=repository)
+
+        for filename in ('b/test.c', 'a/test.c', 'b/test.h'):
+            FileDiff.objects.create(diffset=diffset,
+                                    source_file=filename,
+                                    dest_file=filename,
+                                    source_revision=PRE_CREATION,
+                                    diff='--- %s\n+++ %s\n' % (filename,
+                                                                 filename))
+
+        file_index = diffutils.get_diff_file_index(diffset)
+        self.assertEqual([(f['basepath'], f['basename']) for f in file_index],
+                         [('a', 'test.c'), ('b', 'test.h'), ('b', 'test.c')])
+
+        files = diffutils.get_diff_files(diffset, None, None, False, False)
+        page_files = diffutils.get_diff_files(diffset, None, None, False,
+                                              False, file_index[1:])
+        self.assertEqual([(f['filediff'], f['index']) for f in page_files],
+                         [(f['filediff'], f['index']) for f in files[1:]])
+
+    def testFileDiffRanges(self):
+        """Testing building the chunks of ranges of lines"""
+        repository = Repository.objects.get(pk=1)
+        diffset = DiffSet.objects.create(name='test',
+                                         revision=1,
+                                         repository=repository)
+        filediff = FileDiff.objects.create(
+            diffset=diffset,
+            source_file='test.c',
+            dest_file='test.c',
+            source_revision=PRE_CREATION,
+            diff='--- test.c\n+++ test.c\n@@ -0,0 +1,3 @@\n+a\n+b\n+c\n')
+
+        lines = []
+
+        for chunk in diffutils.get_chunks(diffset, filediff, None, False,
+                                          False):
+            lines += chunk['lines']
+
+        ranges = diffutils.FileDiffRanges(filediff, None, False, False)
+        chunks = list(ranges.get_chunks(2, 2))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0]['change'], 'insert')
+        self.assertEqual(chunks[0]['lines'], lines[1:3])
+        self.assertEqual(list(ranges.get_chunks(4, 1)), [])
+
+        # Ranges starting within a multi-line string are highlighted like
+        # the whole file
+        data = 'x = """\nnot = code\n"""\n'
+        filediff = FileDiff.objects.create(
+            diffset=diffset,
+            source_file='test.py',
+            dest_file='test.py',
+            source_revision=PRE_CREATION,
+            diff='--- test.py\n+++ test.py\n@@ -0,0 +1,3 @@\n' +
+                 ''.join(['+' + line + '\n'
+                          for line in data.splitlines()]))
+
+        ranges = diffutils.FileDiffRanges(filediff, None, False, True)
+        chunks = list(ranges.get_chunks(2, 1))
+        self.assertEqual(chunks[0]['lines'][0][5],
+                         diffutils.apply_pygments(data, 'test.py')[1])
+
+    def testWarmUpQueue(self):
+        """Testing queueing diffset warm-ups"""
+        repository = Repository.objects.get(pk=1)
+        diffset = DiffSet.objects.create(name='test',
+                                         revision=1,
+                                         repository=repository)
+
+        siteconfig = SiteConfiguration.objects.get_current()
+        siteconfig.set('diffviewer_warm_up_diffsets', False)
+        siteconfig.save()
+        self.assertEqual(DiffSetWarmUp.objects.queue(diffset), None)
+
+        siteconfig.set('diffviewer_warm_up_diffsets', True)
+        siteconfig.save()
+        DiffSetWarmUp.objects.queue(diffset)
+        DiffSetWarmUp.objects.queue(diffset)
+
+        self.assertEqual(DiffSetWarmUp.objects.claim_all(), [diffset])
+        self.assertEqual(DiffSetWarmUp.objects.count(), 0)
+
+        siteconfig.set('diffviewer_warm_up_diffsets', False)
+        siteconfig.save()
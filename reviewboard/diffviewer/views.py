@@ -14,8 +14,11 @@ from djblets.util.misc import cache_memoize, get_object_or_none
 
 from reviewboard.diffviewer.models import DiffSet, FileDiff
 from reviewboard.diffviewer.diffutils import UserVisibleError, \
+                                             get_diff_file_index, \
                                              get_diff_files, \
-                                             get_enable_highlighting
+                                             get_enable_highlighting, \
+                                             highlight_collapsed_chunks, \
+                                             load_diff_file_chunks
 
 
 def build_diff_fragment(request, file, chunkindex, highlighting, collapseall,
@@ -41,6 +44,9 @@ def build_diff_fragment(request, file, chunkindex, highlighting, collapseall,
 
         file['chunks'] = [file['chunks'][chunkindex]]
         key += '-chunk-%s' % chunkindex
+        expand_chunks = True
+    else:
+        expand_chunks = not collapseall
 
     if collapseall:
         key += '-collapsed'
@@ -53,9 +59,14 @@ def build_diff_fragment(request, file, chunkindex, highlighting, collapseall,
 
     context['file'] = file
 
-    return cache_memoize(key,
-        lambda: render_to_string(template_name,
-                                 RequestContext(request, context)))
+    def render():
+        if highlighting and expand_chunks:
+            highlight_collapsed_chunks(file)
+
+        return render_to_string(template_name,
+                                RequestContext(request, context))
+
+    return cache_memoize(key, render)
 
 
 def get_collapse_diff(request):
@@ -82,13 +93,12 @@ def view_diff(request, diffset, interdiffset=None, extra_context={},
             logging.debug("Generating diff viewer page for filediff id %s",
                           diffset.id)
 
-        files = get_diff_files(diffset, None, interdiffset,
-                               highlighting, False)
-
-        # Break the list of files into pages
+        # Break the list of files into pages. Only the files on the page
+        # are loaded.
+        file_index = get_diff_file_index(diffset, interdiffset)
         siteconfig = SiteConfiguration.objects.get_current()
 
-        paginator = Paginator(files,
+        paginator = Paginator(file_index,
                               siteconfig.get("diffviewer_paginate_by"),
                               siteconfig.get("diffviewer_paginate_orphans"))
 
@@ -97,14 +107,16 @@ def view_diff(request, diffset, interdiffset=None, extra_context={},
         if request.GET.get('file', False):
             file_id = int(request.GET['file'])
 
-            for i, f in enumerate(files):
-                if f['filediff'].id == file_id:
+            for i, f in enumerate(file_index):
+                if f['filediff_id'] == file_id:
                     page_num = i // paginator.per_page + 1
                     if page_num > paginator.num_pages:
                         page_num = paginator.num_pages
                     break
 
         page = paginator.page(page_num)
+        files = get_diff_files(diffset, None, interdiffset, highlighting,
+                               False, page.object_list)
 
         collapse_diffs = get_collapse_diff(request)
 
@@ -112,7 +124,7 @@ def view_diff(request, diffset, interdiffset=None, extra_context={},
             'diffset': diffset,
             'interdiffset': interdiffset,
             'diffset_pair': (diffset, interdiffset),
-            'files': page.object_list,
+            'files': files,
             'collapseall': collapse_diffs,
 
             # Add the pagination context
@@ -135,8 +147,8 @@ def view_diff(request, diffset, interdiffset=None, extra_context={},
         # diff immediately and instead saw a spinner, making them feel it was
         # taking longer than it used to to load a page. We just trick the
         # user by providing that first file.
-        if page.object_list:
-            first_file = page.object_list[0]
+        if files:
+            first_file = files[0]
         else:
             first_file = None
 
@@ -235,6 +247,87 @@ def view_diff_fragment(
             extra_context={'file': get_requested_diff_file(False)})
 
 
+def view_diff_fragments(
+    request,
+    diffset_id,
+    filediff_ids,
+    base_url,
+    interdiffset_id=None,
+    template_name='diffviewer/diff_file_fragment.html',
+    error_template_name='diffviewer/diff_fragment_error.html'):
+    """
+    View which renders the fragments of many files of a diff.
+
+    The diffsets, file list and SCMTool are looked up once for all the
+    files. The fragments are streamed back in the order of filediff_ids as
+    they're rendered, each after a ``<!-- diff-fragment ID -->`` line with
+    the ID of its filediff. The ``index`` GET parameter optionally lists
+    the comma-separated indexes of the files, in the same order.
+
+    A file that fails to render gets an error fragment. As the response has
+    already started, the status code doesn't change. The response isn't
+    compressed or buffered, so that each fragment reaches the client as
+    soon as it's rendered.
+    """
+    diffset = get_object_or_404(DiffSet, pk=diffset_id)
+    interdiffset = get_object_or_none(DiffSet, pk=interdiffset_id)
+    highlighting = get_enable_highlighting(request.user)
+    collapseall = get_collapse_diff(request)
+
+    filediff_ids = [int(filediff_id) for filediff_id in filediff_ids
+                    if filediff_id]
+    indexes = request.GET.get('index', '').split(',')
+
+    if len(indexes) != len(filediff_ids):
+        indexes = [None] * len(filediff_ids)
+
+    wanted_ids = set(filediff_ids)
+    file_index = [entry
+                  for entry in get_diff_file_index(diffset, interdiffset)
+                  if entry['filediff_id'] in wanted_ids]
+    files = {}
+
+    for file in get_diff_files(diffset, None, interdiffset, highlighting,
+                               False, file_index):
+        files[file['filediff'].id] = file
+
+    def render_fragments():
+        for filediff_id, index in zip(filediff_ids, indexes):
+            file = files.get(filediff_id)
+
+            try:
+                if not file:
+                    raise UserVisibleError(
+                        _(u"Internal error. Unable to locate file record "
+                          u"for filediff %s") % filediff_id)
+
+                if index:
+                    file['index'] = index
+
+                load_diff_file_chunks(file, highlighting)
+                context = {
+                    'standalone': False,
+                    'base_url': base_url,
+                }
+                content = build_diff_fragment(request, file, None,
+                                              highlighting, collapseall,
+                                              context, template_name)
+            except Exception, e:
+                content = exception_traceback_string(
+                    request, e, error_template_name,
+                    extra_context={'file': file})
+
+            yield u'<!-- diff-fragment %s -->\n%s\n' % (filediff_id, content)
+
+    response = HttpResponse(render_fragments())
+    response.streaming = True
+
+    # Ask proxies such as nginx not to buffer the fragments.
+    response['X-Accel-Buffering'] = 'no'
+
+    return response
+
+
 def exception_traceback_string(request, e, template_name, extra_context={}):
     context = { 'error': e }
     context.update(extra_context)
@@ -361,6 +361,85 @@ $.extend(RB.Diff.prototype, {
         });
     },
 
+    /*
+     * Loads the fragments of many files of a diff in one request.
+     *
+     * onSuccess is called with the ID and HTML of each file's fragment,
+     * in the order of filediff_ids. Fragments are handed over as they're
+     * streamed in, where the browser supports progress events. onError is
+     * called with the ID of each file whose fragment wasn't received, and
+     * the request, and then onComplete is called.
+     */
+    getDiffFiles: function(review_base_url, filediff_ids, revision_str,
+                           file_indexes, onSuccess, onError, onComplete) {
+        var fragmentRE = /<!-- diff-fragment (\d+) -->\n/g;
+        var loaded = {};
+        var filediff_id = null;
+        var start = 0;
+
+        function parseFragments(xhr, done) {
+            if (xhr.readyState < 3 || xhr.status != 200) {
+                return;
+            }
+
+            var text = xhr.responseText;
+            var m;
+
+            /*
+             * A fragment is complete once the marker of the next one has
+             * been received, or the whole response has.
+             */
+            fragmentRE.lastIndex = start;
+
+            while ((m = fragmentRE.exec(text)) != null) {
+                if (filediff_id != null) {
+                    loaded[filediff_id] = true;
+                    onSuccess(filediff_id, text.substring(start, m.index));
+                }
+
+                filediff_id = m[1];
+                start = fragmentRE.lastIndex;
+            }
+
+            if (done && filediff_id != null) {
+                loaded[filediff_id] = true;
+                onSuccess(filediff_id, text.substring(start));
+                filediff_id = null;
+            }
+        }
+
+        $.ajax({
+            type: "GET",
+            url: review_base_url + "diff/" + revision_str + "/fragments/" +
+                 filediff_ids.join(",") + "/?index=" +
+                 file_indexes.join(",") + "&" + AJAX_SERIAL,
+            xhr: function() {
+                var xhr = $.ajaxSettings.xhr();
+
+                try {
+                    xhr.onprogress = function() {
+                        parseFragments(xhr, false);
+                    };
+                } catch (e) {
+                    /* Fragments are only parsed once complete, then. */
+                }
+
+                return xhr;
+            },
+            complete: function(xhr) {
+                parseFragments(xhr, true);
+
+                for (var i = 0; i < filediff_ids.length; i++) {
+                    if (!loaded[filediff_ids[i]]) {
+                        onError(filediff_ids[i], xhr);
+                    }
+                }
+
+                onComplete();
+            }
+        });
+    },
+
     getErrorString: function(rsp) {
         if (rsp.err.code == 207) {
             return 'The file "' + rsp.file + '" (revision ' + rsp.revision +
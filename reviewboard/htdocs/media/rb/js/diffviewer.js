@@ -4,6 +4,7 @@ var FORWARD  = 1;
 var INVALID  = -1;
 var DIFF_SCROLLDOWN_AMOUNT = 100;
 var VISIBLE_CONTEXT_SIZE = 5;
+var DIFF_FILES_BATCH_SIZE = 20;
 
 var ANCHOR_COMMENT = 1;
 var ANCHOR_FILE = 2;
@@ -85,6 +86,7 @@ var gAnchors = $();
 var gHiddenComments = {};
 var gDiffHighlightBorder = null;
 var gStartAtAnchor = null;
+var gDiffFileBatches = {};
 
 
 /*
@@ -1179,18 +1181,16 @@ function loadFileDiff(review_base_url, filediff_id, filediff_revision,
     if ($("#file" + filediff_id).length == 1) {
         /* We already have this one. This is probably a pre-loaded file. */
         setupFileDiff();
+        $.funcQueue("diff_files").next();
     } else {
-        $.funcQueue("diff_files").add(function() {
-            gDiff.getDiffFile(review_base_url, filediff_id, filediff_revision,
-                              interfilediff_id, interfilediff_revision,
-                              file_index, onFileLoaded);
-        });
-    }
+        var revision_str = filediff_revision;
 
-    function onFileLoaded(xhr) {
-        $("#file_container_" + filediff_id).replaceWith(xhr.responseText);
+        if (interfilediff_id) {
+            revision_str += "-" + interfilediff_revision;
+        }
 
-        setupFileDiff();
+        queueDiffFile(review_base_url, filediff_id, revision_str, file_index,
+                      setupFileDiff);
     }
 
     function setupFileDiff() {
@@ -1223,8 +1223,83 @@ function loadFileDiff(review_base_url, filediff_id, filediff_revision,
                 gStartAtAnchor = null;
             }
         }
+    }
+}
 
-        $.funcQueue("diff_files").next();
+
+/*
+ * Queues the loading of a file's diff.
+ *
+ * Files of the same diff revision queued one after another are loaded
+ * together, up to DIFF_FILES_BATCH_SIZE files per request. onLoaded is
+ * called once the file's fragment has replaced its placeholder.
+ *
+ * @param {string}   review_base_url  The URL of the review request
+ * @param {string}   filediff_id      The filediff ID
+ * @param {string}   revision_str     The diff revision, or the two
+ *                                    revisions of an interdiff
+ * @param {string}   file_index       The file index
+ * @param {function} onLoaded         The function to call once loaded
+ */
+function queueDiffFile(review_base_url, filediff_id, revision_str, file_index,
+                       onLoaded) {
+    var batch = gDiffFileBatches[revision_str];
+
+    if (!batch || batch.filediff_ids.length == DIFF_FILES_BATCH_SIZE) {
+        batch = {
+            filediff_ids: [],
+            file_indexes: [],
+            callbacks: {}
+        };
+        gDiffFileBatches[revision_str] = batch;
+
+        $.funcQueue("diff_files").add(function() {
+            if (gDiffFileBatches[revision_str] == batch) {
+                delete gDiffFileBatches[revision_str];
+            }
+
+            gDiff.getDiffFiles(review_base_url, batch.filediff_ids,
+                               revision_str, batch.file_indexes,
+                               function(filediff_id, html) {
+                $("#file_container_" + filediff_id).replaceWith(html);
+                batch.callbacks[filediff_id]();
+            }, function(filediff_id, xhr) {
+                showDiffFileError(filediff_id, xhr);
+                batch.callbacks[filediff_id]();
+            }, function() {
+                $.funcQueue("diff_files").next();
+            });
+        });
+    }
+
+    batch.filediff_ids.push(filediff_id);
+    batch.file_indexes.push(file_index);
+    batch.callbacks[filediff_id] = onLoaded;
+}
+
+
+/*
+ * Shows an error in place of a file's diff that failed to load.
+ *
+ * @param {string}         filediff_id  The filediff ID
+ * @param {XMLHttpRequest} xhr          The request that failed
+ */
+function showDiffFileError(filediff_id, xhr) {
+    var tbody = $("#file_container_" + filediff_id)
+        .removeClass("loading")
+        .addClass("diff-error")
+        .children("tbody")
+            .empty()
+            .append($("<tr/>")
+                .append($('<td colspan="2"/>')
+                    .text("Diff currently unavailable.")));
+
+    if (xhr.status != 200) {
+        tbody.append($("<tr/>")
+            .append($('<td colspan="2"/>')
+                .append("<b>Error:</b> ")
+                .append(document.createTextNode(
+                    xhr.status + " " + xhr.statusText))));
     }
 }
 
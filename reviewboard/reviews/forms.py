@@ -9,7 +9,8 @@ from django.utils.safestring import mark_safe
 from reviewboard.diffviewer import forms as diffviewer_forms
 from reviewboard.diffviewer.models import DiffSet
 from reviewboard.reviews.errors import OwnershipError, RevisionTableUpdated
-from reviewboard.reviews.models import DefaultReviewer, Group, ReviewRequest, \
+from reviewboard.reviews.models import DefaultReviewer, Group, \
+                                       PostCommitJob, ReviewRequest, \
                                        ReviewRequestDraft, Screenshot
 from reviewboard.scmtools.errors import SCMError, ChangeNumberInUseError, \
     InvalidChangeNumberError, ChangeSetError
@@ -422,6 +423,11 @@ class NewPostReviewRequestForm(forms.Form):
                                  widget=forms.TextInput(attrs={'size':'50'}),
                                  help_text=_('A list of revision identifiers, e.g. 11235 57789 34567'))
 
+    create_async = forms.BooleanField(
+        required=False,
+        label=_('Create in Background'),
+        help_text=_('Create the diff of large revisions in the background. The review request is filled in once the diff is ready.'))
+
     revisions_choice = MultiChoiceWithoutValidation(required=False,
                                                     label=_('Pending Revisions'), 
                                                     widget=CheckboxSelectMultipleWithIds)
@@ -556,6 +562,13 @@ class NewPostReviewRequestForm(forms.Form):
 
         review_request = ReviewRequest.objects.create(user, repository)
 
+        if (diff_file == None and tool != None and revision_list and
+            self.cleaned_data.get('create_async')):
+            # The diff is created by the runpostcommitjobs command
+            PostCommitJob.objects.queue(user, review_request, revision_list,
+                                        new_review_request=True)
+            return review_request
+
         if diff_file == None and tool != None:
             try:
                 # Create diff file
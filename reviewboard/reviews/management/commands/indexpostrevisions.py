@@ -0,0 +1,30 @@
+import sys
+
+from django.core.management.base import NoArgsCommand
+
+from reviewboard.reviews.models import PostCommitRevision, ReviewRequest
+from reviewboard.scmtools.models import Repository
+
+
+class Command(NoArgsCommand):
+    help = ("Records the revisions of existing post-commit review requests, "
+            "so that the revision trackers know they are under review.")
+
+    def handle_noargs(self, **options):
+        for repository in Repository.objects.all():
+            try:
+                tool_class = repository.tool.get_scmtool_class()
+            except Exception, e:
+                sys.stderr.write('Unable to load SCMTool for %s: %s\n' %
+                                 (repository.name, e))
+                continue
+
+            if not getattr(tool_class, 'support_post_commit', False):
+                continue
+
+            review_requests = ReviewRequest.objects.filter(
+                repository=repository).only('id', 'repository', 'description')
+
+            for review_request in review_requests.iterator():
+                PostCommitRevision.objects.record(review_request,
+                                                  review_request.description)
@@ -0,0 +1,123 @@
+import logging
+import optparse
+import time
+from datetime import timedelta
+
+from django.core.management.base import NoArgsCommand
+
+from reviewboard.diffviewer.models import DiffSetWarmUp
+from reviewboard.reviews.forms import UploadDiffForm
+from reviewboard.reviews.models import PostCommitJob, ReviewRequest, \
+                                       ReviewRequestDraft
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option('--loop', action='store_true',
+                             dest='loop', default=False,
+                             help='Keep running and check for new jobs '
+                                  'periodically'),
+        optparse.make_option('--interval', type='int',
+                             dest='interval', default=5,
+                             help='The number of seconds to wait between '
+                                  'checks when running with --loop'),
+        optparse.make_option('--stale-timeout', type='int',
+                             dest='stale_timeout', default=30,
+                             help='The number of minutes after which a '
+                                  'running job that reported no progress '
+                                  'is considered crashed and is queued '
+                                  'again'),
+        )
+    help = ("Runs the queued post-commit diff creations and finalizes their "
+            "review requests")
+    requires_model_validation = True
+
+    def handle_noargs(self, **options):
+        interval = options.get('interval', 5)
+        stale_timeout = timedelta(minutes=options.get('stale_timeout', 30))
+
+        while True:
+            job = PostCommitJob.objects.claim_next(stale_timeout)
+
+            while job:
+                self.run_job(job)
+                job = PostCommitJob.objects.claim_next(stale_timeout)
+
+            if not options.get('loop', False):
+                break
+
+            time.sleep(interval)
+
+    def run_job(self, job):
+        review_request = job.review_request
+
+        try:
+            tool = review_request.repository.get_scmtool()
+            diff_file = tool.get_diff_file(job.get_revision_list(),
+                                           progress=job.set_progress)
+
+            if job.new_review_request:
+                review_request.summary = diff_file.name
+                review_request.description = diff_file.description
+
+            diff_form = UploadDiffForm(review_request,
+                                       {'revisions': job.revisions})
+            diff_form.full_clean()
+            diffset, description = diff_form.create(
+                diff_file, None, attach_to_history=job.new_review_request)
+
+            if job.new_review_request:
+                review_request.add_default_reviewers()
+                review_request.save()
+            else:
+                self._attach_to_draft(review_request, diffset, description)
+
+            DiffSetWarmUp.objects.queue(diffset)
+        except Exception, e:
+            logging.error("Error running post-commit job %s: %s",
+                          job.pk, e, exc_info=1)
+
+            job.status = PostCommitJob.FAILED
+            job.error = str(e)
+
+            job.save()
+
+            if job.new_review_request and review_request:
+                # Don't leave an empty review request open. It's discarded
+                # rather than deleted, so that the job and its error can
+                # still be looked up through it.
+                review_request.close(ReviewRequest.DISCARDED, job.user)
+
+            return
+
+        if job.files_total == 0:
+            # Cached diffs are returned without reporting any progress
+            job.files_total = diffset.files.count()
+
+        job.status = PostCommitJob.DONE
+        job.files_fetched = job.files_total
+        job.save()
+
+    def _attach_to_draft(self, review_request, diffset, description):
+        discarded_diffset = None
+
+        draft = ReviewRequestDraft.create(review_request)
+
+        if draft.diffset and draft.diffset != diffset:
+            discarded_diffset = draft.diffset
+
+        draft.diffset = diffset
+
+        # We only want to add default reviewers the first time.
+        if review_request.diffset_history.diffsets.count() == 0:
+            draft.add_default_reviewers()
+
+        if description:
+            # post-commit review
+            draft.description += '--- --- --- --- --- --- --- --- --- --- --- --- --- --- --- ---\n'
+            draft.description += unicode(description, errors='replace')
+
+        draft.save()
+
+        if discarded_diffset:
+            discarded_diffset.delete()
@@ -1,4 +1,6 @@
 import logging
+import re
+from datetime import datetime
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
@@ -347,3 +349,101 @@ class ReviewManager(ConcurrencyManager):
             review.delete()
 
         return master_review
+
+
+class PostCommitRevisionManager(Manager):
+    """A manager for PostCommitRevision models."""
+
+    # Revision lines in post-commit descriptions, like
+    # "116855 by henkel on 2011-03-24 11:30 AM"
+    REVISION_LINE_RE = re.compile(r'^(\d+) by (\S+) on ')
+
+    def record(self, review_request, description):
+        """Records the revisions listed in a post-commit description.
+
+        This replaces any revisions previously recorded for the review
+        request, so it should be given the full published description.
+        Shelved changelists are listed with a "shelved" prefix and are not
+        recorded, since they may still change.
+        """
+        revisions = set()
+
+        for line in description.splitlines():
+            m = self.REVISION_LINE_RE.match(line)
+
+            if m:
+                revisions.add((m.group(1), m.group(2).lower()))
+
+        self.filter(review_request=review_request).delete()
+
+        if not review_request.repository_id:
+            return
+
+        for revision, scm_user in revisions:
+            self.create(review_request=review_request,
+                        repository=review_request.repository,
+                        revision=revision,
+                        scm_user=scm_user)
+
+    def get_known_revisions(self, repository, scm_user, since=None):
+        """Returns the set of the user's revisions that are under review.
+
+        Revisions of discarded review requests are not included. If since
+        is given, only review requests updated since then are considered.
+        """
+        qs = self.filter(repository=repository, scm_user=scm_user.lower())
+        qs = qs.exclude(review_request__status='D')
+
+        if since:
+            qs = qs.filter(review_request__last_updated__gte=since)
+
+        return set(qs.values_list('revision', flat=True))
+
+
+class PostCommitJobManager(Manager):
+    """A manager for PostCommitJob models."""
+
+    def queue(self, user, review_request, revisions,
+              new_review_request=False):
+        """Queues the creation of a post-commit diff for a review request.
+
+        If new_review_request is True, the review request was created for
+        this job and is filled in from the diff once the job completes.
+        Otherwise the diff is attached to the review request's draft.
+        """
+        return self.create(user=user,
+                           review_request=review_request,
+                           revisions=' '.join([str(rev)
+                                               for rev in revisions]),
+                           new_review_request=new_review_request)
+
+    def claim_next(self, stale_timeout=None):
+        """Claims the oldest queued job for running it.
+
+        Several workers may poll the queue at once, so a job is only
+        returned if its status could be switched from queued to running.
+        Returns None if there are no queued jobs.
+
+        If stale_timeout is given, running jobs that haven't reported any
+        progress for that long are assumed to have crashed with their
+        worker, and are queued again first.
+        """
+        queued = self.model.QUEUED
+        running = self.model.RUNNING
+
+        if stale_timeout:
+            stale_jobs = self.filter(
+                status=running,
+                last_updated__lt=datetime.now() - stale_timeout)
+            stale_jobs.update(status=queued, last_updated=datetime.now())
+
+        for job in self.filter(status=queued).order_by('time_added'):
+            now = datetime.now()
+
+            if self.filter(pk=job.pk, status=queued).update(
+                    status=running, last_updated=now):
+                job.status = running
+                job.last_updated = now
+                return job
+
+        return None
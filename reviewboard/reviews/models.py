@@ -15,7 +15,8 @@ from djblets.util.misc import get_object_or_none
 from djblets.util.templatetags.djblets_images import crop_image, thumbnail
 
 from reviewboard.changedescs.models import ChangeDescription
-from reviewboard.diffviewer.models import DiffSet, DiffSetHistory, FileDiff
+from reviewboard.diffviewer.models import DiffSet, DiffSetHistory, \
+                                          DiffSetWarmUp, FileDiff
 from reviewboard.attachments.models import FileAttachment
 from reviewboard.reviews.signals import review_request_published, \
                                         review_request_reopened, \
@@ -24,6 +25,8 @@ from reviewboard.reviews.signals import review_request_published, \
 from reviewboard.reviews.errors import PermissionError
 from reviewboard.reviews.managers import DefaultReviewerManager, \
                                          ReviewGroupManager, \
+                                         PostCommitJobManager, \
+                                         PostCommitRevisionManager, \
                                          ReviewRequestManager, \
                                          ReviewManager
 from reviewboard.scmtools.errors import EmptyChangeSetError, \
@@ -785,6 +788,11 @@ class ReviewRequest(models.Model):
         self.public = True
         self.save(update_counts=True)
 
+        # Remember which revisions of post-commit repositories are under
+        # review now. Only published descriptions count, so discarded
+        # drafts and replaced diffs don't leave stale revisions behind.
+        PostCommitRevision.objects.record(self, self.description)
+
         review_request_published.send(sender=self.__class__, user=user,
                                       review_request=self,
                                       changedesc=changes)
@@ -1246,6 +1254,8 @@ class ReviewRequestDraft(models.Model):
             self.diffset.history = review_request.diffset_history
             self.diffset.save()
 
+            DiffSetWarmUp.objects.queue(self.diffset)
+
         if self.changedesc:
             self.changedesc.timestamp = datetime.now()
             self.changedesc.public = True
@@ -1274,6 +1284,87 @@ class ReviewRequestDraft(models.Model):
         ordering = ['-last_updated']
 
 
+class PostCommitRevision(models.Model):
+    """
+    A repository revision that is part of a post-commit review request.
+
+    These are recorded when a post-commit diff is attached, so that the
+    revision trackers can look up which revisions are under review already.
+    """
+    review_request = models.ForeignKey(ReviewRequest,
+                                       related_name="post_commit_revisions")
+    repository = models.ForeignKey(Repository,
+                                   related_name="post_commit_revisions")
+    revision = models.CharField(max_length=64)
+    scm_user = models.CharField(max_length=64)
+
+    objects = PostCommitRevisionManager()
+
+    def __unicode__(self):
+        return u"%s by %s" % (self.revision, self.scm_user)
+
+    class Meta:
+        unique_together = (('repository', 'scm_user', 'revision',
+                            'review_request'),)
+
+
+class PostCommitJob(models.Model):
+    """
+    A queued creation of a post-commit diff.
+
+    Large post-commit diffs take too long to be built within a web request.
+    Jobs are run by the runpostcommitjobs command, which reports the number
+    of files fetched so far while the diff is built.
+    """
+    QUEUED  = "Q"
+    RUNNING = "R"
+    DONE    = "D"
+    FAILED  = "F"
+
+    STATUSES = (
+        (QUEUED,  _('Queued')),
+        (RUNNING, _('Running')),
+        (DONE,    _('Done')),
+        (FAILED,  _('Failed')),
+    )
+
+    user = models.ForeignKey(User, related_name="post_commit_jobs")
+    review_request = models.ForeignKey(ReviewRequest,
+                                       related_name="post_commit_jobs",
+                                       blank=True, null=True)
+    revisions = models.CharField(_("revisions"), max_length=512)
+    new_review_request = models.BooleanField(default=False)
+    status = models.CharField(_("status"), max_length=1, choices=STATUSES,
+                              default=QUEUED, db_index=True)
+    files_fetched = models.PositiveIntegerField(default=0)
+    files_total = models.PositiveIntegerField(default=0)
+    error = models.TextField(_("error"), blank=True)
+    time_added = models.DateTimeField(_("time added"), default=datetime.now)
+    last_updated = ModificationTimestampField(_("last updated"))
+
+    objects = PostCommitJobManager()
+
+    def get_revision_list(self):
+        return self.revisions.split()
+
+    def set_progress(self, files_fetched, files_total):
+        """
+        Stores the progress of a running job.
+
+        Only the progress columns are written, so that this can be called
+        for every file without overwriting other changes to the job.
+        """
+        self.files_fetched = files_fetched
+        self.files_total = files_total
+        PostCommitJob.objects.filter(pk=self.pk).update(
+            files_fetched=files_fetched,
+            files_total=files_total,
+            last_updated=datetime.now())
+
+    def __unicode__(self):
+        return u"%s (%s)" % (self.revisions, self.get_status_display())
+
+
 class BaseComment(models.Model):
     OPEN           = "O"
     RESOLVED       = "R"
@@ -1,5 +1,6 @@
 import logging
 import os
+from datetime import datetime, timedelta
 
 from django.contrib.auth.models import AnonymousUser, User
 from django.core.urlresolvers import reverse
@@ -12,6 +13,8 @@ from reviewboard.accounts.models import Profile, LocalSiteProfile
 from reviewboard.reviews.forms import DefaultReviewerForm, GroupForm
 from reviewboard.reviews.models import DefaultReviewer, \
                                        Group, \
+                                       PostCommitJob, \
+                                       PostCommitRevision, \
                                        ReviewRequest, \
                                        ReviewRequestDraft, \
                                        Review
@@ -504,6 +507,24 @@ class ViewTests(TestCase):
         self.assert_('fragment' not in files[1])
         self.assert_('interfilediff' in files[1])
 
+    def testInterdiffFragments(self):
+        """Testing loading the fragments of many interdiff files at once"""
+        response = self.client.get('/r/8/diff/1-2/')
+        self.assertEqual(response.status_code, 200)
+
+        filediff_ids = [str(file['filediff'].id)
+                        for file in self.getContextVar(response, 'files')]
+        self.assertEqual(len(filediff_ids), 2)
+
+        response = self.client.get('/r/8/diff/1-2/fragments/%s/' %
+                                   ','.join(filediff_ids),
+                                   {'index': '0,1'})
+        self.assertEqual(response.status_code, 200)
+
+        for filediff_id in filediff_ids:
+            self.assertTrue('<!-- diff-fragment %s -->' % filediff_id
+                            in response.content)
+
     # Bug 847
     def testInterdiffNewFile(self):
         """Testing the diff viewer with interdiffs containing new files"""
@@ -1398,6 +1419,99 @@ class CounterTests(TestCase):
         self.group = Group.objects.get(pk=self.group.pk)
 
 
+class PostCommitRevisionTests(TestCase):
+    fixtures = ['test_scmtools.json']
+
+    def setUp(self):
+        tool = Tool.objects.get(name='Subversion')
+        self.repository = Repository.objects.create(name='Test1',
+                                                    path='path1', tool=tool)
+        self.user = User.objects.create(username='testuser', password='')
+
+    def test_known_revisions(self):
+        """Testing PostCommitRevision known revision lookups"""
+        review_request = ReviewRequest.objects.create(self.user,
+                                                      self.repository)
+        PostCommitRevision.objects.record(
+            review_request,
+            '116855 by Henkel on 2011-03-24 11:30 AM\n'
+            '       Fix the build\n'
+            '\n'
+            '116856 by other on 2011-03-24 11:45 AM\n'
+            'shelved 116857 by henkel on 2011-03-24 12:00 PM\n')
+
+        self.assertEqual(
+            PostCommitRevision.objects.get_known_revisions(self.repository,
+                                                           'henkel'),
+            set(['116855']))
+
+        review_request.status = ReviewRequest.DISCARDED
+        review_request.save()
+
+        self.assertEqual(
+            PostCommitRevision.objects.get_known_revisions(self.repository,
+                                                           'henkel'),
+            set())
+
+    def test_record_on_publish(self):
+        """Testing PostCommitRevision recording when publishing"""
+        review_request = ReviewRequest.objects.create(self.user,
+                                                      self.repository)
+        review_request.summary = 'Test'
+        review_request.target_people.add(self.user)
+        review_request.publish(self.user)
+
+        draft = ReviewRequestDraft.create(review_request)
+        draft.description = '116855 by henkel on 2011-03-24 11:30 AM\n'
+        draft.save()
+
+        self.assertEqual(
+            PostCommitRevision.objects.get_known_revisions(self.repository,
+                                                           'henkel'),
+            set())
+
+        draft.description = '116856 by henkel on 2011-03-24 11:45 AM\n'
+        draft.save()
+        review_request.publish(self.user)
+
+        self.assertEqual(
+            PostCommitRevision.objects.get_known_revisions(self.repository,
+                                                           'henkel'),
+            set(['116856']))
+
+    def test_post_commit_job_queue(self):
+        """Testing PostCommitJob queueing and progress"""
+        review_request = ReviewRequest.objects.create(self.user,
+                                                      self.repository)
+        job = PostCommitJob.objects.queue(self.user, review_request,
+                                          ['116855', 116856])
+
+        self.assertEqual(job.get_revision_list(), ['116855', '116856'])
+        self.assertEqual(job.status, PostCommitJob.QUEUED)
+
+        claimed = PostCommitJob.objects.claim_next()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, PostCommitJob.RUNNING)
+        self.assertEqual(PostCommitJob.objects.claim_next(), None)
+
+        claimed.set_progress(3, 10)
+        job = PostCommitJob.objects.get(pk=job.pk)
+        self.assertEqual(job.status, PostCommitJob.RUNNING)
+        self.assertEqual(job.files_fetched, 3)
+        self.assertEqual(job.files_total, 10)
+
+        # Running jobs that stopped reporting progress are claimed again
+        stale_timeout = timedelta(minutes=30)
+        self.assertEqual(PostCommitJob.objects.claim_next(stale_timeout),
+                         None)
+
+        PostCommitJob.objects.filter(pk=job.pk).update(
+            last_updated=datetime.now() - timedelta(hours=1))
+        claimed = PostCommitJob.objects.claim_next(stale_timeout)
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, PostCommitJob.RUNNING)
+
+
 class PolicyTests(TestCase):
     fixtures = ['test_users', 'test_reviewrequests', 'test_scmtools',
                 'test_site']
@@ -30,6 +30,8 @@ urlpatterns = patterns('reviewboard.reviews.views',
      'diff_fragment'),
     (r'^(?P<review_request_id>[0-9]+)/diff/(?P<revision>[0-9]+)/fragment/(?P<filediff_id>[0-9]+)/chunk/(?P<chunkindex>[0-9]+)/$',
      'diff_fragment'),
+    (r'^(?P<review_request_id>[0-9]+)/diff/(?P<revision>[0-9]+)/fragments/(?P<filediff_ids>[0-9,]+)/$',
+     'diff_fragments'),
 
     # Fragments
     (r'^(?P<review_request_id>[0-9]+)/fragments/diff-comments/(?P<comment_ids>[0-9,]+)/$',
@@ -42,6 +44,8 @@ urlpatterns = patterns('reviewboard.reviews.views',
      'diff_fragment'),
     (r'^(?P<review_request_id>[0-9]+)/diff/(?P<revision>[0-9]+)-(?P<interdiff_revision>[0-9]+)/fragment/(?P<filediff_id>[0-9]+)/chunk/(?P<chunkindex>[0-9]+)/$',
      'diff_fragment'),
+    (r'^(?P<review_request_id>[0-9]+)/diff/(?P<revision>[0-9]+)-(?P<interdiff_revision>[0-9]+)/fragments/(?P<filediff_ids>[0-9,]+)/$',
+     'diff_fragments'),
 
     # Screenshots
     url(r'^(?P<review_request_id>[0-9]+)/s/(?P<screenshot_id>[0-9]+)/$',
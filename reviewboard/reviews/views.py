@@ -34,6 +34,7 @@ from reviewboard.changedescs.models import ChangeDescription
 from reviewboard.diffviewer.diffutils import get_file_chunks_in_range
 from reviewboard.diffviewer.models import DiffSet
 from reviewboard.diffviewer.views import view_diff, view_diff_fragment, \
+                                         view_diff_fragments, \
                                          exception_traceback_string
 from reviewboard.attachments.forms import UploadFileForm, CommentFileForm
 from reviewboard.reviews.datagrids import DashboardDataGrid, \
@@ -901,6 +902,44 @@ def diff_fragment(request,
                               interdiffset_id, chunkindex, template_name)
 
 
+@check_login_required
+def diff_fragments(request,
+                   review_request_id,
+                   revision,
+                   filediff_ids,
+                   interdiff_revision=None,
+                   template_name='diffviewer/diff_file_fragment.html',
+                   local_site_name=None):
+    """
+    Wrapper around diffviewer.views.view_diff_fragments that takes a review
+    request.
+
+    Displays the fragments of the files of a diff or interdiff owned by the
+    given review request, given a comma-separated list of filediff IDs. The
+    review request and diffs are looked up once for all the files.
+    """
+    review_request, response = \
+        _find_review_request(request, review_request_id, local_site_name)
+
+    if not review_request:
+        return response
+
+    review_request.get_draft(request.user)
+
+    if interdiff_revision is not None:
+        interdiffset = _query_for_diff(review_request, request.user,
+                                       interdiff_revision)
+        interdiffset_id = interdiffset.id
+    else:
+        interdiffset_id = None
+
+    diffset = _query_for_diff(review_request, request.user, revision)
+
+    return view_diff_fragments(request, diffset.id, filediff_ids.split(','),
+                               review_request.get_absolute_url(),
+                               interdiffset_id, template_name)
+
+
 @check_login_required
 def preview_review_request_email(
     request,
@@ -45,7 +45,7 @@ class RepositoryAdmin(admin.ModelAdmin):
             'classes': ('wide',),
         }),
         (_('Advanced'), {
-            'fields': ('encoding',),
+            'fields': ('encoding', 'diff_workers'),
             'classes': ('wide',),
         }),
         (_('State'), {
@@ -0,0 +1,8 @@
+from django_evolution.mutations import AddField
+from django.db import models
+
+
+MUTATIONS = [
+    AddField('Repository', 'diff_workers', models.PositiveIntegerField,
+             initial=1)
+]
@@ -0,0 +1,102 @@
+import optparse
+import sys
+import time
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand
+
+from reviewboard.scmtools.errors import SCMError
+from reviewboard.scmtools.models import Repository
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option('--max-revisions', type='int',
+                             dest='max_revisions', default=5,
+                             help='The maximum number of recent revisions '
+                                  'per user to generate diffs for'),
+        optparse.make_option('--loop', action='store_true',
+                             dest='loop', default=False,
+                             help='Keep running and check for new revisions '
+                                  'periodically'),
+        optparse.make_option('--interval', type='int',
+                             dest='interval', default=300,
+                             help='The number of seconds to wait between '
+                                  'checks when running with --loop'),
+        )
+    help = ("Generates and caches the diffs of recent single revisions that "
+            "tracked users have not put up for review yet, so that creating "
+            "post-commit review requests for them doesn't wait on the "
+            "repository")
+    requires_model_validation = True
+
+    def handle_noargs(self, **options):
+        max_revisions = options.get('max_revisions', 5)
+        interval = options.get('interval', 300)
+
+        # Revisions handled by this process. Their diffs are in the cache
+        # already, so there's no need to load them again on every pass.
+        pregenerated = set()
+
+        while True:
+            self._pregenerate(max_revisions, pregenerated)
+
+            if not options.get('loop', False):
+                break
+
+            time.sleep(interval)
+
+    def _pregenerate(self, max_revisions, pregenerated):
+        for repository in Repository.objects.filter(visible=True):
+            try:
+                tool = repository.get_scmtool()
+            except Exception, e:
+                sys.stderr.write('Unable to load SCMTool for %s: %s\n' %
+                                 (repository.name, e))
+                continue
+
+            if not hasattr(tool, 'get_missing_submitted_revisions'):
+                # Only post-commit trackers know about users' revisions
+                continue
+
+            # Users who recently created review requests on this repository
+            first_day = date.today() - tool.freshness_delta
+            users = User.objects.filter(
+                is_active=True,
+                review_requests__repository=repository,
+                review_requests__last_updated__gte=first_day).distinct()
+
+            for user in users:
+                if hasattr(tool, 'get_scm_user'):
+                    scm_user = tool.get_scm_user(user.username)
+                else:
+                    scm_user = user.username
+
+                try:
+                    revisions = tool.get_missing_submitted_revisions(
+                        user.username, scm_user)
+                except SCMError, e:
+                    sys.stderr.write('Unable to fetch revisions of %s in %s: '
+                                     '%s\n' % (user.username, repository.name,
+                                               e))
+                    continue
+
+                # Newest revisions first
+                revisions = sorted([int(rev[0]) for rev in revisions],
+                                   reverse=True)[:max_revisions]
+
+                for revision in revisions:
+                    key = (repository.pk, revision)
+                    if key in pregenerated:
+                        continue
+
+                    try:
+                        tool.get_diff_file([str(revision)])
+                        pregenerated.add(key)
+                    except SCMError, e:
+                        # E.g. revisions without textual changes
+                        sys.stderr.write('Unable to generate the diff of '
+                                         'revision %s in %s: %s\n' %
+                                         (revision, repository.name, e))
+                        pregenerated.add(key)
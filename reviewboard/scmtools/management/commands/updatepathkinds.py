@@ -0,0 +1,58 @@
+import optparse
+import sys
+import time
+
+from django.core.management.base import NoArgsCommand
+
+from reviewboard.scmtools.models import Repository
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option('--loop', action='store_true',
+                             dest='loop', default=False,
+                             help='Keep running and check for new revisions '
+                                  'periodically'),
+        optparse.make_option('--interval', type='int',
+                             dest='interval', default=300,
+                             help='The number of seconds to wait between '
+                                  'checks when running with --loop'),
+        )
+    help = ("Extends the path kind indexes of Subversion post-commit "
+            "repositories up to their latest revision, filling in the "
+            "revisions that weren't fetched while creating diffs")
+    requires_model_validation = True
+
+    def handle_noargs(self, **options):
+        interval = options.get('interval', 300)
+
+        while True:
+            self._update_indexes(int(options.get('verbosity', 1)))
+
+            if not options.get('loop', False):
+                break
+
+            time.sleep(interval)
+
+    def _update_indexes(self, verbosity):
+        for repository in Repository.objects.filter(visible=True):
+            try:
+                tool = repository.get_scmtool()
+            except Exception, e:
+                sys.stderr.write('Unable to load SCMTool for %s: %s\n' %
+                                 (repository.name, e))
+                continue
+
+            if not hasattr(tool, 'update_path_kind_index'):
+                continue
+
+            def progress(last_revision, head):
+                if verbosity:
+                    print "Indexed %s up to revision %d of %d" % \
+                          (repository.name, last_revision, head)
+
+            try:
+                tool.update_path_kind_index(progress)
+            except Exception, e:
+                sys.stderr.write('Unable to update the path kind index of '
+                                 '%s: %s\n' % (repository.name, e))
@@ -1,6 +1,9 @@
+import threading
+
 from django.contrib.auth.models import User
 from django.core.exceptions import ImproperlyConfigured
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import ugettext_lazy as _
 
 from reviewboard.scmtools.managers import RepositoryManager, ToolManager
@@ -42,6 +45,68 @@ class Tool(models.Model):
         ordering = ("name",)
 
 
+class SCMToolCache(object):
+    """
+    A per-process cache of the SCMTools of saved repositories.
+
+    SCMTools and their clients aren't safe to share between threads, so
+    each thread gets its own instances. Tools are keyed by the repository
+    ID and the fields they're configured from, so a repository changed in
+    memory or by another process gets a new tool. Saving or deleting a
+    repository drops its tools in all threads of the process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generations = {}
+        self.local = threading.local()
+
+    def get(self, repository):
+        """Returns the current thread's SCMTool for the repository."""
+        cls = repository.tool.get_scmtool_class()
+
+        if repository.pk is None:
+            return cls(repository)
+
+        key = (repository.pk, repository.tool_id, repository.path,
+               repository.mirror_path, repository.raw_file_url,
+               repository.username, repository.password,
+               repository.encoding, repository.diff_workers,
+               repository.local_site_id)
+        generation = self.generations.get(repository.pk, 0)
+
+        try:
+            tools = self.local.tools
+        except AttributeError:
+            tools = self.local.tools = {}
+
+        if key in tools:
+            tool_generation, tool = tools[key]
+
+            if tool_generation == generation:
+                return tool
+
+        # Drop the tools of older versions of the repository.
+        for old_key in [k for k in tools.iterkeys() if k[0] == key[0]]:
+            del tools[old_key]
+
+        tool = cls(repository)
+        tools[key] = (generation, tool)
+
+        return tool
+
+    def invalidate(self, repository_id):
+        """Drops the SCMTools of the repository in all threads."""
+        self.lock.acquire()
+        try:
+            self.generations[repository_id] = \
+                self.generations.get(repository_id, 0) + 1
+        finally:
+            self.lock.release()
+
+
+scmtool_cache = SCMToolCache()
+
+
 class Repository(models.Model):
     name = models.CharField(max_length=64)
     path = models.CharField(
@@ -80,6 +145,13 @@ class Repository(models.Model):
         help_text=_("The encoding used for files in this repository. This is "
                     "an advanced setting and should only be used if you're "
                     "sure you need it."))
+    diff_workers = models.PositiveIntegerField(
+        _('Diff workers'),
+        default=1,
+        help_text=_("The number of files fetched concurrently when "
+                    "generating post-commit diffs. Each worker opens its own "
+                    "connection to the repository. Use 1 to fetch files one "
+                    "at a time."))
     visible = models.BooleanField(
         _('Show this repository'),
         default=True,
@@ -118,8 +190,13 @@ class Repository(models.Model):
     objects = RepositoryManager()
 
     def get_scmtool(self):
-        cls = self.tool.get_scmtool_class()
-        return cls(self)
+        """
+        Returns the SCMTool for the repository.
+
+        The tool is reused by later calls in the same thread until the
+        repository is changed, so it must not be modified.
+        """
+        return scmtool_cache.get(self)
 
     def is_accessible_by(self, user):
         """Returns whether or not the user has access to the repository.
@@ -153,3 +230,45 @@ class Repository(models.Model):
         verbose_name_plural = "Repositories"
         unique_together = (('name', 'local_site'),
                            ('path', 'local_site'))
+
+
+class PathKindIndex(models.Model):
+    """
+    The range of revisions whose changed paths are recorded in PathKind.
+
+    Post-commit tools record every added, replaced, modified and deleted
+    path of the revisions in this range, so the kind of any path changed
+    in it can be looked up without contacting the repository.
+    """
+    repository = models.OneToOneField(Repository,
+                                      related_name='path_kind_index')
+    first_revision = models.PositiveIntegerField()
+    last_revision = models.PositiveIntegerField()
+
+
+class PathKind(models.Model):
+    """
+    Whether a repository path is a text file during a range of revisions.
+
+    A range spans the lifetime of a node: it starts when the path is added
+    or replaced and ends when the path is deleted or replaced again. Open
+    ranges have no last revision. ``is_text`` is unknown (None) until the
+    path has been looked up in the repository once.
+    """
+    repository = models.ForeignKey(Repository, related_name='path_kinds')
+    path = models.CharField(max_length=1024)
+    first_revision = models.PositiveIntegerField()
+    last_revision = models.PositiveIntegerField(blank=True, null=True)
+    is_text = models.NullBooleanField()
+
+    def covers(self, revision):
+        return (self.first_revision <= revision and
+                (self.last_revision is None or revision <= self.last_revision))
+
+
+def _invalidate_scmtools(sender, instance, **kwargs):
+    scmtool_cache.invalidate(instance.pk)
+
+
+post_save.connect(_invalidate_scmtools, sender=Repository)
+post_delete.connect(_invalidate_scmtools, sender=Repository)
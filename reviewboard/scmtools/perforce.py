@@ -1,3 +1,4 @@
+import atexit
 import os
 import random
 import re
@@ -6,6 +7,7 @@ import signal
 import socket
 import subprocess
 import tempfile
+import threading
 import time
 
 from djblets.util.filesystem import is_exe_in_path
@@ -82,42 +84,40 @@ class STunnelProxy(object):
                 pass
 
 
-class PerforceClient(object):
-    def __init__(self, p4port, username, password, use_stunnel=False):
-        self.p4port = p4port
-        self.username = username
-        self.password = password
-        self.use_stunnel = use_stunnel
-        self.proxy = None
-
+class PerforceConnection(object):
+    """
+    A connection to a Perforce server, optionally through a stunnel proxy.
+    """
+    def __init__(self, p4port, username, password, use_stunnel):
         import P4
         self.p4 = P4.P4()
-
-        if use_stunnel and not is_exe_in_path('stunnel'):
-            raise AttributeError('stunnel proxy was requested, but stunnel '
-                                 'binary is not in the exec path.')
-
-    def _connect(self):
-        """
-        Connect to the perforce server.
-
-        This connects p4python to the remote server, optionally using a stunnel
-        proxy.
-        """
-        self.p4.user = self.username
-        self.p4.password = self.password
+        self.p4.user = username
+        self.p4.password = password
         self.p4.exception_level = 1
+        self.proxy = None
+        self.last_used = time.time()
 
-        if self.use_stunnel:
+        if use_stunnel:
             # Spin up an stunnel client and then redirect through that
-            self.proxy = STunnelProxy(STUNNEL_CLIENT, self.p4port)
+            self.proxy = STunnelProxy(STUNNEL_CLIENT, p4port)
             self.proxy.start_client()
             self.p4.port = '127.0.0.1:%d' % self.proxy.port
         else:
-            self.p4.port = self.p4port
-        self.p4.connect()
+            self.p4.port = p4port
+
+        try:
+            self.p4.connect()
+        except:
+            self.close()
+            raise
 
-    def _disconnect(self):
+    def is_alive(self):
+        try:
+            return self.p4.connected()
+        except AttributeError:
+            return False
+
+    def close(self):
         """
         Disconnect from the perforce server, and also shut down the stunnel
         proxy (if it exists).
@@ -135,6 +135,127 @@ class PerforceClient(object):
                 pass
             self.proxy = None
 
+
+class PerforceConnectionPool(object):
+    """
+    A per-process pool of connections to Perforce servers.
+
+    Connections are keyed by server and credentials. Idle connections are
+    reused if they are still connected and haven't been idle for longer than
+    idle_timeout seconds. At most max_connections connections per key are in
+    use at the same time; further callers wait for one to be released.
+    """
+    def __init__(self, max_connections=4, idle_timeout=300):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.idle_connections = {}
+        self.semaphores = {}
+
+    def acquire(self, key):
+        """
+        Returns a connection for the (p4port, username, password, use_stunnel)
+        key. It must be given back with release() when done.
+        """
+        self.lock.acquire()
+        try:
+            if key not in self.semaphores:
+                self.semaphores[key] = \
+                    threading.BoundedSemaphore(self.max_connections)
+                self.idle_connections[key] = []
+            semaphore = self.semaphores[key]
+        finally:
+            self.lock.release()
+
+        semaphore.acquire()
+
+        try:
+            while True:
+                self.lock.acquire()
+                try:
+                    self._close_expired()
+
+                    if not self.idle_connections[key]:
+                        break
+
+                    connection = self.idle_connections[key].pop()
+                finally:
+                    self.lock.release()
+
+                if connection.is_alive():
+                    return connection
+
+                connection.close()
+
+            return PerforceConnection(*key)
+        except:
+            semaphore.release()
+            raise
+
+    def release(self, key, connection, reuse=True):
+        if reuse and connection.is_alive():
+            connection.last_used = time.time()
+
+            self.lock.acquire()
+            try:
+                self.idle_connections[key].append(connection)
+            finally:
+                self.lock.release()
+        else:
+            connection.close()
+
+        self.semaphores[key].release()
+
+    def close_all(self):
+        self.lock.acquire()
+        try:
+            for connections in self.idle_connections.itervalues():
+                for connection in connections:
+                    connection.close()
+                del connections[:]
+        finally:
+            self.lock.release()
+
+    def _close_expired(self):
+        # Must be called with the lock held
+        expiration = time.time() - self.idle_timeout
+
+        for connections in self.idle_connections.itervalues():
+            for connection in [c for c in connections
+                               if c.last_used < expiration]:
+                connections.remove(connection)
+                connection.close()
+
+
+connection_pool = PerforceConnectionPool()
+
+# Pooled stunnel proxies are separate processes and must not outlive us
+atexit.register(connection_pool.close_all)
+
+
+class PerforceClient(object):
+    def __init__(self, p4port, username, password, use_stunnel=False):
+        self.p4port = p4port
+        self.username = username
+        self.password = password
+        self.use_stunnel = use_stunnel
+        self.local = threading.local()
+
+        # Fail early if P4Python is not installed
+        __import__('P4')
+
+        if use_stunnel and not is_exe_in_path('stunnel'):
+            raise AttributeError('stunnel proxy was requested, but stunnel '
+                                 'binary is not in the exec path.')
+
+    def _get_p4(self):
+        """
+        The P4 handle of the connection the current thread's worker uses.
+        """
+        return self.local.connection.p4
+
+    p4 = property(_get_p4)
+
     @staticmethod
     def _convert_p4exception_to_scmexception(e):
         error = str(e)
@@ -146,22 +267,29 @@ class PerforceClient(object):
             raise SCMError(error)
 
     def _run_worker(self, worker):
-        result = None
+        if getattr(self.local, 'connection', None):
+            # Nested workers share the connection of the outermost one
+            return worker()
+
+        key = (self.p4port, self.username, self.password, self.use_stunnel)
+        connection = None
+        reuse = True
 
         # TODO: Move to using with: when we require a minimum of Python 2.5.
-        #       We should make it auto-disconnect.
         try:
-            self._connect()
-            result = worker()
-            self._disconnect()
-        except P4Exception, e:
-            self._disconnect()
-            self._convert_p4exception_to_scmexception(e)
-        except:
-            self._disconnect();
-            raise
-
-        return result
+            try:
+                connection = connection_pool.acquire(key)
+                self.local.connection = connection
+                return worker()
+            except P4Exception, e:
+                # The connection may be in a bad state, so don't reuse it
+                reuse = False
+                self._convert_p4exception_to_scmexception(e)
+        finally:
+            self.local.connection = None
+
+            if connection:
+                connection_pool.release(key, connection, reuse)
 
     def _get_changeset(self, changesetid):
         return self.p4.run_describe('-s', str(changesetid))
@@ -183,6 +311,26 @@ class PerforceClient(object):
         """
         return self._run_worker(lambda: self._get_pending_changesets(userid))
 
+    def _run_print(self, specs):
+        """
+        Prints several file specs with a single p4 print and returns a list
+        of (depot path, content) tuples in the order of the specs.
+        """
+        # p4 print returns a dictionary of file attributes for each spec,
+        # followed by the file content, possibly split into several strings
+        files = []
+        for item in self.p4.run_print(*specs):
+            if isinstance(item, dict):
+                files.append((item['depotFile'], []))
+            elif files:
+                files[-1][1].append(item)
+
+        if len(files) != len(specs):
+            raise SCMError('Unexpected output of p4 print: got %d of %d files'
+                           % (len(files), len(specs)))
+
+        return [(depot_path, ''.join(data)) for depot_path, data in files]
+
     def _get_file(self, path, revision, from_shelved_changelist=False):
         if revision == PRE_CREATION:
             return ''
@@ -193,32 +341,7 @@ class PerforceClient(object):
         else:
             depot_path = '%s#%s' % (path, revision)
 
-        args = ['p4', '-p', self.p4.port]
-        if self.p4.user:
-            args.extend(['-u', self.p4.user])
-        if self.p4.password:
-            args.extend(['-P', self.p4.password])
-        args.extend(['print', '-q', depot_path])
-
-        p = subprocess.Popen(args, stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-
-        result, errdata = p.communicate()
-        failure = p.poll()
-
-        if failure:
-            error = errdata.splitlines()
-            # The command-line output is the same as the contents of a
-            # P4Exception except they're prefixed with a line that says
-            # "Perforce client error:", and the lines of the error are indented
-            # with tabs.
-            if error[0].startswith('Perforce client error:'):
-                error = error[1:]
-            text = '\n'.join(line.lstrip('\t') for line in error)
-
-            self._convert_p4exception_to_scmexception(Exception(text))
-        else:
-            return result
+        return self._run_print([depot_path])[0][1]
 
     def get_file(self, path, revision):
         """
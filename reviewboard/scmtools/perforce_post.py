@@ -1,18 +1,13 @@
 # Perforce post-commit SCM tool
 # Author: Philipp Henkel, weltraumpilot@googlemail.com
 
-import re
-import subprocess
-import os
-import sys
 import datetime
 import urllib
 
-from post_utils import DiffFile
+from post_utils import DiffFile, get_cached_diff_file, get_unified_diff_hunks, \
+                       split_diff_lines
 from reviewboard.diffviewer.diffutils import convert_line_endings
 
-from tempfile import mkstemp, mkdtemp
-
 from reviewboard.scmtools.perforce import PerforceTool, PerforceClient
 from reviewboard.scmtools.errors import SCMError
 
@@ -42,10 +37,14 @@ class PerforcePostCommitTool(PerforceTool):
         fields.append('revisions')
         return fields
     
-    def get_diff_file(self, change_numbers):
+    def get_diff_file(self, change_numbers, progress=None):
+        """
+        Returns the diff of the changelists. If given, progress is called
+        with the number of files fetched so far and the total number of files.
+        """
         if change_numbers == None or len(change_numbers) == 0:
             raise SCMError('List of changelist numbers is empty')
-        return self.client.get_diff_file(change_numbers)
+        return self.client.get_diff_file(change_numbers, progress)
     
 
         
@@ -119,59 +118,30 @@ class DiffStatus:
                 self.change_type = self.MODIFIED        # Ignore delete if file was re-added and is modified now
                 
 
-def execute(command, env=None, split_lines=False, ignore_errors=False,
-            extra_ignore_errors=()):
-    """
-    Utility function to execute a command and return the output.
-    """
-
-    if env:
-        env.update(os.environ)
-    else:
-        env = os.environ.copy()
-
-    env['LC_ALL'] = 'en_US.UTF-8'
-    env['LANGUAGE'] = 'en_US.UTF-8'
-
-    if sys.platform.startswith('win'):
-        p = subprocess.Popen(command,
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT,
-                             shell=False,
-                             universal_newlines=True,
-                             env=env)
-    else:
-        p = subprocess.Popen(command,
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT,
-                             shell=False,
-                             close_fds=True,
-                             universal_newlines=True,
-                             env=env)
-    if split_lines:
-        data = p.stdout.readlines()
-    else:
-        data = p.stdout.read()
-    rc = p.wait()
-    if rc and not ignore_errors and rc not in extra_ignore_errors:
-        raise Exception('Failed to execute command: %s\n%s' % (command, data))
-
-    return data
-
-
-
 class PerforcePostCommitClient(PerforceClient):
+    # Number of files whose revisions are fetched with a single p4 print
+    print_batch_size = 50
+
     def __init__(self, p4port, username, password, use_stunnel=False):
         PerforceClient.__init__(self, p4port, username, password, use_stunnel)
         
-    def get_diff_file(self, change_numbers):
+    def get_diff_file(self, change_numbers, progress=None):
         """
         Returns a unified diff file based on the change_numbers.
         """
-        return self._run_worker(lambda: self._get_diff_file(change_numbers))
+        return self._run_worker(lambda: self._get_diff_file_cached(change_numbers, progress))
     
+
+    def _get_diff_file_cached(self, changelist_numbers, progress=None):
+        # Submitted changelists never change, so their diffs are cached.
+        # Shelved changelists can be updated at any time.
+        if len(changelist_numbers) == 1 and \
+           self._get_change_description(changelist_numbers[0])['status'] != 'pending':
+            cache_key = 'perforce_post_diff_file.'+ urllib.quote(str(self.p4port)) +'.'+ str(changelist_numbers[0])
+            return get_cached_diff_file(cache_key, lambda: self._get_diff_file(changelist_numbers, progress))
+
+        return self._get_diff_file(changelist_numbers, progress)
+
     
     def _get_change_description(self, change_number):
         cache_key = 'perforce_post_get_changedesc.'+ urllib.quote(str(self.p4port)) +'.'+ str(change_number)
@@ -197,7 +167,7 @@ class PerforcePostCommitClient(PerforceClient):
         return changedesc
         
     # Creates a diff file based on a Perforce change number list
-    def _get_diff_file(self, changelist_numbers):
+    def _get_diff_file(self, changelist_numbers, progress=None):
         try:            
             changelist_numbers.sort()
 
@@ -224,39 +194,34 @@ class PerforcePostCommitClient(PerforceClient):
             if len(modified_files) == 0:
                 raise SCMError('There are no files attached to the changelist(s)')
 
-            # Create temporary dir and files
-            temp_dir_name = mkdtemp(prefix='reviewboard_perforce_post.')
-            fd, empty_filename = mkstemp(dir=temp_dir_name)
-            os.close(fd)
-            fd, tmp_diff_from_filename = mkstemp(dir=temp_dir_name)
-            os.close(fd)
-            fd, tmp_diff_to_filename = mkstemp(dir=temp_dir_name)
-            os.close(fd)
-    
-            def cleanup():
-                os.unlink(empty_filename)
-                os.unlink(tmp_diff_from_filename)
-                os.unlink(tmp_diff_to_filename)
-                os.rmdir(temp_dir_name)
-            
-            try:
-                cwd = os.getcwd()
-        
-                diff_lines = []
-        
-                for filename, status in modified_files.iteritems():
-                    if status.change_type == DiffStatus.DELETED:
-                        # Skip all files
-                        pass
-                    else: 
-                        old_file, new_file = self._populate_temp_files(filename, status.first_rev, status.last_rev, status.change_type, is_shelved, empty_filename, tmp_diff_from_filename, tmp_diff_to_filename)
-                        diff_lines += self._diff_file(old_file, new_file, filename, filename, status.first_rev, status.change_type, cwd)
-
-                cleanup()
-                return DiffFile(summary, description, ''.join(diff_lines))
-            except Exception, e:
-                cleanup()
-                raise
+            # Fetch the file revisions in batches and diff them in memory.
+            # Only one batch of file contents is held at a time, the diffs
+            # go straight to the diff file.
+            timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            diff_file = DiffFile(summary, description)
+
+            filenames = sorted([filename for filename, status in modified_files.iteritems()
+                                if status.change_type != DiffStatus.DELETED])  # Skip all deleted files
+
+            for start in range(0, len(filenames), self.print_batch_size):
+                batch = dict([(filename, modified_files[filename])
+                              for filename in filenames[start:start + self.print_batch_size]])
+                contents = self._print_files(self._get_file_specs(batch, is_shelved))
+
+                for filename in sorted(batch.keys()):
+                    status = batch[filename]
+                    if status.change_type == DiffStatus.MODIFIED:
+                        old_data = contents.pop(self._get_file_spec(filename, status.first_rev, False))
+                    else:
+                        old_data = ''
+                    new_data = contents.pop(self._get_file_spec(filename, status.last_rev, is_shelved))
+
+                    diff_file.write_file_diff(self._diff_file(old_data, new_data, filename, status.first_rev, status.change_type, timestamp))
+
+                if progress:
+                    progress(min(start + self.print_batch_size, len(filenames)), len(filenames))
+
+            return diff_file
         
         except Exception, e:
             raise SCMError('Error creating diff: ' + str(e) )
@@ -310,120 +275,56 @@ class PerforcePostCommitClient(PerforceClient):
         return description
     
     
-    def _populate_temp_files(self,  depot_path, rev_first,  rev_last,  changetype,  cl_is_pending,  empty_filename,  tmp_diff_from_filename,  tmp_diff_to_filename):
-        old_file = new_file =  empty_filename
-
-        if changetype == DiffStatus.MODIFIED:
-            # We have an old file, get p4 to take this old version from the
-            # depot and put it into a plain old temp file for us
-            self._write_file(depot_path, str(rev_first), tmp_diff_from_filename, False)
-            old_file = tmp_diff_from_filename
-
-            # Also print out the new file into a tmpfile
-            self._write_file(depot_path, str(rev_last), tmp_diff_to_filename, cl_is_pending)
-            new_file = tmp_diff_to_filename
-
-        elif changetype == DiffStatus.ADDED:
-            # We have a new file, get p4 to put this new file into a pretty
-            # temp file for us. No old file to worry about here.
-            self._write_file(depot_path, str(rev_last), tmp_diff_to_filename, cl_is_pending)
-            new_file = tmp_diff_to_filename
-
-        elif changetype == DiffStatus.DELETED:
-            # We've deleted a file, get p4 to put the deleted file into  a temp
-            # file for us. The new file remains the empty file.
-            self._write_file(depot_path, str(rev_first), tmp_diff_from_filename, False)
-            old_file = tmp_diff_from_filename
-            
-            f = open(tmp_diff_to_filename, "w")
-            f.write('<FILE IS DELETED>')
-            f.close()
-            new_file = tmp_diff_to_filename
-
+    def _get_file_spec(self, depot_path, revision, from_shelved_changelist):
+        if from_shelved_changelist:
+            return '%s@=%s' % (depot_path, revision)
         else:
-            raise Exception('Unexpected change type')        
-        
-        return old_file,  new_file
+            return '%s#%s' % (depot_path, revision)
 
 
-    def _diff_file(self, old_file, new_file,  local_name,  depot_path,  base_revision,  changetype,  cwd):
-        diff_cmd = ["diff", "-uN", old_file, new_file]
-        # Diff returns "1" if differences were found.
-        dl = execute(diff_cmd, extra_ignore_errors=(1,2)).splitlines(True)
-
-        if local_name.startswith(cwd):
-            local_path = local_name[len(cwd) + 1:]
-        else:
-            local_path = local_name
-
-        # Special handling for the output of the diff tool on binary files:
-        #     diff outputs "Files a and b differ"
-        # and the code below expects the output to start with
-        #     "Binary files "
-        if len(dl) == 1 and \
-            dl[0].startswith('Files %s and %s differ' %
-                            (old_file, new_file)):
-            dl = ['Binary files %s and %s differ\n'% (old_file, new_file)]
-
-        if dl == [] or dl[0].startswith("Binary files "):
-            if dl == []:
-                print "Warning: %s in your changeset is unmodified or refers to a binary file" % local_path
-            # Add our binary file header  
-            dl.insert(0, "==== %s#%s ==%s== %s ====\n" % \
-                        (depot_path, base_revision, changetype, local_path))                          
-        else:
-            m = re.search(r'(\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d)', dl[1])
-            if m:
-                timestamp = m.group(1)
-            else:
-                # Thu Sep  3 11:24:48 2007
-                m = re.search(r'(\w+)\s+(\w+)\s+(\d+)\s+(\d\d:\d\d:\d\d)\s+(\d\d\d\d)', dl[1])
-                if not m:
-                    raise SCMError("Unable to parse diff header: %s" % dl[1])
-
-                month_map = {
-                    "Jan": "01",
-                    "Feb": "02",
-                    "Mar": "03",
-                    "Apr": "04",
-                    "May": "05",
-                    "Jun": "06",
-                    "Jul": "07",
-                    "Aug": "08",
-                    "Sep": "09",
-                    "Oct": "10",
-                    "Nov": "11",
-                    "Dec": "12",
-                }
-                month = month_map[m.group(2)]
-                day = m.group(3)
-                timestamp = m.group(4)
-                year = m.group(5)
-
-                timestamp = "%s-%s-%s %s" % (year, month, day, timestamp)
-
-            dl[0] = "--- %s\t%s#%s\n" % (local_path, depot_path, base_revision)
-            dl[1] = "+++ %s\t%s\n" % (local_path, timestamp)
-                
-        return dl
+    def _get_file_specs(self, modified_files, cl_is_pending):
+        specs = []
+        for depot_path, status in modified_files.iteritems():
+            if status.change_type == DiffStatus.MODIFIED:
+                specs.append(self._get_file_spec(depot_path, status.first_rev, False))
+                specs.append(self._get_file_spec(depot_path, status.last_rev, cl_is_pending))
+            elif status.change_type == DiffStatus.ADDED:
+                specs.append(self._get_file_spec(depot_path, status.last_rev, cl_is_pending))
+        return specs
 
 
-    def _write_file(self, path, revision, tmpfile, from_shelved_changelist):
+    def _print_files(self, specs):
         """
-        Grabs a file from Perforce and writes it to a temp file. We do this
-        rather than telling p4 print to write it out in order to work around
-        a permissions bug on Windows.
+        Fetches the contents of all file specs with a single p4 print and
+        returns them as a dictionary keyed by spec.
         """
-        data = self._get_file(path, revision, from_shelved_changelist)
-        f = open(tmpfile, "w")
-        
-        # Fix line endings
-        # P4 print does not properly convert the line endings according to the OS standard
-        # Wrong endings will result in invalid diffs and cause problems with the patch later on
-        cleaned_data = convert_line_endings(data)
-        
-        f.write(cleaned_data)
-        f.close()
-
-    
-
+        if len(specs) == 0:
+            return {}
+
+        contents = {}
+        for spec, (depot_path, data) in zip(specs, self._run_print(specs)):
+            if not spec.startswith(depot_path):
+                raise SCMError('Unexpected output of p4 print: got %s instead of %s' % (depot_path, spec))
+
+            # Fix line endings
+            # P4 print does not properly convert the line endings according to the OS standard
+            # Wrong endings will result in invalid diffs and cause problems with the patch later on
+            contents[spec] = convert_line_endings(data)
+
+        return contents
+
+
+    def _diff_file(self, old_data, new_data, depot_path, base_revision, changetype, timestamp):
+        # Binary files are recognized by NUL bytes, like diff does
+        if old_data == new_data or '\0' in old_data or '\0' in new_data:
+            # Add our binary file header
+            dl = ["==== %s#%s ==%s== %s ====\n" % \
+                  (depot_path, base_revision, changetype, depot_path)]
+            if old_data != new_data:
+                dl.append('Binary files %s#%s and %s differ\n' % (depot_path, base_revision, depot_path))
+            return dl
+
+        dl = ["--- %s\t%s#%s\n" % (depot_path, depot_path, base_revision),
+              "+++ %s\t%s\n" % (depot_path, timestamp)]
+        dl += get_unified_diff_hunks(split_diff_lines(old_data), split_diff_lines(new_data))
+        return dl
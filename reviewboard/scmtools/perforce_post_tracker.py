@@ -13,37 +13,31 @@ from post_utils import get_known_revisions, RepositoryRevisionCache
 from django.utils import encoding
 
 
-def extract_revision_user(line):
-    # Try to extract revision info tuple (rev, user, line, shelved) from line
-    # Revision info example: "116855 by henkel on 2011-03-24 11:30 AM"
-    words = line.split(' ',  4)
-
-    if len(words)>=4 and words[0].isdigit() and words[1] == 'by' and words[3] == 'on':
-        return (words[0], words[2], line, False)
-    
-    return None
-
-
 class PerforcePostCommitTrackerClient(PerforcePostCommitClient):
     def __init__(self, p4port, username, password, use_stunnel=False):
         PerforcePostCommitClient.__init__(self, p4port, username, password, use_stunnel)
 
-    def get_missing_revisions(self, userid, scm_user, revisionCache):
+    def get_missing_revisions(self, userid, scm_user, repository, revisionCache):
         """
         Returns revisions that are not yet available in Review Board.
         """
-        return self._run_worker(lambda: self._get_missing_revisions(userid, scm_user, revisionCache))
+        return self._run_worker(lambda: self._get_missing_revisions(userid, scm_user, repository, revisionCache))
+
+    def get_missing_submitted_revisions(self, userid, scm_user, repository, revisionCache):
+        """
+        Returns submitted revisions that are not yet available in Review Board.
+        """
+        return self._run_worker(lambda: self._get_missing_revisions(userid, scm_user, repository, revisionCache, False))
                     
-    def _get_missing_revisions(self, userid, scm_user, revisionCache):
+    def _get_missing_revisions(self, userid, scm_user, repository, revisionCache, include_shelved=True):
         
         # Fetch user's commits from repository
-        commits = revisionCache.get_latest_commits(scm_user, self._fetch_log_of_day_uncached)
+        commits = revisionCache.get_latest_commits(scm_user, self._fetch_log_uncached)
         
         # Fetch the already contained
         known_revisions = get_known_revisions(scm_user, 
-                                              self.p4port, 
-                                              revisionCache.get_freshness_delta(), 
-                                              extract_revision_user)
+                                              repository, 
+                                              revisionCache.get_freshness_delta())
 
         changelists_to_be_ignored = revisionCache.get_ignored_revisions(userid)           
         
@@ -55,6 +49,9 @@ class PerforcePostCommitTrackerClient(PerforcePostCommitClient):
                                   key=itemgetter(0), 
                                   reverse=False)
         
+        if not include_shelved:
+            return sorted_revisions
+
         # Don't cache Shelved changelists
         sorted_shelved_all = sorted([(rev[0], rev[2]) for rev in self._fetch_shelved_logs(scm_user)], key=itemgetter(0))
         # Filter ignored shelved changelists
@@ -81,7 +78,7 @@ class PerforcePostCommitTrackerClient(PerforcePostCommitClient):
             log.append(( str(changedesc['change']), 
                          changedesc['user'], 
                          desc,
-                         shelved ))
+                         submit_date.date() ))
         
         return log
 
@@ -95,16 +92,18 @@ class PerforcePostCommitTrackerClient(PerforcePostCommitClient):
             raise SCMError('Error fetching revisions: ' +str(e))
 
 
-    def _fetch_log_of_day_uncached(self, day):  
+    def _fetch_log_uncached(self, first_day, revision):
         try:
             # Fetch submitted changes
-            day_plus_one = day + timedelta(days=1)
-            changes = self.p4.run_changes('-l', '-s', 'submitted', '@' + day.strftime("%Y/%m/%d") + ',' + day_plus_one.strftime("%Y/%m/%d"))
+            if revision == None:
+                since = '@' + first_day.strftime("%Y/%m/%d")
+            else:
+                since = '@' + str(revision + 1)
+            changes = self.p4.run_changes('-l', '-s', 'submitted', since + ',@now')
             return self._get_log_changelists(changes)
         except Exception, e:
             raise SCMError('Error fetching revisions: ' +str(e))
 
-        
 
 class PerforcePostCommitTrackerTool(PerforcePostCommitTool):
     name = "Perforce Post Commit Tracker"
@@ -140,7 +139,12 @@ class PerforcePostCommitTrackerTool(PerforcePostCommitTool):
     def get_missing_revisions(self, userid, scm_user):
         scm_user = scm_user or userid
         scm_user = scm_user.lower()
-        return self.client.get_missing_revisions(userid, scm_user, self.revisionCache)
+        return self.client.get_missing_revisions(userid, scm_user, self.repository, self.revisionCache)
+
+    def get_missing_submitted_revisions(self, userid, scm_user):
+        scm_user = scm_user or userid
+        scm_user = scm_user.lower()
+        return self.client.get_missing_submitted_revisions(userid, scm_user, self.repository, self.revisionCache)
     
     def ignore_revisions(self, userid, new_revisions_to_be_ignored):
         self.revisionCache.ignore_revisions(userid, new_revisions_to_be_ignored)
\ No newline at end of file
@@ -1,47 +1,242 @@
-from reviewboard.reviews.models import ReviewRequest
-from datetime import date, timedelta
+from reviewboard.diffviewer.myersdiff import MyersDiffer
+from reviewboard.reviews.models import PostCommitRevision
+from datetime import date
+import time
+try:
+    from tempfile import SpooledTemporaryFile
+except ImportError:
+    # Python 2.5 has no spooled temporary files, always write to disk
+    from tempfile import TemporaryFile
+
+    def SpooledTemporaryFile(max_size=0):
+        return TemporaryFile()
 from django.core.cache import cache
+from djblets.util.misc import cache_memoize
 
 
-# Returns fresh (revision, user) tuples that are known to Review Board
-def get_known_revisions(userid, repository, freshness_delta, extract_revision_user):
-    # Filter fresh requests
+# Diffs of single submitted revisions never change. They are cached, so that
+# the pregenpostdiffs command can generate them ahead of time.
+DIFF_FILE_CACHE_EXPIRATION = 60*60*24*7
+
+
+class _MissingCacheEntry(Exception):
+    pass
+
+
+def _get_cache_entry(cache_key, large_data=False):
+    def missing():
+        raise _MissingCacheEntry(cache_key)
+
+    return cache_memoize(cache_key, missing,
+                         expiration=DIFF_FILE_CACHE_EXPIRATION,
+                         large_data=large_data)
+
+
+def _set_cache_entry(cache_key, value, large_data=False):
+    cache_memoize(cache_key, lambda: value,
+                  expiration=DIFF_FILE_CACHE_EXPIRATION,
+                  large_data=large_data)
+
+
+def get_cached_diff_file(cache_key, func_get_diff_file):
+    """
+    Returns the cached diff file, or the one returned by func_get_diff_file
+    after caching it.
+
+    The diff is cached in pieces: one entry per file diff, and an index
+    entry with the name, description and number of file diffs that is
+    stored last. Neither storing nor loading the diff needs more than one
+    file diff in memory at once.
+    """
+    index_key = cache_key + '.index'
+
+    try:
+        index = _get_cache_entry(index_key)
+        diff_file = DiffFile(index['name'], index['description'])
+
+        for i in range(index['num_file_diffs']):
+            diff_file.write_file_diff(
+                [_get_cache_entry('%s.%d' % (cache_key, i), large_data=True)])
+
+        return diff_file
+    except _MissingCacheEntry:
+        # Not cached yet, or some pieces have expired
+        pass
+
+    diff_file = func_get_diff_file()
+
+    for i, data in enumerate(diff_file.iter_file_diffs()):
+        _set_cache_entry('%s.%d' % (cache_key, i), data, large_data=True)
+
+    _set_cache_entry(index_key, {
+        'name': diff_file.name,
+        'description': diff_file.description,
+        'num_file_diffs': len(diff_file.file_diffs),
+    })
+
+    return diff_file
+
+
+# Returns the fresh revisions of the user that are known to Review Board
+def get_known_revisions(userid, repository, freshness_delta):
     # Our fresh revisions cannot be contained in old requests!
     # We don't have to consider any ReviewRequest which were last updated before the shown user revisions were created.
     first_day = date.today()-freshness_delta
-    query = ReviewRequest.objects.filter(last_updated__gte=first_day.strftime("%Y-%m-%d"))
-    query = query.filter(repository__path__exact=repository)
+    return PostCommitRevision.objects.get_known_revisions(repository, userid, since=first_day)
+
+
+def split_diff_lines(data):
+    """
+    Splits data into lines, keeping the line endings. Unlike splitlines() only
+    newlines end a line, just like in diff.
+    """
+    lines = [line + '\n' for line in data.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def get_unified_diff_hunks(old_lines, new_lines, context=3):
+    """
+    Returns the hunks of a unified diff between two lists of lines, as
+    generated by split_diff_lines(), without the file headers.
+    """
+    opcodes = list(MyersDiffer(old_lines, new_lines).get_opcodes())
+
+    # Only keep the context lines of the leading and trailing equal blocks
+    tag, i1, i2, j1, j2 = opcodes[0]
+    if tag == 'equal':
+        opcodes[0] = (tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)
+    tag, i1, i2, j1, j2 = opcodes[-1]
+    if tag == 'equal':
+        opcodes[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+
+    # Split into groups at equal blocks that are longer than twice the context
+    groups = []
+    group = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal' and i2 - i1 > 2 * context:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    groups.append(group)
+
+    def format_range(start, stop):
+        length = stop - start
+        if length == 1:
+            return '%d' % (start + 1)
+        elif length == 0:
+            return '%d,0' % start
+        else:
+            return '%d,%d' % (start + 1, length)
 
-    revisions = []
-    for request in query:
-        if request.status == ReviewRequest.DISCARDED:
-            # skip request
+    def format_line(prefix, line):
+        if line.endswith('\n'):
+            return prefix + line
+        else:
+            return prefix + line + '\n\\ No newline at end of file\n'
+
+    diff_lines = []
+    for group in groups:
+        if len(group) == 1 and group[0][0] == 'equal':
             continue
 
-        # Parse description to find revision numbers
-        lc_userid = userid.lower()
-        desc = request.description
-        for line in desc.splitlines(True):
-            rev_user = extract_revision_user(line)
-            if rev_user != None and rev_user[1].lower() == lc_userid: # case-insensitive comparison
-                revisions.append(rev_user[0])
+        diff_lines.append('@@ -%s +%s @@\n' % (
+            format_range(group[0][1], group[-1][2]),
+            format_range(group[0][3], group[-1][4])))
+
+        # Removed lines go before added lines within each run of changes
+        removed = []
+        added = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                diff_lines.extend(removed + added)
+                removed = []
+                added = []
+                diff_lines.extend([format_line(' ', line) for line in old_lines[i1:i2]])
+            else:
+                removed.extend([format_line('-', line) for line in old_lines[i1:i2]])
+                added.extend([format_line('+', line) for line in new_lines[j1:j2]])
+        diff_lines.extend(removed + added)
 
-    return set(revisions)
+    return diff_lines
 
 
 class DiffFile:
-    def __init__(self, name, description, data):
+    """
+    A post-commit diff, written file by file.
+
+    The diff is kept in a temporary file once it grows beyond
+    max_memory_size bytes. The diff of each file can be read back on its
+    own, so that consumers never need the whole diff in memory at once.
+    """
+
+    max_memory_size = 1024 * 1024
+
+    def __init__(self, name, description, data=None):
         self.name = name
         self.description = description
-        self.data = data
+        self.spool = SpooledTemporaryFile(max_size=self.max_memory_size)
+        self.file_diffs = [] # (start, end) offsets of the file diffs
+        self.size = 0
+
+        if data:
+            self.write_file_diff([data])
+
+
+    def write_file_diff(self, lines):
+        """
+        Appends the diff of one file, given as an iterable of strings.
+        """
+        self.spool.seek(self.size)
+        for line in lines:
+            self.spool.write(str(line))
+
+        end = self.spool.tell()
+        if end > self.size:
+            self.file_diffs.append((self.size, end))
+            self.size = end
+
+
+    def get_file_diff(self, index):
+        start, end = self.file_diffs[index]
+        self.spool.seek(start)
+        return self.spool.read(end - start)
+
+
+    def iter_file_diffs(self):
+        for index in range(len(self.file_diffs)):
+            yield self.get_file_diff(index)
 
 
     def read(self):
-        return self.data
+        self.spool.seek(0)
+        return self.spool.read(self.size)
+
+
+    def __getstate__(self):
+        # Temporary files can't be pickled. This loads the whole diff, so
+        # get_cached_diff_file caches diffs file by file instead.
+        return {'name': self.name,
+                'description': self.description,
+                'file_diffs': list(self.iter_file_diffs())}
+
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['description'])
+        # Diffs cached before they were written file by file have one blob
+        for data in state.get('file_diffs', [state.get('data') or '']):
+            self.write_file_diff([data])
 
 
 class RepositoryRevisionCache:
 
+    # Minimum number of seconds between two queries for new commits
+    log_refresh_interval = 60
+
     def __init__(self, cache_key_prefix, freshness_delta):
         self.cache_key_prefix = cache_key_prefix
         self.freshness_delta = freshness_delta
@@ -61,18 +256,17 @@ class RepositoryRevisionCache:
         cache.set(cache_key, scm_user, 30 * 3600 * 24) # expires after 1 month (max memcached expiration value)
 
 
-    def get_latest_commits(self, userid, func_fetch_log_of_day):
-        log_entries = self._get_latest_revision_log(func_fetch_log_of_day)
-        user_revs = []
-
-        lc_userid = userid.lower()
-
-        for log in log_entries:
-            if log[1].lower() == lc_userid:
-                user_revs.append((log[0], log[2]))
-
-        return user_revs
+    def get_latest_commits(self, userid, func_fetch_log):
+        """
+        Returns (revision, description) tuples of the user's commits within
+        the freshness window.
 
+        func_fetch_log(first_day, revision) has to return (revision, user,
+        description, day) tuples of all commits after the given revision, or
+        of all commits since first_day if the revision is None.
+        """
+        log_index = self._get_log_index(func_fetch_log)
+        return [(rev, desc) for rev, desc, day in log_index['users'].get(userid.lower(), [])]
 
     def ignore_revisions(self, userid, new_revisions_to_be_ignored):
         cache_key = self.cache_key_prefix + '.post_ig.' + '.' + userid
@@ -98,30 +292,55 @@ class RepositoryRevisionCache:
         return [item for sublist in ignore_lists for item in sublist]
 
 
-    def _get_latest_revision_log(self, func_fetch_log_of_day):
-        cur = date.today()
+    def _get_log_index(self, func_fetch_log):
+        # The whole window is kept in a single cache entry, so that a lookup
+        # is a single cache read. Only commits after the highest revision
+        # already in the index are fetched from the repository.
+        cache_key = self.cache_key_prefix + '.post_log'
+        expiration = self.freshness_delta.days * 3600 * 24 + self.freshness_delta.seconds
+
+        log_index = cache_memoize(cache_key,
+                                  lambda: self._update_log_index(None, func_fetch_log),
+                                  expiration=expiration,
+                                  large_data=True)
+
+        if time.time() - log_index['updated'] >= self.log_refresh_interval:
+            log_index = self._update_log_index(log_index, func_fetch_log)
+            cache_memoize(cache_key, lambda: log_index,
+                          expiration=expiration,
+                          force_overwrite=True,
+                          large_data=True)
+
+        return log_index
+
+
+    def _update_log_index(self, log_index, func_fetch_log):
         first_day = date.today()-self.freshness_delta
-        log_entries = []
-        while cur > first_day:
-            latest_entries = log_entries
-            log_entries = self._get_log_of_day(cur, func_fetch_log_of_day)
-            log_entries.extend(latest_entries)
-            cur -= timedelta(days=1)
-        return log_entries
-
-
-    def _get_log_of_day(self, day, func_fetch_log_of_day):
-        if day == date.today():
-            # Today - do not use cache
-            return func_fetch_log_of_day(day)
+
+        if log_index == None:
+            revision = None
+            users = {}
         else:
+            revision = log_index['revision']
 
-            cache_key = self.cache_key_prefix + '.post_rc.'+ day.strftime("%Y-%m-%d")
-            # Load through cache
-            entries = cache.get(cache_key)
-            if entries != None:
-                return entries
-            else:
-                entries = func_fetch_log_of_day(day)
-                cache.set(cache_key, entries, self.freshness_delta.days * 3600 * 24 + self.freshness_delta.seconds)
-            return entries
+            # Drop commits that left the window
+            users = {}
+            for user, entries in log_index['users'].iteritems():
+                entries = [ entry for entry in entries if entry[2] > first_day ]
+                if len(entries) > 0:
+                    users[user] = entries
+
+        last_revision = revision
+        for rev, user, desc, day in func_fetch_log(first_day, last_revision):
+            if last_revision != None and int(rev) <= last_revision:
+                continue # already in the index
+
+            if revision == None or int(rev) > revision:
+                revision = int(rev)
+
+            if day > first_day:
+                users.setdefault(user.lower(), []).append((rev, desc, day))
+
+        return {'revision': revision,
+                'updated': time.time(),
+                'users': users}
@@ -4,12 +4,15 @@
 from reviewboard.scmtools.errors import SCMError
 from reviewboard.scmtools.svn import SVNTool
 from reviewboard.scmtools.core import HEAD
-from reviewboard.scmtools.post_utils import DiffFile
+from reviewboard.scmtools.models import PathKind, PathKindIndex
+from reviewboard.scmtools.post_utils import DiffFile, get_cached_diff_file
 
 import datetime
 import os
 import pysvn
+import Queue
 import tempfile
+import threading
 import urllib
 
 try:
@@ -18,12 +21,29 @@ except ImportError:
     pass
 
 from django.core.cache import cache
+from django.db.models import Q
 
 
 class SVNPostCommitTool(SVNTool):
     name = "Subversion Post Commit"
     support_post_commit = True
 
+    # Requested revisions at most this far apart are fetched with a single
+    # log call, accepting that the revisions in between are fetched as well.
+    log_batch_max_gap = 50
+
+    # Requested revisions at most this far past the end of the path kind
+    # index are left for update_path_kind_index to fill in the gap. Larger
+    # gaps restart the index.
+    path_kind_index_max_gap = 1000
+
+    # Number of revisions fetched with a single log call when extending the
+    # path kind index
+    path_kind_index_batch_size = 500
+
+    # Maximum number of paths passed to a single IN query
+    path_query_chunk_size = 500
+
     def __init__(self, repository):
         SVNTool.__init__(self, repository)
 
@@ -42,75 +62,333 @@ class SVNPostCommitTool(SVNTool):
         return SVNTool.get_file(self, path, revision)
 
 
-    def get_diff_file(self, revision_list):
+    def get_diff_file(self, revision_list, progress=None):
+        """
+        Returns the diff of the revisions. If given, progress is called with
+        the number of files fetched so far and the total number of files.
+        """
         if revision_list == None or len(revision_list) == 0:
             raise SCMError('List of revisions is empty')
-        return SVNDiffTool(self).get_diff_file(revision_list)
+
+        if len(revision_list) == 1:
+            # Committed revisions never change, so their diffs are cached
+            cache_key = 'svn_post_diff_file.'+ urllib.quote(self.repopath) +'.'+ str(revision_list[0])
+            return get_cached_diff_file(cache_key, lambda: SVNDiffTool(self).get_diff_file(revision_list, progress))
+
+        return SVNDiffTool(self).get_diff_file(revision_list, progress)
 
 
     def get_revision_info(self, revision):
-        cache_key = 'svn_post_get_revision_info.'+ urllib.quote(self.repopath) +'.'+ str(revision)
-        res = cache.get(cache_key)
-        if res != None:
-            return res
+        return self.get_revisions_info([revision])[0]
+
+
+    def get_revisions_info(self, revision_list):
+        """
+        Returns the revision infos of the given revisions in the given order.
+
+        Revisions that are not cached yet are fetched in bulk: one log call
+        per cluster of nearby revisions, and the text files among the changed
+        paths are determined with a few calls per touched folder instead of
+        two calls per path.
+        """
+        infos = {}
+        missing = []
+        for revision in revision_list:
+            res = cache.get(self._get_revision_info_cache_key(revision))
+            if res != None:
+                infos[int(revision)] = res
+            else:
+                missing.append(int(revision))
+
+        index = self._get_path_kind_index()
+
+        for first_rev, last_rev in self._cluster_revisions(missing):
+            logs = self.client.log(self.repopath,
+                                   Revision(opt_revision_kind.number, first_rev),
+                                   Revision(opt_revision_kind.number, last_rev),
+                                   True)
+
+            # Only the requested revisions are fetched here. A small gap to
+            # the end of the index is filled in by update_path_kind_index
+            # later on, outside of the request.
+            if not (index and
+                    index.last_revision + 1 < first_rev <=
+                    index.last_revision + self.path_kind_index_max_gap):
+                index = self._update_path_kind_index(index, first_rev,
+                                                     last_rev, logs)
+
+            logs = [log for log in logs if log.revision.number in missing]
+            text_files = self._find_text_files(logs)
+
+            for log in logs:
+                revision = log.revision.number
+                changed_paths = [cpath for cpath in log.changed_paths
+                                 if cpath['action'] == 'D' or
+                                    (cpath['path'], revision) in text_files]
+
+                revisionInfo = {'revision': revision,
+                                'user': log.author or '',
+                                'description': log.message or '',
+                                'changes': self._normalize(changed_paths),
+                                'date': log.date}
+
+                cache.set(self._get_revision_info_cache_key(revision), revisionInfo, 60*60*24*7)
+                infos[revision] = revisionInfo
+
+        revision_infos = []
+        for revision in revision_list:
+            if int(revision) not in infos:
+                raise SCMError('Revision ' + str(revision) +' not found')
+            revision_infos.append(infos[int(revision)])
+        return revision_infos
+
+
+    def _get_revision_info_cache_key(self, revision):
+        return 'svn_post_get_revision_info.'+ urllib.quote(self.repopath) +'.'+ str(revision)
+
+
+    def _cluster_revisions(self, revisions):
+        """
+        Splits the revisions into (first, last) ranges that are fetched with a
+        single log call each. Revisions that are at most log_batch_max_gap
+        apart share a range; unrequested revisions in between are dropped.
+        """
+        clusters = []
+        for revision in sorted(set(revisions)):
+            if clusters and revision - clusters[-1][1] <= self.log_batch_max_gap:
+                clusters[-1][1] = revision
+            else:
+                clusters.append([revision, revision])
+        return [tuple(cluster) for cluster in clusters]
 
-        rev = Revision(opt_revision_kind.number, revision)
-        logs = self.client.log(self.repopath, rev, rev, True)
 
-        if len(logs) != 1:
-            raise SCMError('Revision ' + str(revision) +' not found')
+    def is_file(self, path, revision):
+        return (path, int(revision)) in self._find_text_files_at([(path, int(revision))])
+
+
+    def update_path_kind_index(self, progress=None):
+        """
+        Extends the path kind index up to the HEAD revision.
+
+        This fills in the revisions that get_revisions_info skipped, in
+        batches of path_kind_index_batch_size revisions. If given, progress
+        is called with the last indexed revision and the HEAD revision
+        after each batch. Returns the number of indexed revisions.
+        """
+        index = self._get_path_kind_index()
+        if index is None:
+            # The index starts with the first requested revisions
+            return 0
+
+        info = self.client.info2(self.repopath,
+                                 revision=Revision(opt_revision_kind.head),
+                                 recurse=False)
+        head = info[0][1]['rev'].number
+        num_indexed = 0
+
+        while index.last_revision < head:
+            first_rev = index.last_revision + 1
+            last_rev = min(first_rev + self.path_kind_index_batch_size - 1,
+                           head)
+            logs = self.client.log(self.repopath,
+                                   Revision(opt_revision_kind.number, first_rev),
+                                   Revision(opt_revision_kind.number, last_rev),
+                                   True)
+            index = self._update_path_kind_index(index, first_rev, last_rev,
+                                                 logs)
+            num_indexed += last_rev - first_rev + 1
+
+            if progress:
+                progress(last_rev, head)
+
+        return num_indexed
+
+
+    def _get_path_kind_index(self):
+        try:
+            return PathKindIndex.objects.get(repository=self.repository)
+        except PathKindIndex.DoesNotExist:
+            return None
+
+
+    def _update_path_kind_index(self, index, first_rev, last_rev, logs):
+        """
+        Records the changed paths of the given contiguous log in the path
+        kind index and returns the updated index.
+        """
+        if index is None:
+            index = PathKindIndex(repository=self.repository,
+                                  first_revision=first_rev,
+                                  last_revision=first_rev - 1)
+        elif last_rev <= index.last_revision:
+            return index # nothing new
+        elif first_rev > index.last_revision + 1:
+            # Gap is too large, restart the index. Open ranges are only known
+            # to be valid up to the end of the old index.
+            PathKind.objects.filter(repository=self.repository,
+                                    last_revision__isnull=True) \
+                            .update(last_revision=index.last_revision)
+            index.first_revision = first_rev
+            index.last_revision = first_rev - 1
+
+        for log in logs:
+            revision = log.revision.number
+            if index.last_revision < revision <= last_rev:
+                self._index_changed_paths(revision, log.changed_paths)
+
+        index.last_revision = last_rev
+        index.save()
+        return index
+
+
+    def _index_changed_paths(self, revision, changed_paths):
+        # Close the ranges of nodes that end in this revision. Deleting or
+        # replacing a folder ends the ranges of everything below it as well.
+        # A modification may set svn:mime-type and change the kind of the
+        # path, so it ends the range as well, unless the log tells that no
+        # properties were modified.
+        added = []
+        for cpath in changed_paths:
+            path = cpath['path']
+            if cpath['action'] == 'A' or \
+               (cpath['action'] == 'M' and cpath.get('props_modified', True)):
+                added.append(path)
+            elif cpath['action'] in ('D', 'R'):
+                self._get_open_path_kinds().filter(Q(path=path) |
+                                                   Q(path__startswith=path + '/')) \
+                                           .update(last_revision=revision - 1)
+
+        for paths in self._chunks(added):
+            self._get_open_path_kinds().filter(path__in=paths) \
+                                       .update(last_revision=revision - 1)
+
+        # Open new ranges for the paths whose ranges were closed above and for
+        # modified paths that are seen for the first time. The kind of the
+        # new ranges is looked up again when needed.
+        modified = [cpath['path'] for cpath in changed_paths
+                    if cpath['action'] == 'M' and
+                       not cpath.get('props_modified', True)]
+        known = set()
+        for paths in self._chunks(modified):
+            known.update(self._get_open_path_kinds().filter(path__in=paths)
+                                                    .values_list('path', flat=True))
 
-        changed_paths = self._reduceToTextFiles(logs[0].changed_paths, revision)
-        changes = self._normalize(changed_paths)
+        for cpath in changed_paths:
+            if cpath['action'] in ('A', 'R') or \
+               (cpath['action'] == 'M' and cpath['path'] not in known):
+                PathKind.objects.create(repository=self.repository,
+                                        path=cpath['path'],
+                                        first_revision=revision)
+
+
+    def _get_open_path_kinds(self):
+        return PathKind.objects.filter(repository=self.repository,
+                                       last_revision__isnull=True)
+
+
+    def _chunks(self, paths):
+        size = self.path_query_chunk_size
+        return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+
+    def _find_text_files(self, logs):
+        # Deleted paths are always kept to filter the content of deleted
+        # folders later on, so they need no lookup
+        return self._find_text_files_at([(cpath['path'], log.revision.number)
+                                         for log in logs
+                                         for cpath in log.changed_paths
+                                         if cpath['action'] != 'D'])
+
+
+    def _find_text_files_at(self, path_revisions):
+        """
+        Returns the set of (path, revision) pairs that refer to text files.
+
+        The path kind index is consulted first. Only paths whose kind is not
+        known yet are looked up in the repository and then recorded.
+        """
+        path_kinds = {}
+        for paths in self._chunks(list(set([path for path, revision in path_revisions]))):
+            for path_kind in PathKind.objects.filter(repository=self.repository,
+                                                     path__in=paths):
+                path_kinds.setdefault(path_kind.path, []).append(path_kind)
+
+        text_files = set()
+        unknown = []
+        for path, revision in path_revisions:
+            covering = [path_kind for path_kind in path_kinds.get(path, [])
+                        if path_kind.covers(revision)]
+            if covering:
+                # Prefer the most recent range in case of overlaps
+                path_kind = max(covering, key=lambda k: k.first_revision)
+            else:
+                path_kind = None
 
-        revisionInfo = {'revision': revision,
-                        'user': logs[0].author or '',
-                        'description': logs[0].message or '',
-                        'changes': changes,
-                        'date': logs[0].date}
+            if path_kind is None or path_kind.is_text is None:
+                unknown.append((path, revision, path_kind))
+            elif path_kind.is_text:
+                text_files.add((path, revision))
 
-        cache.set(cache_key, revisionInfo, 60*60*24*7)
-        return revisionInfo
+        fetched = self._fetch_text_files([entry[:2] for entry in unknown])
 
+        for path, revision, path_kind in unknown:
+            if path_kind is None:
+                # Outside of the indexed revisions, only this revision is known
+                path_kind = PathKind(repository=self.repository, path=path,
+                                     first_revision=revision,
+                                     last_revision=revision)
+            path_kind.is_text = (path, revision) in fetched
+            path_kind.save()
 
-    def is_file(self, path, revision):
-        quoted_path = urllib.quote(path)
-        cache_key = 'svn_post_is_file.'+ urllib.quote(self.repopath) +'.'+ quoted_path   # revision is ignored because a change in file type is considered to happen only very seldom
-        cache_timeout = 60*60*24 * 7 * 30
-        res = cache.get(cache_key)
+            if path_kind.is_text:
+                text_files.add((path, revision))
 
-        if res != None:
-            return res
+        return text_files
 
-        rev = Revision(opt_revision_kind.number, revision)
 
-        entry = self.client.info2(self.repopath+quoted_path, revision=rev)
-        if entry[0][1]['kind'] != pysvn.node_kind.file:
-            cache.set(cache_key, False, cache_timeout)
-            return False
+    def _fetch_text_files(self, path_revisions):
+        """
+        Looks up which of the (path, revision) pairs refer to text files.
 
-        property = self.client.propget('svn:mime-type', self.repopath+quoted_path, rev)
-        if len(property) > 0:
-            if 'application/octet-stream' in property.values():
-                cache.set(cache_key, False, cache_timeout)
-                return False
+        Paths are grouped by parent folder and revision, so that all
+        siblings are resolved with one info2 and one propget call.
+        """
+        folders = {}
+        for path, revision in path_revisions:
+            folder = (path.rsplit('/', 1)[0], revision)
+            folders.setdefault(folder, set()).add(path)
 
-        cache.set(cache_key, True, cache_timeout)
-        return True
+        text_files = set()
+        for (folder, revision), paths in folders.iteritems():
+            rev = Revision(opt_revision_kind.number, revision)
+
+            if len(paths) == 1:
+                url = self.repopath + urllib.quote(list(paths)[0])
+                depth = pysvn.depth.empty
+            else:
+                url = self.repopath + urllib.quote(folder)
+                depth = pysvn.depth.immediates
 
+            files = set()
+            for entry in self.client.info2(url, revision=rev, depth=depth):
+                if entry[1]['kind'] == pysvn.node_kind.file:
+                    files.add(self._get_path_of_url(entry[1]['URL']))
+
+            binaries = set()
+            properties = self.client.propget('svn:mime-type', url, rev, depth=depth)
+            for prop_url, mime_type in properties.iteritems():
+                if mime_type == 'application/octet-stream':
+                    binaries.add(self._get_path_of_url(prop_url))
+
+            for path in paths:
+                if path in files and path not in binaries:
+                    text_files.add((path, revision))
+
+        return text_files
 
-    def _reduceToTextFiles(self, changed_paths, revision):
-        filtered = []
-        for cpath in changed_paths:
-            rev = int(revision)
-            if cpath['action'] == 'D':
-                # Always append deleted paths
-                # This is needed to filter content of deleted folders. All deleted entries will be removed later.
-                rev = rev - 1
-                filtered.append(cpath)
-            elif self.is_file(cpath['path'], rev):
-                filtered.append(cpath)
-        return filtered
+
+    def _get_path_of_url(self, url):
+        return urllib.unquote(url)[len(urllib.unquote(self.repopath)):]
 
 
     def _normalize(self, changed_paths):
@@ -199,18 +477,19 @@ class SVNDiffTool:
 
 
     # Creates a diff file based on a SVN revisions
-    def get_diff_file(self, revision_list):
+    def get_diff_file(self, revision_list, progress=None):
         description = ''
-        diff_lines = []
+        summary = ''
 
         try:
             revision_list.sort()
 
-            if len(revision_list) != 1:
-                summary = ''  # user should give a summary
-            else:
+            # Fetch all revisions at once instead of one by one
+            revision_infos = self.tool.get_revisions_info(revision_list)
+
+            if len(revision_list) == 1:
                 # Use first line of commit message as summary
-                revInfo = self.tool.get_revision_info(revision_list[0])
+                revInfo = revision_infos[0]
                 desc = revInfo['description'].splitlines()
                 if len(desc) > 0:
                     summary = desc[0].strip()
@@ -218,55 +497,161 @@ class SVNDiffTool:
 
             # Determine list of modified files including a modification status
             modifications = {}
-            for revision in revision_list:
-                description += self._merge_revision_into_modifications(revision, modifications)
+            for revInfo in revision_infos:
+                description += self._merge_revision_into_modifications(revInfo, modifications)
 
             # Remove deleted files + folders AND remove files that are located in deleted folders
             modifications = remove_deleted_paths(modifications)
 
-            temp_dir_name = tempfile.mkdtemp(prefix='reviewboard_svn_post.')
+            # Create difference. Paths are processed in sorted order so that
+            # the serial and the parallel mode produce identical diffs.
+            diff_file = DiffFile(summary, description)
+            files_fetched = 0
+            for file_diff_lines in self._get_diffs(modifications):
+                diff_file.write_file_diff(file_diff_lines)
 
-            # Create difference
-            for path, status in modifications.iteritems():
-                try:
-                    if status.change_type == DiffStatus.ADDED:
-                        diff_lines += self._get_diff_of_new_file(path, status.last_rev)
-
-                    elif status.change_type == DiffStatus.DELETED:
-                        if status.first_rev != 0:  # we ignore new files that were deleted again
-                            diff_lines += self._get_diff_of_deleted_file(path, status.first_rev)
-
-                    else: # MODIFIED
-                        rev1 = Revision(opt_revision_kind.number, status.first_rev)
-                        rev2 = Revision(opt_revision_kind.number, status.last_rev)
-                        try:
-                            diff = self.tool.client.diff(temp_dir_name, self.tool.repopath + urllib.quote(path), revision1=rev1, revision2=rev2)
-                            if diff.startswith('Index:'):
-                                # We have content changes
-                                expanded_diff = self._expand_filename(diff, path, status.first_rev, status.last_rev)
-                                self._remove_property_changes(expanded_diff)
-                                diff_lines += expanded_diff
-
-                        except pysvn.ClientError, e:
-                            if str(e).find('was not found in the repository at revision') != -1:
-                                # Looks like we have special case here, e.g. replacing and renaming at the same time
-                                diff_lines += self._get_diff_of_new_file(path, status.last_rev)
-                            else:
-                                raise
-
-                except Exception, e:
-                    os.rmdir(temp_dir_name)
-                    raise SCMError('Problem with ' + path +': '+ str(e))
-
-            os.rmdir(temp_dir_name)
+                files_fetched += 1
+                if progress:
+                    progress(files_fetched, len(modifications))
 
         except Exception, e:
             raise SCMError('Error creating diff: ' + str(e) )
 
-        if len(diff_lines) < 3:
+        if len(diff_file.file_diffs) == 0:
             raise SCMError('There is no source code difference. The changes might consist of deletions only or neutralize each other. Binary files and folders are ignored completely.')
 
-        return DiffFile(summary, description, str(''.join(diff_lines)))
+        return diff_file
+
+
+    def _get_diffs(self, modifications):
+        """
+        Yields the diff lines of each path in sorted path order.
+
+        Depending on the number of diff workers configured for the repository
+        the per-file diffs are fetched one after another or by a bounded pool
+        of threads. Each thread uses its own SCM tool and thus its own pysvn
+        client, because pysvn clients must not be shared between threads.
+        """
+        paths = sorted(modifications.keys())
+        num_workers = min(self.tool.repository.diff_workers or 1, len(paths))
+
+        if num_workers <= 1:
+            temp_dir_name = tempfile.mkdtemp(prefix='reviewboard_svn_post.')
+            try:
+                for path in paths:
+                    yield self._get_diff_of_path(path, modifications[path], temp_dir_name)
+            finally:
+                os.rmdir(temp_dir_name)
+            return
+
+        # Results are handed over as soon as they are complete, so that only
+        # the diffs finished ahead of the next path in order are kept around.
+        results = {}
+        errors = {}
+        finished = threading.Condition()
+        pending = Queue.Queue()
+        for idx in range(len(paths)):
+            pending.put(idx)
+
+        def worker():
+            try:
+                diff_tool = SVNDiffTool(type(self.tool)(self.tool.repository))
+                temp_dir_name = tempfile.mkdtemp(prefix='reviewboard_svn_post.')
+            except Exception, e:
+                finished.acquire()
+                errors[-1] = e
+                finished.notify()
+                finished.release()
+                return
+
+            try:
+                while not errors:
+                    try:
+                        idx = pending.get_nowait()
+                    except Queue.Empty:
+                        return
+
+                    try:
+                        result = diff_tool._get_diff_of_path(
+                            paths[idx], modifications[paths[idx]], temp_dir_name)
+                    except Exception, e:
+                        result = None
+                        error = e
+
+                    finished.acquire()
+                    if result is None:
+                        errors[idx] = error
+                    else:
+                        results[idx] = result
+                    finished.notify()
+                    finished.release()
+            finally:
+                os.rmdir(temp_dir_name)
+
+        threads = [threading.Thread(target=worker) for i in range(num_workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for idx in range(len(paths)):
+                finished.acquire()
+                try:
+                    while idx not in results and not errors:
+                        finished.wait(1.0)
+
+                        if idx not in results and not errors and \
+                           not [thread for thread in threads if thread.isAlive()]:
+                            raise SCMError('Problem with ' + paths[idx] +': diff worker stopped')
+
+                    if idx not in results:
+                        # Report the error of the first failing path
+                        raise errors[min(errors.keys())]
+
+                    result = results.pop(idx)
+                finally:
+                    finished.release()
+
+                yield result
+        finally:
+            # Let the workers stop early if we bailed out
+            finished.acquire()
+            errors.setdefault(-2, None)
+            finished.release()
+            for thread in threads:
+                thread.join()
+
+
+    def _get_diff_of_path(self, path, status, temp_dir_name):
+        try:
+            if status.change_type == DiffStatus.ADDED:
+                return self._get_diff_of_new_file(path, status.last_rev)
+
+            elif status.change_type == DiffStatus.DELETED:
+                if status.first_rev != 0:  # we ignore new files that were deleted again
+                    return self._get_diff_of_deleted_file(path, status.first_rev)
+
+            else: # MODIFIED
+                rev1 = Revision(opt_revision_kind.number, status.first_rev)
+                rev2 = Revision(opt_revision_kind.number, status.last_rev)
+                try:
+                    diff = self.tool.client.diff(temp_dir_name, self.tool.repopath + urllib.quote(path), revision1=rev1, revision2=rev2)
+                    if diff.startswith('Index:'):
+                        # We have content changes
+                        expanded_diff = self._expand_filename(diff, path, status.first_rev, status.last_rev)
+                        self._remove_property_changes(expanded_diff)
+                        return expanded_diff
+
+                except pysvn.ClientError, e:
+                    if str(e).find('was not found in the repository at revision') != -1:
+                        # Looks like we have special case here, e.g. replacing and renaming at the same time
+                        return self._get_diff_of_new_file(path, status.last_rev)
+                    else:
+                        raise
+
+        except Exception, e:
+            raise SCMError('Problem with ' + path +': '+ str(e))
+
+        return []
 
 
     def _expand_filename(self, diff, fullname, rev1, rev2):
@@ -300,48 +685,46 @@ class SVNDiffTool:
     def _get_diff_of_new_file(self, path, new_revision):
         # is same like diff with empty content
         content = self.tool.get_file(path, new_revision)
-        diff_lines = content.splitlines(True)
-
-        file_len = len(diff_lines)
-
-        if not diff_lines[file_len - 1].endswith('\n'):
-            diff_lines.append('\n\\ No newline at end of file\n')
-
-        for idx in range(0, file_len):
-            diff_lines[idx] = '+' + diff_lines[idx]
-
-        diff_lines.insert(0, '@@ -0,0 +1,%d @@\n' % file_len)     # @@ -R +R @@ with R = l,s with l=line and s=block size in number of lines
-        diff_lines.insert(0, '+++ %s\t(revision %s)\n' % (path, str(new_revision)))
-        diff_lines.insert(0, '--- %s\t(revision 0)\n' % (path))
-
-        return diff_lines
+        return list(self._get_diff_of_content(content, '+', [
+            '--- %s\t(revision 0)\n' % (path),
+            '+++ %s\t(revision %s)\n' % (path, str(new_revision)),
+        ], '@@ -0,0 +1,%d @@\n', []))
 
 
     def _get_diff_of_deleted_file(self, path, last_revision):
         # is same like diff with empty file
         content = self.tool.get_file(path, last_revision)
-        diff_lines = content.splitlines(True)
+        return list(self._get_diff_of_content(content, '-', [
+            '--- %s\t(revision %s)\n' % (path, str(last_revision)),
+            '+++ %s\t(revision 0)\n' % (path),
+        ], '@@ -1,%d +1,1 @@\n', ['+' + self.REMOVED_FILE + '\n']))
 
-        file_len = len(diff_lines)
 
-        if not diff_lines[file_len - 1].endswith('\n'):
-            diff_lines.append('\n\\ No newline at end of file\n')
+    def _get_diff_of_content(self, content, prefix, headers, hunk_header, trailer):
+        """
+        Yields the diff lines of a file whose content is completely added or
+        removed, without building intermediate copies of the content.
+        """
+        diff_lines = content.splitlines(True)
 
-        for idx in range(0, file_len):
-            diff_lines[idx] = '-' + diff_lines[idx]
+        for line in headers:
+            yield line
 
-        diff_lines.insert(0, '+' + self.REMOVED_FILE + '\n')
+        # @@ -R +R @@ with R = l,s with l=line and s=block size in number of lines
+        yield hunk_header % len(diff_lines)
 
-        diff_lines.insert(0, '@@ -1,%d +1,1 @@\n' % file_len)     # @@ -R +R @@ with R = l,s with l=line and s=block size in number of lines
+        for line in trailer:
+            yield line
 
-        diff_lines.insert(0, '+++ %s\t(revision 0)\n' % (path))
-        diff_lines.insert(0, '--- %s\t(revision %s)\n' % (path, str(last_revision)))
+        for line in diff_lines:
+            yield prefix + line
 
-        return diff_lines
+        if not diff_lines[-1].endswith('\n'):
+            yield '\n\\ No newline at end of file\n'
 
 
-    def _merge_revision_into_modifications(self, revision, modifications):
-        revInfo = self.tool.get_revision_info(revision)
+    def _merge_revision_into_modifications(self, revInfo, modifications):
+        revision = revInfo['revision']
 
         if len(revInfo['changes']) == 0:
             return ''  # skip revision
@@ -19,17 +19,6 @@ except ImportError:
 
 
 
-def extract_revision_user(line):
-    # Try to extract revision info tuple (rev, user) from line
-    # Revision info example: "116855 by henkel on 2011-03-24 11:30 AM"
-    words = line.split(' ',  4)
-                
-    if len(words)>=4 and words[0].isdigit() and words[1] == 'by' and words[3] == 'on':
-        return (words[0], words[2])
-    
-    return None
-
-
 class SVNPostCommitTrackerTool(SVNPostCommitTool):
     name = "Subversion Post Commit Tracker"
     
@@ -49,13 +38,12 @@ class SVNPostCommitTrackerTool(SVNPostCommitTool):
     
     def get_missing_revisions(self, userid, scm_user):
         # Fetch user's commits from repository
-        commits = self.revisionCache.get_latest_commits(userid, self._fetch_log_of_day_uncached)
+        commits = self.revisionCache.get_latest_commits(userid, self._fetch_log_uncached)
         
         # Fetch the already contained
         known_revisions = get_known_revisions(userid, 
                                               self.repository, 
-                                              self.revisionCache.get_freshness_delta(), 
-                                              extract_revision_user)
+                                              self.revisionCache.get_freshness_delta())
         
         commits_to_be_ignored = self.revisionCache.get_ignored_revisions(userid)        
         
@@ -68,33 +56,45 @@ class SVNPostCommitTrackerTool(SVNPostCommitTool):
         return sorted_revisions
 
 
+    def get_missing_submitted_revisions(self, userid, scm_user):
+        # All Subversion revisions are committed
+        return self.get_missing_revisions(userid, scm_user)
+
+
     def ignore_revisions(self, userid, new_revisions_to_be_ignored):
         self.revisionCache.ignore_revisions(userid, new_revisions_to_be_ignored)
         
 
-    def _fetch_log_of_day_uncached(self, day):  
-        start_time = time.mktime(day.timetuple())
-        end_time = time.mktime((day+timedelta(days=1)).timetuple())
-        
-        start = Revision(opt_revision_kind.date, start_time)
-        end = Revision(opt_revision_kind.date, end_time)
+    def _fetch_log_uncached(self, first_day, revision):
+        head = Revision(opt_revision_kind.head)
+        if revision == None:
+            start_time = time.mktime(first_day.timetuple())
+            start = Revision(opt_revision_kind.date, start_time)
+        else:
+            start_time = 0
+            start = Revision(opt_revision_kind.number, revision)
+
         log = []
         
         try:
-            for entry in self.client.log(self.repopath, revision_start=start, revision_end=end):
+            for entry in self.client.log(self.repopath, revision_start=start, revision_end=head):
                 
                 if entry['date'] < start_time:
                     continue # workaround for pysvn bug which adds the previous day's last entry
+
+                if revision != None and entry['revision'].number <= revision:
+                    continue # already known
                 
                 submit_date = datetime.fromtimestamp(entry['date'])      
                 date_str = submit_date.strftime("%Y-%m-%d")
                 
                 message = entry['message'] or '' 
-                msg = message.splitlines()[0].strip()
+                msg = (message.splitlines() or [''])[0].strip()
                 desc = 'on ' +date_str + ' : ' + msg
                 log.append(( str(entry['revision'].number), 
-                             entry['author'], 
-                             desc))
+                             entry['author'] or '', 
+                             desc,
+                             submit_date.date()))
                        
         except pysvn.ClientError, e:
             stre = str(e)
@@ -104,6 +104,3 @@ class SVNPostCommitTrackerTool(SVNPostCommitTool):
                 raise SCMError('Error fetching revisions: ' +str(e))
         
         return log      
-        
-        
-
@@ -3,9 +3,11 @@ import imp
 import os
 import nose
 import paramiko
+import pickle
 import shutil
 import socket
 import tempfile
+import time
 try:
     from hashlib import md5
 except ImportError:
@@ -30,7 +32,8 @@ from reviewboard.scmtools.errors import SCMError, FileNotFoundError, \
                                         AuthenticationError
 from reviewboard.scmtools.forms import RepositoryForm
 from reviewboard.scmtools.git import ShortSHA1Error
-from reviewboard.scmtools.models import Repository, Tool
+from reviewboard.scmtools.models import PathKind, PathKindIndex, \
+                                        Repository, Tool
 from reviewboard.scmtools.perforce import STunnelProxy, STUNNEL_SERVER
 from reviewboard.site.models import LocalSite
 
@@ -154,6 +157,35 @@ class CoreTests(DjangoTestCase):
         self.assert_(len(cs.files) == 0)
 
 
+class RepositoryTests(DjangoTestCase):
+    """Tests for the scmtools.models.Repository model"""
+    fixtures = ['test_scmtools.json']
+
+    def testSCMToolCache(self):
+        """Testing reusing SCMTools until the repository changes"""
+        repository = Repository.objects.create(
+            name='Subversion SVN',
+            path='file://' + os.path.join(os.path.dirname(__file__),
+                                          'testdata/svn_repo'),
+            tool=Tool.objects.get(name='Subversion'))
+
+        try:
+            tool = repository.get_scmtool()
+        except ImportError:
+            raise nose.SkipTest('pysvn is not installed')
+
+        self.assertTrue(repository.get_scmtool() is tool)
+        self.assertTrue(
+            Repository.objects.get(pk=repository.pk).get_scmtool() is tool)
+
+        repository.username = 'test'
+        self.assertFalse(repository.get_scmtool() is tool)
+
+        tool = repository.get_scmtool()
+        repository.save()
+        self.assertFalse(repository.get_scmtool() is tool)
+
+
 class SSHUtilsTests(SCMTestCase):
     """Unit tests for sshutils."""
     def setUp(self):
@@ -602,6 +634,226 @@ class SubversionTests(SCMTestCase):
         patch(diff, file, filename)
 
 
+class SVNPostCommitTests(SCMTestCase):
+    """Unit tests for the Subversion post-commit tool."""
+    fixtures = ['test_scmtools.json']
+
+    def setUp(self):
+        super(SVNPostCommitTests, self).setUp()
+
+        svn_repo_path = os.path.join(os.path.dirname(__file__),
+                                     'testdata/svn_repo')
+        self.repository = Repository(name='Subversion SVN',
+                                     path='file://' + svn_repo_path,
+                                     tool=Tool.objects.get(name='Subversion'))
+        self.repository.save()
+
+        try:
+            from reviewboard.scmtools.svn_post import SVNPostCommitTool
+            self.tool = SVNPostCommitTool(self.repository)
+        except ImportError:
+            raise nose.SkipTest('pysvn is not installed')
+
+    def _make_log(self, revision, changes):
+        class LogRevision:
+            number = revision
+
+        class LogEntry:
+            pass
+
+        log = LogEntry()
+        log.revision = LogRevision()
+        log.changed_paths = [{'action': action, 'path': path}
+                             for action, path in changes]
+        return log
+
+    def _get_ranges(self, path):
+        return [(kind.first_revision, kind.last_revision)
+                for kind in PathKind.objects.filter(repository=self.repository,
+                                                    path=path)
+                                            .order_by('first_revision')]
+
+    def testPathKindIndex(self):
+        """Testing SVNPostCommitTool path kind index maintenance"""
+        logs = [
+            self._make_log(10, [('A', '/trunk/dir'),
+                                ('A', '/trunk/dir/a.c')]),
+            self._make_log(11, [('M', '/trunk/b.c')]),
+            self._make_log(12, [('D', '/trunk/dir')]),
+            self._make_log(13, [('R', '/trunk/b.c')]),
+        ]
+        index = self.tool._update_path_kind_index(None, 10, 13, logs)
+
+        self.assertEqual(index.first_revision, 10)
+        self.assertEqual(index.last_revision, 13)
+        self.assertEqual(self._get_ranges('/trunk/dir/a.c'), [(10, 11)])
+        self.assertEqual(self._get_ranges('/trunk/b.c'),
+                         [(11, 12), (13, None)])
+
+        # Known kinds are answered from the index
+        PathKind.objects.filter(path='/trunk/b.c').update(is_text=True)
+        self.assertEqual(self.tool._find_text_files_at([('/trunk/b.c', 11),
+                                                        ('/trunk/b.c', 20)]),
+                         set([('/trunk/b.c', 11), ('/trunk/b.c', 20)]))
+
+        # A gap that is too large restarts the index
+        index = self.tool._update_path_kind_index(
+            index, 2000, 2000, [self._make_log(2000, [])])
+        self.assertEqual(index.first_revision, 2000)
+        self.assertEqual(self._get_ranges('/trunk/b.c'),
+                         [(11, 12), (13, 13)])
+
+
+    def testPathKindIndexTypeChange(self):
+        """Testing SVNPostCommitTool path kind index with mime-type changes"""
+        logs = [
+            self._make_log(10, [('A', '/trunk/a.png')]),
+            self._make_log(11, [('M', '/trunk/a.png')]),
+        ]
+        logs[1].changed_paths[0]['props_modified'] = False
+        index = self.tool._update_path_kind_index(None, 10, 11, logs)
+        PathKind.objects.filter(path='/trunk/a.png').update(is_text=True)
+
+        # Modifications without property changes keep the kind
+        self.assertEqual(self._get_ranges('/trunk/a.png'), [(10, None)])
+
+        # Setting svn:mime-type to application/octet-stream makes the file
+        # binary without replacing it
+        log = self._make_log(12, [('M', '/trunk/a.png')])
+        log.changed_paths[0]['props_modified'] = True
+        self.tool._update_path_kind_index(index, 12, 12, [log])
+
+        self.assertEqual(self._get_ranges('/trunk/a.png'),
+                         [(10, 11), (12, None)])
+
+        path_kind = PathKind.objects.get(path='/trunk/a.png',
+                                         first_revision=12)
+        self.assertEqual(path_kind.is_text, None)
+
+        self.tool._fetch_text_files = lambda path_revisions: set()
+        self.assertEqual(self.tool._find_text_files_at([('/trunk/a.png', 11),
+                                                        ('/trunk/a.png', 12)]),
+                         set([('/trunk/a.png', 11)]))
+
+    def testUpdatePathKindIndex(self):
+        """Testing SVNPostCommitTool.update_path_kind_index"""
+        logs = {
+            11: self._make_log(11, [('M', '/trunk/b.c')]),
+            12: self._make_log(12, [('D', '/trunk/a.c')]),
+        }
+
+        class HeadRevision:
+            number = 12
+
+        class FakeClient:
+            def info2(self, url, revision, recurse):
+                return [(url, {'rev': HeadRevision()})]
+
+            def log(self, url, revision_start, revision_end,
+                    discover_changed_paths):
+                return [logs[revision]
+                        for revision in range(revision_start.number,
+                                              revision_end.number + 1)]
+
+        self.assertEqual(self.tool.update_path_kind_index(), 0)
+
+        self.tool._update_path_kind_index(
+            None, 10, 10, [self._make_log(10, [('A', '/trunk/a.c')])])
+        self.tool.client = FakeClient()
+        self.tool.path_kind_index_batch_size = 1
+
+        self.assertEqual(self.tool.update_path_kind_index(), 2)
+        self.assertEqual(PathKindIndex.objects.get(
+            repository=self.repository).last_revision, 12)
+        self.assertEqual(self._get_ranges('/trunk/a.c'), [(10, 11)])
+        self.assertEqual(self._get_ranges('/trunk/b.c'), [(11, None)])
+
+class PostCommitUtilsTests(DjangoTestCase):
+    """Unit tests for the post-commit tool utilities."""
+    def testUnifiedDiffHunks(self):
+        """Testing get_unified_diff_hunks"""
+        from reviewboard.scmtools.post_utils import get_unified_diff_hunks, \
+                                                    split_diff_lines
+
+        old = split_diff_lines('a\nb\nc\nd\ne\nf\ng\nh\ni\nj')
+        new = split_diff_lines('a\nB\nc\nd\ne\nf\ng\nh\ni\nj\n')
+
+        self.assertEqual(get_unified_diff_hunks(old, new),
+                         ['@@ -1,5 +1,5 @@\n', ' a\n', '-b\n', '+B\n',
+                          ' c\n', ' d\n', ' e\n',
+                          '@@ -7,4 +7,4 @@\n', ' g\n', ' h\n', ' i\n',
+                          '-j\n\\ No newline at end of file\n', '+j\n'])
+        self.assertEqual(get_unified_diff_hunks([], split_diff_lines('a\n')),
+                         ['@@ -0,0 +1 @@\n', '+a\n'])
+        self.assertEqual(get_unified_diff_hunks(old, old), [])
+
+    def testDiffFilePickle(self):
+        """Testing pickling DiffFile"""
+        from reviewboard.scmtools.post_utils import DiffFile
+
+        diff_file = DiffFile('r1', 'Description')
+        diff_file.write_file_diff(['--- a\n', '+++ a\n', '+a\n'])
+        diff_file.write_file_diff(['--- b\n', '+++ b\n', '-b\n'])
+
+        diff_file = pickle.loads(pickle.dumps(diff_file))
+
+        self.assertEqual(diff_file.name, 'r1')
+        self.assertEqual(diff_file.description, 'Description')
+        self.assertEqual(list(diff_file.iter_file_diffs()),
+                         ['--- a\n+++ a\n+a\n', '--- b\n+++ b\n-b\n'])
+
+    def testCachedDiffFile(self):
+        """Testing get_cached_diff_file"""
+        from reviewboard.scmtools.post_utils import DiffFile, \
+                                                    get_cached_diff_file
+
+        calls = []
+
+        def get_diff_file():
+            calls.append(True)
+            diff_file = DiffFile('r2', 'Description')
+            diff_file.write_file_diff(['--- a\n+++ a\n+a\n'])
+            diff_file.write_file_diff(['--- b\n+++ b\n-b\n'])
+            return diff_file
+
+        cache_key = 'test_cached_diff_file.%s' % time.time()
+
+        for i in range(2):
+            diff_file = get_cached_diff_file(cache_key, get_diff_file)
+            self.assertEqual(diff_file.name, 'r2')
+            self.assertEqual(diff_file.description, 'Description')
+            self.assertEqual(list(diff_file.iter_file_diffs()),
+                             ['--- a\n+++ a\n+a\n', '--- b\n+++ b\n-b\n'])
+
+        self.assertEqual(len(calls), 1)
+
+    def testRevisionLogIndex(self):
+        """Testing RepositoryRevisionCache incremental log index"""
+        from datetime import date, timedelta
+        from reviewboard.scmtools.post_utils import RepositoryRevisionCache
+
+        today = date.today()
+        calls = []
+
+        def fetch_log(first_day, revision):
+            calls.append(revision)
+            if revision is None:
+                return [('10', 'Alice', 'on ... : Old', today),
+                        ('11', 'bob', 'on ... : Other', today)]
+            else:
+                return [('12', 'alice', 'on ... : New', today)]
+
+        revision_cache = RepositoryRevisionCache('test_log_index',
+                                                 timedelta(days=21))
+        self.assertEqual(revision_cache.get_latest_commits('alice', fetch_log),
+                         [('10', 'on ... : Old')])
+
+        revision_cache.log_refresh_interval = 0
+        self.assertEqual(revision_cache.get_latest_commits('ALICE', fetch_log),
+                         [('10', 'on ... : Old'), ('12', 'on ... : New')])
+        self.assertEqual(calls, [None, 11])
+
+
 class PerforceTests(SCMTestCase):
     """Unit tests for perforce.
 
@@ -36,15 +36,18 @@ from djblets.webapi.resources import WebAPIResource as DjbletsWebAPIResource, \
 from reviewboard import get_version_string, get_package_version, is_release
 from reviewboard.accounts.models import Profile
 from reviewboard.changedescs.models import ChangeDescription
-from reviewboard.diffviewer.diffutils import get_diff_files
+from reviewboard.diffviewer.diffutils import get_diff_files, \
+                                             highlight_collapsed_chunks
 from reviewboard.diffviewer.forms import EmptyDiffError
+from reviewboard.diffviewer.models import DiffSetWarmUp
 from reviewboard.attachments.forms import UploadFileForm
 from reviewboard.attachments.models import FileAttachment
 from reviewboard.reviews.errors import PermissionError
 from reviewboard.reviews.forms import UploadDiffForm, UploadScreenshotForm
 from reviewboard.reviews.models import BaseComment, Comment, DiffSet, \
                                        FileDiff, Group, Repository, \
-                                       ReviewRequest, ReviewRequestDraft, \
+                                       PostCommitJob, ReviewRequest, \
+                                       ReviewRequestDraft, \
                                        Review, ScreenshotComment, Screenshot, \
                                        FileAttachmentComment
 from reviewboard.scmtools import sshutils
@@ -1095,10 +1098,15 @@ class FileDiffResource(WebAPIResource):
         assert len(files) == 1
         f = files[0]
 
+        if highlighting:
+            highlight_collapsed_chunks(f)
+
         payload = {
             'diff_data': {
                 'binary': f['binary'],
-                'chunks': f['chunks'],
+                # The lines of cached chunks are decoded when used.
+                'chunks': [dict(chunk, lines=chunk['lines'])
+                           for chunk in f['chunks']],
                 'num_changes': f['num_changes'],
                 'changed_chunk_indexes': f['changed_chunk_indexes'],
                 'new_file': f['newfile'],
@@ -1430,9 +1438,16 @@ class DiffResource(WebAPIResource):
                 'type': str,
                 'description': 'A list of revision identifiers, e.g. 12345 56789 34567',
             },
+            'async': {
+                'type': bool,
+                'description': 'Whether the diff of the given revisions '
+                               'should be created in the background. If '
+                               'set, a post-commit job is returned right '
+                               'away instead of the diff.',
+            },
         }
     )
-    def create(self, request, *args, **kwargs):
+    def create(self, request, async=False, *args, **kwargs):
         """Creates a new diff by parsing an uploaded diff file.
 
         This will implicitly create the new Review Request draft, which can
@@ -1463,6 +1478,12 @@ class DiffResource(WebAPIResource):
 
             <Unified Diff Content Here>
             -- SoMe BoUnDaRy --
+
+        Post-commit diffs of large revisions can take a while to create.
+        If ``async`` is set along with ``revisions``, the diff is created by
+        a background worker instead. The response then contains the queued
+        post-commit job, which reports the progress of the diff creation.
+        The diff is attached to the draft once the job is done.
         """
         try:
             review_request = \
@@ -1479,6 +1500,15 @@ class DiffResource(WebAPIResource):
         if not form.is_valid():
             return WebAPIResponseFormError(request, form)
 
+        if async and form.cleaned_data.get('revisions', '').strip():
+            job = PostCommitJob.objects.queue(
+                request.user, review_request,
+                form.cleaned_data['revisions'].replace(',', ' ').split())
+
+            return 201, {
+                post_commit_job_resource.item_result_key: job,
+            }
+
         try:
             if 'path' in request.FILES:
                 error_field = 'path'
@@ -1540,6 +1570,8 @@ class DiffResource(WebAPIResource):
         if discarded_diffset:
             discarded_diffset.delete()
 
+        DiffSetWarmUp.objects.queue(diffset)
+
         # E-mail gets sent when the draft is saved.
 
         return 201, {
@@ -1549,6 +1581,99 @@ class DiffResource(WebAPIResource):
 diffset_resource = DiffResource()
 
 
+class PostCommitJobResource(WebAPIResource):
+    """Provides information on queued creations of post-commit diffs.
+
+    A job is queued when a post-commit diff is requested with ``async``.
+    Clients can poll the job to follow the progress of the diff creation.
+    Once the job is ``done``, the diff is available on the review request.
+    """
+    model = PostCommitJob
+    name = 'post_commit_job'
+    fields = {
+        'id': {
+            'type': int,
+            'description': 'The numeric ID of the job.',
+        },
+        'revisions': {
+            'type': str,
+            'description': 'The revisions to create the diff of, separated '
+                           'by spaces.',
+        },
+        'status': {
+            'type': ('queued', 'running', 'done', 'failed'),
+            'description': 'The current status of the job.',
+        },
+        'files_fetched': {
+            'type': int,
+            'description': 'The number of files fetched from the repository '
+                           'so far.',
+        },
+        'files_total': {
+            'type': int,
+            'description': 'The total number of files to fetch. This is 0 '
+                           'until the modified files are known.',
+        },
+        'error': {
+            'type': str,
+            'description': 'The error that made the job fail, if any.',
+        },
+        'time_added': {
+            'type': str,
+            'description': 'The date and time that the job was queued '
+                           '(in YYYY-MM-DD HH:MM:SS format).',
+        },
+        'last_updated': {
+            'type': str,
+            'description': 'The date and time that the job was last updated '
+                           '(in YYYY-MM-DD HH:MM:SS format).',
+        },
+    }
+    uri_object_key = 'job_id'
+    model_parent_key = 'review_request'
+    last_modified_field = 'last_updated'
+    allowed_methods = ('GET',)
+
+    _status_map = {
+        PostCommitJob.QUEUED: 'queued',
+        PostCommitJob.RUNNING: 'running',
+        PostCommitJob.DONE: 'done',
+        PostCommitJob.FAILED: 'failed',
+    }
+
+    def get_queryset(self, request, *args, **kwargs):
+        try:
+            review_request = \
+                review_request_resource.get_object(request, *args, **kwargs)
+        except ReviewRequest.DoesNotExist:
+            raise self.model.DoesNotExist
+
+        return self.model.objects.filter(review_request=review_request)
+
+    def has_access_permissions(self, request, job, *args, **kwargs):
+        return job.review_request.is_accessible_by(request.user)
+
+    def serialize_status_field(self, obj):
+        return self._status_map[obj.status]
+
+    @webapi_check_local_site
+    @webapi_response_errors(DOES_NOT_EXIST)
+    def get_list(self, *args, **kwargs):
+        """Returns the post-commit jobs of the review request."""
+        try:
+            return super(PostCommitJobResource, self).get_list(*args, **kwargs)
+        except self.model.DoesNotExist:
+            return DOES_NOT_EXIST
+
+    @webapi_check_local_site
+    @augment_method_from(WebAPIResource)
+    def get(self, *args, **kwargs):
+        """Returns the status and progress of a post-commit job."""
+        pass
+
+post_commit_job_resource = PostCommitJobResource()
+
+
 class BaseWatchedObjectResource(WebAPIResource):
     """A base resource for objects watched by a user."""
     watched_resource = None
@@ -5522,6 +5647,7 @@ class ReviewRequestResource(WebAPIResource):
     item_child_resources = [
         change_resource,
         diffset_resource,
+        post_commit_job_resource,
         review_request_draft_resource,
         review_request_last_update_resource,
         review_resource,
@@ -6329,6 +6455,7 @@ register_resource_for_model(
 register_resource_for_model(DiffSet, diffset_resource)
 register_resource_for_model(FileDiff, filediff_resource)
 register_resource_for_model(Group, review_group_resource)
+register_resource_for_model(PostCommitJob, post_commit_job_resource)
 register_resource_for_model(Repository, repository_resource)
 register_resource_for_model(
     Review,